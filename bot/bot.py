@@ -27,6 +27,7 @@ from .scheduling.timedTask import TimedTask
 from .scheduling.timedTaskHeap import TimedTaskHeap
 from bot.scheduling import timedTaskHeap
 from .reactionMenus import reactionMenu
+from .game import cardStore, deckRendering
 
 
 async def checkForUpdates():
@@ -43,6 +44,13 @@ async def checkForUpdates():
                   versionInfo.BASED_REPO_URL + " for instructions on how to update your BASED fork.")
 
 
+def logLoopLag(lag: float):
+    """Log that the event loop was blocked for at least cfg.loopLagWarnSeconds.
+    """
+    botState.logger.log("Main", "loopLag", "Event loop ran " + str(round(lag * 1000)) + "ms late",
+                        eventType="LOOP_LAG", noPrint=True)
+
+
 async def initializeEmojis():
     """Converts all of the expected emoji config vars from UninitializedBasedEmoji to BasedEmoji.
     Throws errors if initialization of any emoji failed.
@@ -206,6 +214,7 @@ class BasedClient(ClientBaseClass):
                 game.shutdownOverrideReason = "The bot is shutting down"
 
         botState.taskScheduler.stopTaskChecking()
+        botState.loopLagMonitor.stop()
         if self.storeMenus:
             # expire non-saveable reaction menus
             menus = list(botState.reactionMenusDB.values())
@@ -218,6 +227,7 @@ class BasedClient(ClientBaseClass):
         await self.logout()
         # save bot save data
         self.saveAllDBs()
+        cardStore.flushStore()
         await botState.httpClient.close()
         print(datetime.now().strftime("%H:%M:%S: Shutdown complete."))
         # close the bot's aiohttp session
@@ -347,6 +357,12 @@ async def on_ready():
     else:
         raise ValueError("Unsupported cfg.timedTaskCheckingType: " + str(cfg.timedTaskCheckingType))
 
+    # Measure how long the event loop is blocked for, see the loop-lag dev command. on_ready is called again on reconnect
+    if botState.loopLagMonitor is None:
+        botState.loopLagMonitor = lib.loopLag.LoopLagMonitor(interval=cfg.loopLagCheckSeconds, threshold=cfg.loopLagWarnSeconds,
+                                                                onLag=logLoopLag)
+    botState.loopLagMonitor.start()
+
     # Set help embed thumbnails
     setHelpEmbedThumbnails()
 
@@ -560,6 +576,9 @@ def run():
     if cfg.botToken_envVarName and cfg.botToken_envVarName not in os.environ:
         raise KeyError("Bot token environment variable " + cfg.botToken_envVarName + " not set (cfg.botToken_envVarName")
 
+    # Card rendering processes are forked now, before the client starts any threads
+    deckRendering.startRenderPool()
+
     # Launch the bot!! 🤘🚀
     botState.client.run(cfg.botToken if cfg.botToken else os.environ[cfg.botToken_envVarName])
     return botState.shutdown
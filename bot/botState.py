@@ -18,4 +18,5 @@ dbSaveTT = None
 updatesCheckTT = None
 
 taskScheduler = None
+loopLagMonitor = None
 logger: Logger = None
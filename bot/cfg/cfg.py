@@ -49,6 +49,11 @@ timeouts = {
     "sdbPlayerSelectorSeconds": 300,
     # The time to wait for a new deck name message in cmd_rename
     "deckRenameSeconds": 180,
+    # Number of seconds to wait for a deck's spreadsheet to be read before giving up on creating or updating the deck
+    "deckIngestionSeconds": 120,
+    # Number of seconds to wait for each request to the Google Sheets and Drive APIs. Requests that time out free their
+    # deck ingestion thread, see deckIngestionSeconds
+    "sheetsRequestSeconds": 30,
     # The minimum amount of time that must pass between updates of a specific deck
     "deckUpdateCooldown": {"minutes": 2},
     # The default amount of time a poll will run for
@@ -131,6 +136,14 @@ developers = [188618589102669826, 144137708711837696]
 # Number of cards to distribute to each player per round
 cardsPerHand = 7
 
+# Maximum number of card slot messages to edit at once when dealing cards
+maxConcurrentCardEdits = 10
+
+# Maximum number of deck spreadsheets to read at once. Further deck creations and updates wait for a free slot.
+maxConcurrentDeckIngestions = 4
+# Maximum size in bytes of spreadsheet files attached to deck create and update commands
+maxDeckFileBytes = 8000000
+
 # Fall back image for the backs of cards in case none are included in the deck
 emptyWhiteCard = "https://cdn.discordapp.com/attachments/793470493197729853/793470535039320084/emptyCard.png"
 emptyBlackCard = emptyWhiteCard
@@ -147,6 +160,15 @@ cardsDCChannel = {"guild_id": 733652363235033088,
 
 # Can be either "local" or "discord"
 cardStorageMethod = "discord"
+# Maximum number of messages to upload card images in at once, when cardStorageMethod is "discord"
+maxConcurrentUploads = 3
+# Maximum total size in bytes of the images uploaded in a single message
+maxUploadBytesPerMessage = 8000000
+# Maximum number of times to retry an upload that was rate limited
+maxUploadRetries = 5
+# Number of seconds to wait after cards are rendered as they are drawn, before saving the card store index.
+# Every card rendered in that time is saved together
+cardStoreSaveDelaySeconds = 10
 
 # Exactly one of botToken or botToken_envVarName must be given.
 # botToken contains a string of your bot token
@@ -158,11 +180,56 @@ botToken_envVarName = "SDB_BOT_TOKEN"
 submissionsPresentationMethod = "merged"
 # Number of cards to display per line on an merged image of all of a player's submitted cards
 mergedSubmissionsMenu_lineLength = 3
+# Maximum number of players' merged submissions images to build at once
+maxConcurrentSubmissionMerges = 6
 
 # Font size of main text to render on cards
 cardContentFontSize = 90
 # Font size of smaller text to render on cards
 cardTitleFontSize = 40
+# Number of processes to render new decks with. 0 uses one process per CPU core
+cardRenderProcesses = 0
+# Maximum number of text measurements to remember per font and size in each card rendering process
+fontMeasurementCacheSize = 65536
+# Minimum number of seconds between updates to the progress message shown while rendering a new deck
+renderProgressIntervalSeconds = 2
+# Create new decks without rendering any cards. Each card is rendered the first time it is drawn,
+# and the rest of the expansions in play are rendered in the background during games
+lazyCardRendering = False
+# Number of cards to render at a time when rendering lazy decks in the background
+lazyPrerenderBatchSize = 25
+# Store the cards of new decks in card sheets holding many cards each, rather than one image per card.
+# Each card is cropped out of its sheet and stored on its own the first time it is drawn
+cardAtlasStorage = False
+# Number of columns and rows of cards in each card sheet. Sheets must fit within Discord's attachment size limit
+cardAtlasColumns = 4
+cardAtlasRows = 4
+
+# Encoder profiles for images encoded by the bot. Each profile gives a PIL image format under "format", and PIL save options
+imageEncoderProfiles = {
+    "jpeg": {"format": "JPEG", "quality": 85, "optimize": True},
+    "progressive-jpeg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "png": {"format": "PNG", "optimize": True}
+}
+# Name of the encoder profile for card images uploaded to discord: each card of a deck, card sheets, and cards cropped out of them.
+# Cards stored locally keep the renderer's cardRenderer["IMG_FORMAT"]
+cardEncoderProfile = "jpeg"
+# Name of the encoder profile for merged submissions images
+mergedSubmissionEncoderProfile = "jpeg"
+# Scale to deliver card images uploaded to discord, card sheets, cropped cards and merged submissions at, relative to cardRenderer["CARD_SIZE"]
+cardDeliveryScale = 1.0
+# Number of threads to decode, merge and encode card images with, off the event loop. 0 uses one thread per CPU core.
+# Threads beyond the number of cores compete with the event loop for the GIL
+imageWorkerThreads = 0
+# Maximum memory in bytes to keep decoded card images and card sheets in, so that cards submitted often are not loaded every round.
+# A decoded image takes 4 bytes per pixel, so a 4x4 card sheet takes 16 times as much as a card
+cardImageCacheBytes = 400000000
+
+# Number of seconds between measurements of how late the event loop is to run tasks
+loopLagCheckSeconds = 0.25
+# Event loop lag in seconds at or above which a warning is logged
+loopLagWarnSeconds = 0.1
 
 # Default number of options to present in a PagedReactionMenu
 defaultOptionsPerPage = 5
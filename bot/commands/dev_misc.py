@@ -1,9 +1,14 @@
 import discord
 import traceback
+import asyncio
+import os
+import tempfile
 from datetime import datetime
 
 from . import commandsDB as botCommands
 from .. import botState, lib
+from ..cfg import cfg
+from ..game import cardImages, deckValidation, sdbDeck
 
 from . import util_help
 
@@ -90,4 +95,142 @@ async def dev_cmd_reset_has_poll(message : discord.Message, args : str, isDM : b
         botState.usersDB.getUser(int(args.lstrip("<@!").rstrip(">"))).pollOwned = False
     await message.channel.send("Done!")
 
-botCommands.register("reset-has-poll", dev_cmd_reset_has_poll, 2, allowDM=True, useDoc=True)
\ No newline at end of file
+botCommands.register("reset-has-poll", dev_cmd_reset_has_poll, 2, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_benchmark_encoders(message: discord.Message, args: str, isDM: bool):
+    """developer command encoding the attached card images with every profile in cfg.imageEncoderProfiles,
+    and reporting the mean size and encode time of a card with each profile.
+    Cards are resized to cfg.cardDeliveryScale before encoding.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: ignored
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    if not message.attachments:
+        await message.channel.send(":x: Please attach some card images to encode!")
+        return
+
+    images = [await lib.imageWorkers.decodeImage(await attachment.read()) for attachment in message.attachments]
+    results = await lib.imageWorkers.runImageTask(lib.imageEncoding.benchmarkProfiles, images, cfg.imageEncoderProfiles, cfg.cardDeliveryScale)
+    for im in images:
+        im.close()
+
+    await message.channel.send("\n".join("**" + profileName + "**: " + str(round(meanBytes / 1000, 1)) + "KB, "
+                                            + str(round(meanMillis, 1)) + "ms per card"
+                                            for profileName, (meanBytes, meanMillis) in results.items()))
+
+botCommands.register("benchmark-encoders", dev_cmd_benchmark_encoders, 3, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_benchmark_snapshots(message: discord.Message, args: str, isDM: bool):
+    """developer command comparing the time to load a deck by parsing its meta JSON, against loading its snapshot.
+    Give the name of a deck in this server to benchmark it, or nothing to benchmark a made up 50,000 card, 40 expansion deck.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: the name of the deck to benchmark, or nothing
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    loop = asyncio.get_event_loop()
+    if args:
+        if isDM or args not in botState.guildsDB.getGuild(message.guild.id).decks:
+            await message.channel.send(":x: Unknown deck: " + args)
+            return
+        results = await loop.run_in_executor(None, sdbDeck.benchmarkCatalogLoad, botState.guildsDB.getGuild(message.guild.id).decks[args]["meta_path"])
+    else:
+        with tempfile.TemporaryDirectory() as benchmarkDir:
+            metaPath = benchmarkDir + os.sep + "benchmark.json"
+            lib.jsonHandler.writeJSON(metaPath, sdbDeck.syntheticDeckMeta(40, 50000))
+            results = await loop.run_in_executor(None, sdbDeck.benchmarkCatalogLoad, metaPath)
+
+    await message.channel.send("Mean of 10 loads: JSON parse and build " + str(round(results["json"], 1)) + "ms, snapshot load "
+                                + str(round(results["snapshot"], 1)) + "ms, snapshot load unpacking every expansion "
+                                + str(round(results["snapshotAllExpansions"], 1)) + "ms")
+
+botCommands.register("benchmark-snapshots", dev_cmd_benchmark_snapshots, 3, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_benchmark_validation(message: discord.Message, args: str, isDM: bool):
+    """developer command timing deck validation on made up decks, with 120 expansions and 50,000 cards,
+    and with 400 expansions and 200,000 cards. Give a number of expansions and cards to benchmark that size instead.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: a number of expansions and a number of cards, separated by a space, or nothing
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    if args:
+        try:
+            sizes = [tuple(int(arg) for arg in args.split(" "))]
+            if len(sizes[0]) != 2 or min(sizes[0]) < 1:
+                raise ValueError()
+        except ValueError:
+            await message.channel.send(":x: Please give a number of expansions and a number of cards!")
+            return
+    else:
+        sizes = [(120, 50000), (400, 200000)]
+
+    loop = asyncio.get_event_loop()
+    lines = []
+    for numExpansions, numCards in sizes:
+        fastest = await loop.run_in_executor(None, deckValidation.benchmarkValidation, numExpansions, numCards)
+        lines.append(str(numExpansions) + " expansions, " + str(numCards) + " cards: " + str(round(fastest, 1)) + "ms (best of 5)")
+    await message.channel.send("\n".join(lines))
+
+botCommands.register("benchmark-validation", dev_cmd_benchmark_validation, 3, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_benchmark_sheets_auth(message: discord.Message, args: str, isDM: bool):
+    """developer command timing the authorization of a Google Sheets client, which is done when the first deck is read
+    rather than at startup.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: ignored
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    fastest = await asyncio.get_event_loop().run_in_executor(None, sdbDeck.benchmarkSheetsAuthorization)
+    await message.channel.send("Google Sheets client authorization: " + str(round(fastest, 1)) + "ms (best of 5)")
+
+botCommands.register("benchmark-sheets-auth", dev_cmd_benchmark_sheets_auth, 3, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_loop_lag(message: discord.Message, args: str, isDM: bool):
+    """developer command reporting how late the event loop has been to run tasks, as measured by botState.loopLagMonitor.
+    Lag of cfg.loopLagWarnSeconds or more is also logged as it happens.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: ignored
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    monitor = botState.loopLagMonitor
+    if monitor is None:
+        await message.channel.send("The loop lag monitor isn't running yet.")
+        return
+    stats = monitor.stats()
+    await message.channel.send("Over the last " + str(round(stats["samples"] * monitor.interval)) + "s: mean "
+                                + str(round(stats["mean"] * 1000, 1)) + "ms, p99 " + str(round(stats["p99"] * 1000, 1))
+                                + "ms, max " + str(round(stats["max"] * 1000, 1)) + "ms\nSince startup: max "
+                                + str(round(monitor.maxLag * 1000, 1)) + "ms, " + str(monitor.numLagging) + " lags of "
+                                + str(round(monitor.threshold * 1000)) + "ms or more")
+
+botCommands.register("loop-lag", dev_cmd_loop_lag, 3, allowDM=True, useDoc=True)
+
+
+async def dev_cmd_image_cache(message: discord.Message, args: str, isDM: bool):
+    """developer command reporting the size and hit rate of the decoded card image cache.
+    Give 'clear' to empty the cache.
+
+    :param discord.Message message: the discord message calling the command
+    :param str args: 'clear' to empty the cache, or nothing
+    :param bool isDM: Whether or not the command is being called from a DM channel
+    """
+    cache = cardImages.getCache()
+    if args.lower() == "clear":
+        cache.clear()
+    stats = cache.stats()
+    loads = stats["hits"] + stats["misses"]
+    await message.channel.send(str(stats["images"]) + " images, " + str(round(stats["currentBytes"] / 1000000, 1)) + "MB of "
+                                + str(round(stats["maxBytes"] / 1000000, 1)) + "MB\n" + str(stats["hits"]) + " hits, "
+                                + str(stats["misses"]) + " misses" + (" (" + str(round(stats["hits"] * 100 / loads)) + "% hit rate)" if loads else "")
+                                + ", " + str(stats["evictions"]) + " evictions")
+
+botCommands.register("image-cache", dev_cmd_image_cache, 3, allowDM=True, useDoc=True)
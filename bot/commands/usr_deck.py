@@ -13,7 +13,7 @@ from .. import botState, lib
 from ..reactionMenus import SDBExpansionsPicker, reactionMenu
 from ..cfg import cfg
 from ..scheduling import timedTask
-from ..game import sdbGame, sdbDeck
+from ..game import sdbGame, sdbDeck, deckSnapshot, deckSources, deckValidation, deckRendering, cardStore, lazyRendering, cardAtlas
 from ..users.basedGuild import BasedGuild
 
 import os
@@ -49,20 +49,34 @@ async def cmd_add_deck(message : discord.Message, args : str, isDM : bool):
 
 
 async def cmd_create(message : discord.Message, args : str, isDM : bool):
-    if not args:
-        await message.channel.send(":x: Please give a public google spreadsheet link to your deck to add.")
+    if not args and not message.attachments:
+        await message.channel.send(":x: Please give a public google spreadsheet link to your deck to add, or attach a spreadsheet file (" \
+                                    + ", ".join(deckSources.supportedExtensions()) + ").")
         return
 
     callingBGuild = botState.guildsDB.getGuild(message.guild.id)
     loadingMsg = await message.channel.send("Reading spreadsheet... " + cfg.defaultEmojis.loading.sendable)
 
     try:
-        gameData = sdbDeck.collect_cards(args)
+        revision = None
+        if args:
+            # Read before the cells, so that edits made while the deck is being created are picked up by the next update
+            revision = await sdbDeck.fetchSheetRevision(args)
+            gameData = await sdbDeck.fetchCards(args)
+        else:
+            gameData = await sdbDeck.fetchCardsFromAttachment(message.attachments[0])
         await loadingMsg.edit(content="Reading spreadsheet... " + cfg.defaultEmojis.submit.sendable)
     except sdbDeck.gspread.SpreadsheetNotFound:
         await message.channel.send(":x: Unrecognised spreadsheet! Please make sure the file exists and is public.")
         return
+    except deckSources.DeckFileError as e:
+        await message.channel.send(":x: " + str(e))
+        return
+    except asyncio.TimeoutError:
+        await message.channel.send(":x: Reading your spreadsheet took too long! Please try again later.")
+        return
     else:
+        digest = sdbDeck.cardDataDigest(gameData)
         if gameData["title"] == "":
             await message.channel.send(":x: Your deck does not have a name! Please name the spreadsheet and try again.")
             return
@@ -75,82 +89,88 @@ async def cmd_create(message : discord.Message, args : str, isDM : bool):
             await message.channel.send(":x: A deck already exists in this server with the name '" + gameData["title"] + "' - cannot add deck.")
             return
 
-        lowerExpansions = [expansion.lower() for expansion in gameData["expansions"]]
-        for expansion in lowerExpansions:
-            if lowerExpansions.count(expansion) > 1:
-                await message.channel.send(":x: Deck creation failed - duplicate expansion pack name found: " + expansion)
-                return
-        
-        unnamedFound = False
-        emptyExpansions = []
-        for expansion in gameData["expansions"]:
-            if expansion == "":
-                unnamedFound = True
-            if len(gameData["expansions"][expansion]["white"]) == 0 and len(gameData["expansions"][expansion]["black"]) == 0:
-                emptyExpansions.append(expansion)
-
-        errs = ""
-        
-        if unnamedFound:
-            errs += "\nUnnamed expansion pack detected - skipping this expansion."
-            del gameData["expansions"][""]
-
-        if len(emptyExpansions) != 0:
-            errs += "\nEmpty expansion packs detected - skipping these expansions: " + ", ".join(expansion for expansion in emptyExpansions)
-            for expansion in emptyExpansions:
-                del gameData["expansions"][expansion]
-
-        whiteCounts = {}
-        blackCounts = {}
-        for expansion in gameData["expansions"]:
-            whiteCounts[expansion] = len(gameData["expansions"][expansion]["white"])
-            blackCounts[expansion] = len(gameData["expansions"][expansion]["black"])
-            indicesToRemove = []
-            for cardNum, cardText in enumerate(gameData["expansions"][expansion]["black"]):
-                if "_" not in cardText:
-                    indicesToRemove.append(cardNum)
-            if indicesToRemove:
-                errs += "\nIgnoring " + str(len(indicesToRemove)) + " black cards from " + expansion + " expansion with no white card slots (`_`)."
-                for i in indicesToRemove:
-                    gameData["expansions"][expansion]["black"].pop(i)
-        
-        if errs != "":
-            await message.channel.send(errs)
-
-        totalWhite = sum(whiteCounts.values())
-        totalBlack = sum(blackCounts.values())
-        
-        if int(totalWhite / cfg.cardsPerHand) < 2:
-            await message.channel.send("Deck creation failed.\nDecks must have at least " + str(2 * cfg.cardsPerHand) + " white cards.")
-            return
-        if totalBlack == 0:
-            await message.channel.send("Deck creation failed.\nDecks must have at least 1 black card.")
+        report = deckValidation.validateCardData(gameData)
+        if report.warnings:
+            await message.channel.send("\n".join(report.warnings))
+        if not report.isValid:
+            await message.channel.send(":x: Deck creation failed.\n" + "\n".join(report.errors))
             return
+        gameData = report.cardData
 
-        loadingMsg = await message.channel.send("Drawing cards... " + cfg.defaultEmojis.loading.sendable)
-        deckMeta = await make_cards.render_all(cfg.paths.decksFolder, gameData, cfg.paths.cardFont, message.guild.id, contentFontSize=cfg.cardContentFontSize, titleFontSize=cfg.cardTitleFontSize)
-        if cfg.cardStorageMethod == "discord":
-            deckMeta = await make_cards.store_cards_discord(cfg.paths.decksFolder, deckMeta,
-                                                            botState.client.get_guild(cfg.cardsDCChannel["guild_id"]).get_channel(cfg.cardsDCChannel["channel_id"]),
-                                                            message)
-        elif cfg.cardStorageMethod == "local":
-            deckMeta = make_cards.store_cards_local(deckMeta)
+        store = cardStore.getStore()
+        metaPath = cfg.paths.decksFolder + os.sep + str(message.guild.id) + os.sep + str(hash(gameData["title"])) + ".json"
+        if cfg.lazyCardRendering:
+            # Cards are rendered as they are drawn, see lazyRendering
+            deckMeta = lazyRendering.buildLazyMeta(gameData)
         else:
-            raise ValueError("Unsupported cfg.cardStorageMethod: " + str(cfg.cardStorageMethod))
+            loadingMsg = await message.channel.send("Drawing cards... " + cfg.defaultEmojis.loading.sendable)
+            lastProgressEdit = datetime.utcnow()
+
+            async def showRenderProgress(expansionsDone, numExpansions):
+                nonlocal lastProgressEdit
+                # Limit progress edits to avoid being rate limited on decks with many small expansions
+                if expansionsDone < numExpansions and (datetime.utcnow() - lastProgressEdit).total_seconds() >= cfg.renderProgressIntervalSeconds:
+                    lastProgressEdit = datetime.utcnow()
+                    await loadingMsg.edit(content="Drawing cards... " + str(expansionsDone) + "/" + str(numExpansions) + " expansions " + cfg.defaultEmojis.loading.sendable)
+
+            # Cards already rendered for any other deck are reused from the card store
+            cardsToRender, storedCards = store.splitStored(gameData, metaPath)
+            try:
+                deckMeta = await deckRendering.renderDeck(cardsToRender, message.guild.id, progress=showRenderProgress)
+                if cfg.cardAtlasStorage:
+                    deckMeta = make_cards.store_cards_local(deckMeta)
+                    sdbDeck.hashDeckCards(deckMeta)
+                    await cardAtlas.packDeckAtlases(deckMeta)
+                    if cfg.cardStorageMethod == "discord":
+                        # Card backs are not packed into sheets, so are still local images
+                        await cardStore.uploadDeckCards(deckMeta)
+                elif cfg.cardStorageMethod == "discord":
+                    async def showUploadProgress(cardsDone, numCards):
+                        nonlocal lastProgressEdit
+                        if cardsDone < numCards and (datetime.utcnow() - lastProgressEdit).total_seconds() >= cfg.renderProgressIntervalSeconds:
+                            lastProgressEdit = datetime.utcnow()
+                            await loadingMsg.edit(content="Drawing cards... uploaded " + str(cardsDone) + "/" + str(numCards) + " cards " + cfg.defaultEmojis.loading.sendable)
+
+                    # Cards are uploaded several to a message, rather than one message per card
+                    deckMeta = make_cards.store_cards_local(deckMeta)
+                    await cardStore.uploadDeckCards(deckMeta, progress=showUploadProgress)
+                elif cfg.cardStorageMethod == "local":
+                    deckMeta = make_cards.store_cards_local(deckMeta)
+                else:
+                    raise ValueError("Unsupported cfg.cardStorageMethod: " + str(cfg.cardStorageMethod))
 
-        await loadingMsg.edit(content="Drawing cards... " + cfg.defaultEmojis.submit.sendable)
-        
-        deckMeta["spreadsheet_url"] = args
-        metaPath = cfg.paths.decksFolder + os.sep + str(message.guild.id) + os.sep + str(hash(gameData["title"])) + ".json"
+                await loadingMsg.edit(content="Drawing cards... " + cfg.defaultEmojis.submit.sendable)
+            except deckRendering.RenderError as e:
+                store.releaseDeck(metaPath)
+                await message.channel.send(":x: Deck creation failed. " + str(e))
+                return
+            except BaseException:
+                # The deck was never created, so does not keep the stored cards
+                store.releaseDeck(metaPath)
+                raise
+            cardStore.mergeStored(deckMeta, storedCards)
+
+        deckMeta["spreadsheet_url"] = args if args else message.attachments[0].url
+        sdbDeck.hashDeckCards(deckMeta)
+        store.syncDeck(metaPath, deckMeta)
+        cardStore.saveStore()
+        deckMeta["stats"] = sdbDeck.buildDeckStats(deckMeta)
         lib.jsonHandler.writeJSON(metaPath, deckMeta)
+        sdbDeck.saveSnapshot(metaPath, deckMeta)
         now = datetime.utcnow()
-        callingBGuild.decks[deckMeta["deck_name"].lower()] = {"meta_path": metaPath, "creator": message.author.id, "last_update" : now.timestamp(), "plays": 0,
-                                                            "expansions" : {expansion: (whiteCounts[expansion], blackCounts[expansion]) for expansion in whiteCounts}, "spreadsheet_url": args, "white_count": totalWhite, "black_count": totalBlack,
-                                                            "updating": False}
+        deckRecord = {"meta_path": metaPath, "creator": message.author.id, "last_update" : now.timestamp(), "plays": 0,
+                        "spreadsheet_url": deckMeta["spreadsheet_url"], "source": "sheets" if args else "file", "content_digest": digest, "updating": False}
+        if revision is not None:
+            deckRecord["sheet_revision"] = revision
+            deckRecord["render_settings_digest"] = sdbDeck.renderSettingsDigest()
+        if cfg.lazyCardRendering:
+            deckRecord["lazy"] = True
+        sdbDeck.applyDeckStats(deckRecord, deckMeta["stats"])
+        callingBGuild.decks[deckMeta["deck_name"].lower()] = deckRecord
 
         await message.channel.send("✅ Deck added: " + gameData["title"])
 
-botCommands.register("create", cmd_create, 0, allowDM=False, helpSection="decks", signatureStr="**create <spreadsheet link>**", forceKeepArgsCasing=True, shortHelp="Add a new deck to the server. Your cards must be given in a **public** google spreadsheet link.", longHelp="Add a new deck to the server. You must provide a link to a **public** google spreadsheet containing your new deck's cards.\n\n- Each sheet in the spreadsheet is an expansion pack\n- The **A** column of each sheet contains that expansion pack's white cards\n- The **B** columns contain black cards\n- Black cards should give spaces for white cards with **one underscore (_) per white card.**")
+botCommands.register("create", cmd_create, 0, allowDM=False, helpSection="decks", signatureStr="**create <spreadsheet link>**", forceKeepArgsCasing=True, shortHelp="Add a new deck to the server. Your cards must be given in a **public** google spreadsheet link, or an attached spreadsheet file.", longHelp="Add a new deck to the server. You must provide a link to a **public** google spreadsheet containing your new deck's cards, or attach a CSV, XLSX or ODS spreadsheet file.\n\n- Each sheet in the spreadsheet is an expansion pack\n- The **A** column of each sheet contains that expansion pack's white cards\n- The **B** columns contain black cards\n- Black cards should give spaces for white cards with **one underscore (_) per white card.**")
 
 
 async def cmd_start_game(message : discord.Message, args : str, isDM : bool):
@@ -171,17 +191,14 @@ async def cmd_start_game(message : discord.Message, args : str, isDM : bool):
         await message.channel.send(":x: This deck is currently being updated!")
         return
 
-    if args in callingBGuild.activeDecks:
-        gameDeck = callingBGuild.activeDecks[args]
-    else:
-        try:
-            gameDeck = sdbDeck.SDBDeck(callingBGuild.decks[args]["meta_path"])
-        except RuntimeError as e:
-            gameDeck = None
-            await message.reply("An unexpected error occurred when building the deck, the error has been logged.\nPlease try playing with a different deck!")
-            botState.logger.log("usr_deck", "cmd_start_game",
-                                "Exception occured when trying to build a deck before starting a game",
-                                eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
+    try:
+        gameDeck = sdbDeck.loadCatalog(callingBGuild.decks[args]["meta_path"], callingBGuild.decks[args]["last_update"])
+    except RuntimeError as e:
+        gameDeck = None
+        await message.reply("An unexpected error occurred when building the deck, the error has been logged.\nPlease try playing with a different deck!")
+        botState.logger.log("usr_deck", "cmd_start_game",
+                            "Exception occured when trying to build a deck before starting a game",
+                            eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
     
     if gameDeck is not None:
         reservation = sdbGame.GameChannelReservation(gameDeck)
@@ -375,6 +392,9 @@ async def cmd_rename_deck(message : discord.Message, args : str, isDM : bool):
                 deckMeta = lib.jsonHandler.readJSON(callingBGuild.decks[newNameMsg.content]["meta_path"])
                 deckMeta["deck_name"] = newNameMsg.content
                 lib.jsonHandler.writeJSON(callingBGuild.decks[newNameMsg.content]["meta_path"], deckMeta)
+                sdbDeck.saveSnapshot(callingBGuild.decks[newNameMsg.content]["meta_path"], deckMeta)
+                # Catalogs are cached by last update time, which renaming does not change
+                sdbDeck.evictCatalog(callingBGuild.decks[newNameMsg.content]["meta_path"])
                 await newNameMsg.reply("✅ Deck renamed successfully!")
 
 
@@ -401,14 +421,17 @@ async def cmd_delete_deck(message : discord.Message, args : str, isDM : bool):
     
     if os.path.exists(callingBGuild.decks[args]["meta_path"]):
         os.remove(callingBGuild.decks[args]["meta_path"])
+    deckSnapshot.removeSnapshot(callingBGuild.decks[args]["meta_path"])
+    lazyRendering.cancelPrerender(callingBGuild.decks[args]["meta_path"])
+    # Stored card images are only deleted once no other deck uses them
+    cardStore.getStore().releaseDeck(callingBGuild.decks[args]["meta_path"])
+    cardStore.saveStore()
 
     cardsDir = os.path.splitext(callingBGuild.decks[args]["meta_path"])[0]
     if os.path.isdir(cardsDir):
         shutil.rmtree(cardsDir)
         
     del callingBGuild.decks[args]
-    if args in callingBGuild.activeDecks:
-        del callingBGuild.activeDecks[args]
 
     for channel in callingBGuild.runningGames:
         if callingBGuild.runningGames[channel].deck.name == args:
@@ -462,4 +485,4 @@ async def cmd_update_deck(message : discord.Message, args : str, isDM : bool):
         await sdbDeck.updateDeck(message, callingBGuild, args)
 
 
-botCommands.register("update", cmd_update_deck, 0, allowDM=False, signatureStr="**update <deck name>**", shortHelp="Update a deck that you own in this server with any changes to the spreadsheet.\nThis does not update the deck name.", helpSection="decks")
+botCommands.register("update", cmd_update_deck, 0, allowDM=False, signatureStr="**update <deck name>**", shortHelp="Update a deck that you own in this server with any changes to the spreadsheet. Decks created from a file must be updated by attaching the new file.\nThis does not update the deck name.", helpSection="decks")
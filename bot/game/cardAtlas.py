@@ -0,0 +1,157 @@
+import hashlib
+import os
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+from .. import lib
+from ..cfg import cfg
+from ..cardRenderer.lib import url_to_local_path, local_file_url, CARD_SIZE
+from . import cardImages, cardStore
+
+
+# Card sheets pack the cards of a new deck into a few large images, cfg.cardAtlasColumns by cfg.cardAtlasRows cards each,
+# instead of storing one image per card. Sheets are stored in ATLAS_FOLDER within the card store folder, or uploaded to
+# the card storage channel.
+# Cards from a sheet are recorded in deck metas and the card store with an empty URL, and an "atlas" entry holding the
+# sheet's URL and the card's crop box. Embeds need a URL for each card, so a card is cropped out of its sheet and stored
+# on its own the first time it is drawn, see lazyRendering.renderCards. Merged submissions crop cards straight out of
+# the sheet, see loadStoredCard.
+ATLAS_FOLDER = "atlases"
+
+
+def deliveryCardSize() -> Tuple[int, int]:
+    """Get the size that cards are delivered at, see cfg.cardDeliveryScale.
+    """
+    return lib.imageEncoding.scaleSize(CARD_SIZE, cfg.cardDeliveryScale)
+
+
+def cardImageExtension() -> str:
+    """Get the file extension of card sheets and cropped cards, from cfg.cardEncoderProfile.
+    """
+    return lib.imageEncoding.fileExtension(cfg.imageEncoderProfiles[cfg.cardEncoderProfile])
+
+
+def _buildSheet(imagePaths: List[str], columns: int, cardSize: Tuple[int, int], profile: dict) -> Tuple[bytes, List[List[int]]]:
+    """Paste card images into a single sheet at the given card size, and encode it. Run in the image worker pool.
+
+    :return: The encoded sheet, and the crop box of each card in the sheet
+    :rtype: Tuple[bytes, List[List[int]]]
+    """
+    columns = min(len(imagePaths), columns)
+    rows = (len(imagePaths) - 1) // columns + 1
+    sheet = Image.new("RGB", (cardSize[0] * columns, cardSize[1] * rows))
+    boxes = []
+    for cardNum, imagePath in enumerate(imagePaths):
+        x, y = cardSize[0] * (cardNum % columns), cardSize[1] * (cardNum // columns)
+        with Image.open(imagePath) as cardImage:
+            sheet.paste(cardImage if cardImage.size == cardSize else cardImage.resize(cardSize, Image.LANCZOS), (x, y))
+        boxes.append([x, y, x + cardSize[0], y + cardSize[1]])
+    sheetBytes = lib.imageEncoding.encodeImage(sheet, profile)
+    sheet.close()
+    return sheetBytes, boxes
+
+
+async def _storeImages(images: List[Tuple[str, bytes]]) -> List[str]:
+    """Store encoded images with the current cfg.cardStorageMethod. Uploaded images are sent several to a message.
+
+    :param images: The path to save each image to in local storage mode, relative to the card store folder, and the encoded image
+    :type images: List[Tuple[str, bytes]]
+    :return: The URL of each stored image
+    :rtype: List[str]
+    """
+    if cfg.cardStorageMethod == "discord":
+        return await cardStore.uploadFiles([(os.path.basename(storePath), imageBytes) for storePath, imageBytes in images])
+    elif cfg.cardStorageMethod == "local":
+        urls = []
+        for storePath, imageBytes in images:
+            imagePath = cardStore.storeFolder() + os.sep + storePath
+            os.makedirs(os.path.dirname(imagePath), exist_ok=True)
+            with open(imagePath, "wb") as imageFile:
+                imageFile.write(imageBytes)
+            urls.append(local_file_url(imagePath[len(cfg.paths.decksFolder):]))
+        return urls
+    else:
+        raise ValueError("Unsupported cfg.cardStorageMethod: " + str(cfg.cardStorageMethod))
+
+
+async def packDeckAtlases(deckMeta: dict):
+    """Pack the newly rendered cards of a deck meta into card sheets, and store the sheets.
+    Cards must be stored locally, as by make_cards.store_cards_local, and hashed, as by sdbDeck.hashDeckCards.
+    Each card's own image is deleted, its URL is emptied, and its sheet's URL and crop box are recorded under "atlas".
+    Cards with no URL are skipped.
+
+    :param dict deckMeta: The rendered deck meta
+    """
+    cards = [cardData for expansionData in deckMeta["expansions"].values() for colour in ("white", "black")
+                for cardData in (expansionData[colour] if colour in expansionData else []) if cardData["url"]]
+    cardsPerSheet = cfg.cardAtlasColumns * cfg.cardAtlasRows
+    # Sheets are built a group at a time, and each group is stored together so that uploads can share messages
+    sheetsPerGroup = lib.discordUtil.MAX_ATTACHMENTS_PER_MESSAGE * cfg.maxConcurrentUploads
+
+    for groupStart in range(0, len(cards), cardsPerSheet * sheetsPerGroup):
+        sheets = []
+        for sheetStart in range(groupStart, min(len(cards), groupStart + cardsPerSheet * sheetsPerGroup), cardsPerSheet):
+            sheetCards = cards[sheetStart:sheetStart + cardsPerSheet]
+            imagePaths = [cfg.paths.decksFolder + os.sep + url_to_local_path(cardData["url"]) for cardData in sheetCards]
+            sheetBytes, boxes = await lib.imageWorkers.runImageTask(_buildSheet, imagePaths, cfg.cardAtlasColumns, deliveryCardSize(),
+                                                                    cfg.imageEncoderProfiles[cfg.cardEncoderProfile])
+            # Sheets are named after the cards they hold, so a sheet is never stored twice
+            sheetName = hashlib.blake2b("".join(cardData["hash"] for cardData in sheetCards).encode(), digest_size=16).hexdigest()
+            sheets.append((sheetCards, imagePaths, boxes, ATLAS_FOLDER + os.sep + sheetName + "." + cardImageExtension(), sheetBytes))
+
+        sheetURLs = await _storeImages([(storePath, sheetBytes) for _, _, _, storePath, sheetBytes in sheets])
+        for (sheetCards, imagePaths, boxes, _, _), sheetURL in zip(sheets, sheetURLs):
+            for cardData, box, imagePath in zip(sheetCards, boxes, imagePaths):
+                cardData["atlas"] = {"url": sheetURL, "box": box}
+                cardData["url"] = ""
+                os.remove(imagePath)
+
+
+async def cropCard(atlas: dict) -> Image.Image:
+    """Crop a card out of its card sheet.
+
+    :param dict atlas: The card's "atlas" entry
+    :return: A new image of the card
+    :rtype: Image.Image
+    """
+    # Sheets are kept decoded in the card image cache
+    sheet = await cardImages.loadCardImage(atlas["url"])
+    return await lib.imageWorkers.runImageTask(sheet.crop, tuple(atlas["box"]))
+
+
+async def loadStoredCard(text: str, isBlack: bool) -> Image.Image:
+    """Get the image of a card stored in a card sheet, cropped out of the cached sheet.
+    Cards that have already been stored on their own, see materialiseCards, should be loaded from their own URL instead:
+    a whole sheet is many times the size of a card, so decoding sheets for single cards fills the card image cache.
+
+    :param str text: The text of the card
+    :param bool isBlack: Whether the card is a black card
+    :return: A new image of the card, or None if the card is not stored in a card sheet, or has been stored on its own
+    :rtype: Image.Image or None
+    :raise IOError: If the card sheet could not be downloaded
+    """
+    entry = cardStore.getStore().lookup(cardStore.cardHash(text, isBlack))
+    if entry is None or "atlas" not in entry or entry["url"]:
+        return None
+    return await cropCard(entry["atlas"])
+
+
+async def materialiseCards(entries: Dict[str, dict]):
+    """Crop cards out of their card sheets and store each of them on its own, so that they can be shown in embeds.
+    The new URLs are recorded in the card store.
+
+    :param entries: The card store entries of the cards to store, by card hash
+    :type entries: Dict[str, dict]
+    """
+    store = cardStore.getStore()
+    images = []
+    for storedHash, entry in entries.items():
+        cardImage = await cropCard(entry["atlas"])
+        cardBytes = await lib.imageWorkers.encodeImage(cardImage, cfg.imageEncoderProfiles[cfg.cardEncoderProfile])
+        cardImage.close()
+        images.append((storedHash + "." + cardImageExtension(), cardBytes))
+
+    for storedHash, url in zip(entries.keys(), await _storeImages(images)):
+        store.setCardURL(storedHash, url)
+    cardStore.scheduleSave()
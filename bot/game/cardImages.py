@@ -0,0 +1,57 @@
+import os
+
+from PIL import Image
+
+from .. import botState, lib
+from ..cfg import cfg
+from ..cardRenderer.lib import url_to_local_path
+
+
+# Decoded card images and card sheets, by URL, shared by everything that draws with stored card images: merged submissions,
+# winning submissions, and cards cropped out of card sheets. Popular cards are decoded once, rather than every round.
+# Created on first use, see getCache
+_cache: lib.imageCache.DecodedImageCache = None
+
+
+def getCache() -> lib.imageCache.DecodedImageCache:
+    """Get the process-wide card image cache, holding up to cfg.cardImageCacheBytes of decoded images.
+    """
+    global _cache
+    if _cache is None:
+        _cache = lib.imageCache.DecodedImageCache(cfg.cardImageCacheBytes)
+    return _cache
+
+
+async def _fetchImage(url: str) -> Image.Image:
+    if cfg.cardStorageMethod == "local":
+        try:
+            return await lib.imageWorkers.openImageFile(cfg.paths.decksFolder + os.sep + url_to_local_path(url))
+        except FileNotFoundError:
+            # The image may have been stored under a different cardStorageMethod
+            pass
+
+    async with botState.httpClient.get(url) as resp:
+        if resp.status != 200:
+            raise IOError("Failed to download card image, status " + str(resp.status) + ": " + url)
+        return await lib.imageWorkers.decodeImage(await resp.read())
+
+
+async def loadCardImage(url: str) -> Image.Image:
+    """Get a decoded stored card image or card sheet, from the card image cache if it is there.
+    In local storage mode the image is read from disk, falling back to downloading it if there is no such file.
+
+    :param str url: The URL of the image
+    :return: The image. It is shared through the cache, so must not be modified or closed
+    :rtype: Image.Image
+    :raise IOError: If the image could not be downloaded
+    """
+    return await getCache().load(url, lambda: _fetchImage(url))
+
+
+def forgetCardImage(url: str):
+    """Remove an image from the card image cache, if it is cached. Call when a stored image is deleted.
+
+    :param str url: The URL of the image
+    """
+    if _cache is not None:
+        _cache.forget(url)
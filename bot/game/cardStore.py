@@ -0,0 +1,523 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import traceback
+from typing import Awaitable, Callable, Dict, List, Set, Tuple, Union
+
+from PIL import Image
+
+from .. import botState, lib
+from ..cfg import cfg
+from ..cardRenderer.lib import url_to_local_path, local_file_url, IMG_FORMAT
+from . import cardImages
+
+
+# The card store shares rendered card images between every deck in every guild.
+# Cards are keyed by cardHash, so two cards with the same text, colour and render settings share one stored image.
+# The store's index records, for each stored card, its URL and the meta paths of the decks using it. An image is only
+# deleted once no deck uses it. In local storage mode, stored images are moved out of their deck's folder into
+# STORE_FOLDER, so that deleting a deck's folder never deletes an image that another deck uses.
+# Cards stored in a card sheet, see cardAtlas, have an "atlas" entry holding the sheet's URL and the card's crop box.
+# Their URL is empty until the card is cropped out and stored on its own, the first time it is drawn.
+# A sheet is deleted once none of its cards are stored.
+# Store entries are replaced rather than modified, so that a shallow copy of the index can be written out by another thread,
+# see scheduleSave.
+STORE_FOLDER = "cardStore"
+_INDEX_FILE = "index.json"
+
+
+# The render settings last fingerprinted, and their fingerprint. Cards are hashed in passes over whole decks, so the fingerprint
+# is only serialised again when the settings change, see renderSettingsFingerprint
+_fingerprintedSettings: tuple = None
+_settingsFingerprint: str = None
+
+
+def renderSettingsFingerprint() -> str:
+    """Serialise everything besides card content that determines how cards are rendered: the font, font sizes,
+    and the renderer config.
+    configurator.init replaces cfg.cardRenderer with a ConfigProxy, which cannot be serialised directly.
+
+    :return: The current render settings, as a JSON string with sorted keys
+    :rtype: str
+    """
+    global _fingerprintedSettings, _settingsFingerprint
+    if isinstance(cfg.cardRenderer, dict):
+        rendererItems = tuple(cfg.cardRenderer.items())
+    else:
+        rendererItems = tuple((name, getattr(cfg.cardRenderer, name)) for name in cfg.cardRenderer.attrNames)
+    settings = (cfg.paths.cardFont, cfg.cardContentFontSize, cfg.cardTitleFontSize, rendererItems)
+    if settings != _fingerprintedSettings:
+        _settingsFingerprint = json.dumps({"cardFont": os.path.basename(cfg.paths.cardFont), "cardContentFontSize": cfg.cardContentFontSize,
+                                            "cardTitleFontSize": cfg.cardTitleFontSize, "cardRenderer": dict(rendererItems)}, sort_keys=True)
+        _fingerprintedSettings = settings
+    return _settingsFingerprint
+
+
+def cardHash(text: str, isBlack: bool) -> str:
+    """Hash everything that determines how a card is rendered: its text, its colour, the font and font sizes,
+    and the renderer config. Cards with equal hashes render identically, so a card only needs to be rendered once per hash.
+
+    :param str text: The text of the card
+    :param bool isBlack: Whether the card is a black card
+    :return: A hex digest of the card's content
+    :rtype: str
+    """
+    content = "\0".join((text, "black" if isBlack else "white", renderSettingsFingerprint()))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+class CardStore:
+    """An index of stored card images, with the decks that use each of them.
+
+    :var cards: Stored card data by card hash. Each entry holds the card's "url", the "storage" method it was stored with,
+                "requiredWhiteCards" for black cards, and "atlas" for cards stored in a card sheet
+    :vartype cards: Dict[str, dict]
+    :var decks: The hashes of the stored cards used by each deck, by deck meta path
+    :vartype decks: Dict[str, List[str]]
+    """
+
+    def __init__(self, cards: Dict[str, dict] = {}, decks: Dict[str, List[str]] = {}):
+        self.cards = dict(cards)
+        self.decks = dict(decks)
+        self._refCounts: Dict[str, int] = {storedHash: 0 for storedHash in self.cards}
+        for hashes in self.decks.values():
+            for storedHash in hashes:
+                self._refCounts[storedHash] += 1
+        # The number of stored cards in each card sheet, by sheet URL
+        self._atlasRefCounts: Dict[str, int] = {}
+        for entry in self.cards.values():
+            if "atlas" in entry:
+                self._atlasRefCounts[entry["atlas"]["url"]] = self._atlasRefCounts.get(entry["atlas"]["url"], 0) + 1
+
+
+    def lookup(self, storedHash: str) -> dict:
+        """Get the stored card data for a card hash.
+
+        :return: The card's stored data, or None if no image is stored for the hash with the current storage method
+        :rtype: dict or None
+        """
+        entry = self.cards.get(storedHash)
+        if entry is None or entry["storage"] != cfg.cardStorageMethod:
+            return None
+        return entry
+
+
+    def setCardURL(self, storedHash: str, url: str):
+        """Record the URL of a card from a card sheet, once it has been cropped out and stored on its own.
+        """
+        self.cards[storedHash] = dict(self.cards[storedHash], url=url)
+
+
+    def isStored(self, cardData: dict) -> bool:
+        """Decide whether a card from a deck meta uses an image in this store.
+        """
+        entry = self.cards.get(cardData["hash"]) if "hash" in cardData else None
+        if entry is None:
+            return False
+        if "atlas" in entry:
+            # Deck metas keep an empty URL for cards from card sheets, even once they have been stored on their own
+            return "atlas" in cardData and entry["atlas"]["url"] == cardData["atlas"]["url"]
+        return entry["url"] == cardData["url"]
+
+
+    def refCount(self, storedHash: str) -> int:
+        return self._refCounts.get(storedHash, 0)
+
+
+    def hasAtlasCards(self) -> bool:
+        """Decide whether any card in the store is stored in a card sheet.
+        """
+        return bool(self._atlasRefCounts)
+
+
+    def _adopt(self, storedHash: str, cardData: dict, isBlack: bool) -> bool:
+        """Add a newly rendered card to the store. In local storage mode, the card's image is moved into the store folder
+        and cardData's url is updated to match.
+
+        :return: True if the card was added to the store, False if its image could not be found
+        :rtype: bool
+        """
+        if "atlas" in cardData:
+            self._atlasRefCounts[cardData["atlas"]["url"]] = self._atlasRefCounts.get(cardData["atlas"]["url"], 0) + 1
+        elif cfg.cardStorageMethod == "local":
+            imagePath = cfg.paths.decksFolder + os.sep + url_to_local_path(cardData["url"])
+            if not os.path.isfile(imagePath):
+                return False
+            storePath = storeFolder() + os.sep + storedHash + "." + IMG_FORMAT
+            os.makedirs(storeFolder(), exist_ok=True)
+            shutil.move(imagePath, storePath)
+            cardData["url"] = local_file_url(storePath[len(cfg.paths.decksFolder):])
+
+        self.cards[storedHash] = {"url": cardData["url"], "storage": cfg.cardStorageMethod}
+        if "atlas" in cardData:
+            self.cards[storedHash]["atlas"] = cardData["atlas"]
+        if isBlack:
+            self.cards[storedHash]["requiredWhiteCards"] = cardData["requiredWhiteCards"]
+        self._refCounts[storedHash] = 0
+        return True
+
+
+    def _collectStored(self, deckMeta: dict) -> Set[str]:
+        """Add the newly rendered cards in a deck meta to the store, and get the hashes of every stored card in the meta.
+        Cards with no URL or card sheet have not been rendered yet, see lazyRendering, and are skipped.
+        """
+        deckHashes: Set[str] = set()
+        for expansionData in deckMeta["expansions"].values():
+            for colour in ("white", "black"):
+                for cardData in (expansionData[colour] if colour in expansionData else []):
+                    if not cardData["url"] and "atlas" not in cardData:
+                        continue
+                    if cardData["hash"] not in self.cards:
+                        if not self._adopt(cardData["hash"], cardData, colour == "black"):
+                            continue
+                    if self.isStored(cardData):
+                        deckHashes.add(cardData["hash"])
+        return deckHashes
+
+
+    def syncDeck(self, deckKey: str, deckMeta: dict):
+        """Record which stored cards a deck uses, after the deck has been created or updated.
+        Newly rendered cards that are not yet in the store are added to it, and stored cards the deck no longer uses
+        are released, see releaseDeck. deckMeta must have been hashed with sdbDeck.hashDeckCards.
+
+        :param str deckKey: The path to the deck's meta file
+        :param dict deckMeta: The deck's meta. Card URLs may be updated as cards are moved into the store
+        """
+        deckHashes = self._collectStored(deckMeta)
+        oldHashes = set(self.decks[deckKey]) if deckKey in self.decks else set()
+        for storedHash in deckHashes - oldHashes:
+            self._refCounts[storedHash] += 1
+        self.decks[deckKey] = list(deckHashes)
+        self._release(oldHashes - deckHashes)
+
+
+    def addDeckCards(self, deckKey: str, deckMeta: dict) -> bool:
+        """Record that a deck uses the cards in deckMeta, as well as the stored cards it already uses.
+        Lazy decks render their cards a few at a time, and add each batch to the store with this method.
+
+        :param str deckKey: The path to the deck's meta file
+        :param dict deckMeta: A partial deck meta holding the cards to add, each with a "hash"
+        :return: True if the deck uses any cards it did not use before
+        :rtype: bool
+        """
+        return self.addDeckHashes(deckKey, self._collectStored(deckMeta))
+
+
+    def addDeckHashes(self, deckKey: str, hashes: Set[str]) -> bool:
+        """Record that a deck uses the stored cards with the given hashes, as well as the stored cards it already uses.
+
+        :return: True if the deck uses any cards it did not use before
+        :rtype: bool
+        """
+        oldHashes = set(self.decks[deckKey]) if deckKey in self.decks else set()
+        newHashes = hashes - oldHashes
+        for storedHash in newHashes:
+            self._refCounts[storedHash] += 1
+        if newHashes or deckKey not in self.decks:
+            self.decks[deckKey] = list(oldHashes | newHashes)
+        return len(newHashes) > 0
+
+
+    def releaseDeck(self, deckKey: str):
+        """Release all of the stored cards used by a deck, deleting the images that no other deck uses.
+
+        :param str deckKey: The path to the deck's meta file
+        """
+        if deckKey in self.decks:
+            self._release(self.decks.pop(deckKey))
+
+
+    def _release(self, hashes):
+        for storedHash in hashes:
+            self._refCounts[storedHash] -= 1
+            if self._refCounts[storedHash] == 0:
+                entry = self.cards.pop(storedHash)
+                del self._refCounts[storedHash]
+                if entry["storage"] == "local" and entry["url"]:
+                    _removeLocalImage(entry["url"])
+                if "atlas" in entry:
+                    self._atlasRefCounts[entry["atlas"]["url"]] -= 1
+                    if self._atlasRefCounts[entry["atlas"]["url"]] == 0:
+                        del self._atlasRefCounts[entry["atlas"]["url"]]
+                        if entry["storage"] == "local":
+                            _removeLocalImage(entry["atlas"]["url"])
+
+
+    def splitStored(self, cardData: dict, deckKey: str) -> Tuple[dict, Dict[str, Dict[str, List[dict]]]]:
+        """Separate the cards of card data read from a deck source into those that need rendering, and those that are
+        already stored.
+        The deck takes its reference to the stored cards straight away, so that they are not deleted if the other decks using
+        them are deleted before the deck is synced, see syncDeck. If the deck is never synced, release it with releaseDeck.
+
+        :param dict cardData: Validated card data
+        :param str deckKey: The path to the deck's meta file
+        :return: The card data with stored cards removed, and deck meta card dicts for the stored cards of each expansion
+        :rtype: Tuple[dict, Dict[str, Dict[str, List[dict]]]]
+        """
+        toRender = {key: value for key, value in cardData.items() if key != "expansions"}
+        toRender["expansions"] = {}
+        stored = {}
+        for name, expansionData in cardData["expansions"].items():
+            toRender["expansions"][name] = {}
+            stored[name] = {}
+            for colour in ("white", "black"):
+                toRender["expansions"][name][colour] = []
+                stored[name][colour] = []
+                for text in expansionData[colour]:
+                    textHash = cardHash(text, colour == "black")
+                    entry = self.lookup(textHash)
+                    if entry is None:
+                        toRender["expansions"][name][colour].append(text)
+                    else:
+                        storedCard = {"text": text, "url": entry["url"], "hash": textHash}
+                        if "atlas" in entry:
+                            storedCard["atlas"] = entry["atlas"]
+                        if colour == "black":
+                            storedCard["requiredWhiteCards"] = entry["requiredWhiteCards"]
+                        stored[name][colour].append(storedCard)
+        self.addDeckHashes(deckKey, {storedCard["hash"] for expansionData in stored.values() for cards in expansionData.values()
+                                        for storedCard in cards})
+        return toRender, stored
+
+
+    def splitStoredUpdate(self, changedOld: dict, changedNew: dict, deckKey: str) -> Tuple[dict, dict, Dict[str, Dict[str, List[dict]]]]:
+        """Prepare the changed expansions of a deck update, as returned by sdbDeck.splitDeckChanges, for make_cards.update_deck.
+        Stored cards that were removed from the deck are left out of the old data, so that the renderer does not delete
+        images that other decks may share. They are released by syncDeck instead.
+        Added cards that are already stored are left out of the new data, and returned as deck meta card dicts.
+        The deck takes its reference to them straight away, as in splitStored.
+
+        :param dict changedOld: The deck's old meta, restricted to changed expansions
+        :param dict changedNew: The deck's new card data, restricted to changed expansions
+        :param str deckKey: The path to the deck's meta file
+        :return: The old meta and new card data to give to the renderer, and the stored cards to add to each expansion
+        :rtype: Tuple[dict, dict, Dict[str, Dict[str, List[dict]]]]
+        """
+        oldToRender = {key: value for key, value in changedOld.items() if key != "expansions"}
+        oldToRender["expansions"] = {}
+        for name, expansionData in changedOld["expansions"].items():
+            newExpansion = changedNew["expansions"][name] if name in changedNew["expansions"] else {}
+            oldToRender["expansions"][name] = dict(expansionData)
+            for colour in ("white", "black"):
+                if colour in expansionData:
+                    newTexts = set(newExpansion[colour] if colour in newExpansion else [])
+                    oldToRender["expansions"][name][colour] = [cardData for cardData in expansionData[colour]
+                                                                if cardData["text"] in newTexts or not self.isStored(cardData)]
+
+        # Only cards that are not in the old meta are new, the rest are already rendered
+        addedCards = {key: value for key, value in changedNew.items() if key != "expansions"}
+        addedCards["expansions"] = {}
+        for name, expansionData in changedNew["expansions"].items():
+            oldExpansion = oldToRender["expansions"][name] if name in oldToRender["expansions"] else {}
+            addedCards["expansions"][name] = {}
+            for colour in ("white", "black"):
+                oldTexts = {cardData["text"] for cardData in (oldExpansion[colour] if colour in oldExpansion else [])}
+                addedCards["expansions"][name][colour] = [text for text in expansionData[colour] if text not in oldTexts]
+        _, stored = self.splitStored(addedCards, deckKey)
+
+        newToRender = {key: value for key, value in changedNew.items() if key != "expansions"}
+        newToRender["expansions"] = {}
+        for name, expansionData in changedNew["expansions"].items():
+            newToRender["expansions"][name] = {}
+            for colour in ("white", "black"):
+                storedTexts = {cardData["text"] for cardData in stored[name][colour]}
+                newToRender["expansions"][name][colour] = [text for text in expansionData[colour] if text not in storedTexts]
+
+        return oldToRender, newToRender, stored
+
+
+    def toDict(self) -> dict:
+        return {"cards": self.cards, "decks": self.decks}
+
+
+    @classmethod
+    def fromDict(cls, storeDict: dict) -> "CardStore":
+        return CardStore(cards=storeDict["cards"], decks=storeDict["decks"])
+
+
+def _removeLocalImage(url: str):
+    imagePath = cfg.paths.decksFolder + os.sep + url_to_local_path(url)
+    if os.path.isfile(imagePath):
+        os.remove(imagePath)
+    cardImages.forgetCardImage(url)
+
+
+def mergeStored(deckMeta: dict, stored: Dict[str, Dict[str, List[dict]]]):
+    """Add the stored cards returned by CardStore.splitStored into a rendered deck meta.
+    """
+    for name, colours in stored.items():
+        if name not in deckMeta["expansions"]:
+            deckMeta["expansions"][name] = {"white": [], "black": []}
+        for colour, cards in colours.items():
+            if colour not in deckMeta["expansions"][name]:
+                deckMeta["expansions"][name][colour] = []
+            deckMeta["expansions"][name][colour] += cards
+
+
+def storageChannel():
+    """Get the channel that card images are uploaded to when cfg.cardStorageMethod is "discord".
+    """
+    return botState.client.get_guild(cfg.cardsDCChannel["guild_id"]).get_channel(cfg.cardsDCChannel["channel_id"])
+
+
+async def uploadFiles(files: List[Tuple[str, Union[str, bytes]]], progress: Callable[[int, int], Awaitable] = None) -> List[str]:
+    """Upload card images to the card storage channel, see lib.discordUtil.uploadFiles.
+
+    :param files: The name to upload each image with, and either the path to the image or its encoded contents
+    :type files: List[Tuple[str, Union[str, bytes]]]
+    :param progress: Coroutine function called with the number of images uploaded so far and the total number of images
+    :return: The URL of each uploaded image, in the order the images were given
+    :rtype: List[str]
+    """
+    return await lib.discordUtil.uploadFiles(storageChannel(), files, maxConcurrent=cfg.maxConcurrentUploads,
+                                                maxMessageBytes=cfg.maxUploadBytesPerMessage, maxRetries=cfg.maxUploadRetries,
+                                                progress=progress)
+
+
+def _encodeCardFile(imagePath: str, profile: dict, scale: float) -> bytes:
+    # Run in the image worker pool
+    with Image.open(imagePath) as im:
+        return lib.imageEncoding.encodeImage(im, profile, lib.imageEncoding.scaleSize(im.size, scale))
+
+
+async def uploadDeckCards(deckMeta: dict, progress: Callable[[int, int], Awaitable] = None):
+    """Upload the locally stored card images of a rendered deck meta to the card storage channel, several images per message.
+    Used in place of make_cards.store_cards_discord, after make_cards.store_cards_local.
+    Images are encoded with cfg.cardEncoderProfile at cfg.cardDeliveryScale before they are uploaded.
+    Card and card back URLs are replaced with attachment URLs, and the uploaded local images are deleted.
+    URLs that do not point to a local image, such as cards from the card store or card sheets, are left alone.
+
+    :param dict deckMeta: The rendered deck meta
+    :param progress: Coroutine function called with the number of images uploaded so far and the total number of images
+    """
+    # Each image to upload, with the dictionary and key holding its URL
+    uploads = []
+    for expansionData in deckMeta["expansions"].values():
+        for colour in ("white", "black"):
+            for cardData in (expansionData[colour] if colour in expansionData else []):
+                uploads.append((cardData, "url"))
+    for backKey in ("white_back", "black_back"):
+        if backKey in deckMeta:
+            uploads.append((deckMeta, backKey))
+
+    toUpload = []
+    for container, key in uploads:
+        if container[key]:
+            imagePath = cfg.paths.decksFolder + os.sep + url_to_local_path(container[key])
+            if os.path.isfile(imagePath):
+                toUpload.append((container, key, imagePath))
+
+    profile = cfg.imageEncoderProfiles[cfg.cardEncoderProfile]
+    extension = lib.imageEncoding.fileExtension(profile)
+    # Images are encoded a group at a time, so that the encoded images of a large deck are never all held in memory at once
+    groupSize = lib.discordUtil.MAX_ATTACHMENTS_PER_MESSAGE * cfg.maxConcurrentUploads
+    for groupStart in range(0, len(toUpload), groupSize):
+        group = toUpload[groupStart:groupStart + groupSize]
+        encodedImages = await asyncio.gather(*(lib.imageWorkers.runImageTask(_encodeCardFile, imagePath, profile, cfg.cardDeliveryScale)
+                                                for _, _, imagePath in group))
+        files = [(os.path.splitext(os.path.basename(imagePath))[0] + "." + extension, imageBytes)
+                    for (_, _, imagePath), imageBytes in zip(group, encodedImages)]
+
+        async def groupProgress(imagesDone, _, uploadedBefore=groupStart):
+            await progress(uploadedBefore + imagesDone, len(toUpload))
+
+        urls = await uploadFiles(files, progress=groupProgress if progress is not None else None)
+        for (container, key, imagePath), url in zip(group, urls):
+            container[key] = url
+            os.remove(imagePath)
+
+
+def storeFolder() -> str:
+    return cfg.paths.decksFolder + os.sep + STORE_FOLDER
+
+
+# Loaded on first use by getStore
+_store: CardStore = None
+
+
+def getStore() -> CardStore:
+    """Get the card store, loading its index from disk on first use.
+    """
+    global _store
+    if _store is None:
+        indexPath = storeFolder() + os.sep + _INDEX_FILE
+        _store = CardStore.fromDict(lib.jsonHandler.readJSON(indexPath)) if os.path.isfile(indexPath) else CardStore()
+    return _store
+
+
+# The pending debounced save, see scheduleSave
+_saveTask: asyncio.Task = None
+# Each copy of the index taken for saving is numbered, so that a slow save of an older copy never replaces a newer one
+_lastIndexCopy = 0
+_lastIndexWritten = 0
+_indexWriteLock = threading.Lock()
+
+
+def _copyIndex() -> Tuple[int, dict]:
+    global _lastIndexCopy
+    _lastIndexCopy += 1
+    # Entries and deck hash lists are replaced rather than modified, so are shared with the copy
+    return _lastIndexCopy, {"cards": dict(_store.cards), "decks": dict(_store.decks)}
+
+
+def _writeIndex(copyNum: int, index: dict):
+    """Write a copy of the card store's index to disk, unless a newer copy has already been written.
+    Entries are encoded one at a time, so that writing from another thread does not hold the GIL for the whole index.
+    """
+    global _lastIndexWritten
+    indexPath = storeFolder() + os.sep + _INDEX_FILE
+    with _indexWriteLock:
+        if copyNum < _lastIndexWritten:
+            return
+        os.makedirs(storeFolder(), exist_ok=True)
+        with open(indexPath + ".tmp", "w") as indexFile:
+            for sectionNum, section in enumerate(("cards", "decks")):
+                indexFile.write(("{" if sectionNum == 0 else "}, ") + json.dumps(section) + ": {")
+                for itemNum, (key, value) in enumerate(index[section].items()):
+                    indexFile.write(("" if itemNum == 0 else ", ") + json.dumps(key) + ": " + json.dumps(value))
+            indexFile.write("}}")
+        os.replace(indexPath + ".tmp", indexPath)
+        _lastIndexWritten = copyNum
+
+
+def saveStore():
+    """Write the card store's index to disk now, replacing any pending save from scheduleSave.
+    Blocks until the whole index is written, so prefer scheduleSave for frequent changes.
+    """
+    global _saveTask
+    if _store is not None:
+        if _saveTask is not None:
+            _saveTask.cancel()
+            _saveTask = None
+        _writeIndex(*_copyIndex())
+
+
+async def _saveLater():
+    global _saveTask
+    await asyncio.sleep(cfg.cardStoreSaveDelaySeconds)
+    _saveTask = None
+    copyNum, index = _copyIndex()
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, _writeIndex, copyNum, index)
+    except Exception as e:
+        botState.logger.log("cardStore", "_saveLater", "Exception occured when saving the card store index",
+                            eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def scheduleSave():
+    """Write the card store's index to disk cfg.cardStoreSaveDelaySeconds from now, in a background thread.
+    Every change made before then is written by the same save, so frequent changes do not each rewrite the whole index.
+    """
+    global _saveTask
+    if _store is not None and _saveTask is None:
+        _saveTask = asyncio.ensure_future(_saveLater())
+
+
+def flushStore():
+    """Write the card store's index to disk now if a save from scheduleSave is pending. Call before shutting down.
+    """
+    if _saveTask is not None:
+        saveStore()
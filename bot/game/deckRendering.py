@@ -0,0 +1,151 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, List, Tuple
+
+from .. import lib
+from ..cfg import cfg
+from ..cardRenderer import make_cards
+
+
+# Processes for rendering card images. Created at startup, see startRenderPool
+_renderPool: ProcessPoolExecutor = None
+
+
+class RenderError(Exception):
+    """Raised when cards could not be rendered because a card rendering process stopped unexpectedly.
+    The exception message is suitable for showing to the user.
+    """
+    pass
+
+
+def _initRenderWorker(measurementCacheSize: int):
+    # Each worker renders many cards with the same few fonts, so fonts and text measurements are cached for the life of the worker
+    lib.fontCache.installFontCache(measurementCacheSize)
+
+
+def _startWorker():
+    pass
+
+
+def startRenderPool():
+    """Create the card rendering processes, and start all of them. Must be called at startup, before any threads are started:
+    a process forked while other threads are running can deadlock on locks that those threads held.
+    Safe to call more than once.
+    """
+    global _renderPool
+    if _renderPool is None:
+        # Forked workers inherit the loaded config. Spawned workers would import main.py again, so are only used where fork is unavailable
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+        _renderPool = ProcessPoolExecutor(max_workers=cfg.cardRenderProcesses if cfg.cardRenderProcesses > 0 else None, mp_context=context,
+                                            initializer=_initRenderWorker, initargs=(cfg.fontMeasurementCacheSize,))
+        # Workers are otherwise only started by the first render, once the event loop and worker threads are running
+        _renderPool.submit(_startWorker).result()
+
+
+def _getRenderPool() -> ProcessPoolExecutor:
+    if _renderPool is None:
+        raise RuntimeError("The card rendering processes have not been started. Call deckRendering.startRenderPool at startup")
+    return _renderPool
+
+
+def _replaceBrokenPool(pool: ProcessPoolExecutor):
+    """Replace a render pool that can no longer be used because one of its processes died, for example from running out of memory.
+    Does nothing if the pool has already been replaced by another render that found it broken.
+    """
+    global _renderPool
+    if _renderPool is pool:
+        pool.shutdown(wait=False)
+        _renderPool = None
+        # Unlike at startup, the new workers are forked while other threads are running, see startRenderPool.
+        # That risk is taken over leaving card rendering unusable until the bot is restarted
+        startRenderPool()
+
+
+async def _runRender(func: Callable, *args):
+    """Run a rendering function in the render pool.
+    If the pool is broken, it is replaced so that later renders work again.
+
+    :raise RenderError: If the pool broke before or while running func
+    """
+    pool = _getRenderPool()
+    try:
+        return await asyncio.get_event_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool as e:
+        _replaceBrokenPool(pool)
+        raise RenderError("A card rendering process stopped unexpectedly. Please try again.") from e
+
+
+def _renderChunk(decksFolder: str, cardData: dict, fontPath: str, guildID: int, contentFontSize: int, titleFontSize: int) -> dict:
+    """Render part of a deck in a worker process.
+    """
+    return asyncio.run(make_cards.render_all(decksFolder, cardData, fontPath, guildID, contentFontSize=contentFontSize, titleFontSize=titleFontSize))
+
+
+def _updateChunk(decksFolder: str, oldData: dict, newData: dict, deckID: str, fontPath: str, guildID: int, emptyExpansions: List[str],
+                    contentFontSize: int, titleFontSize: int) -> Tuple[dict, str]:
+    """Render a deck update in a worker process. Cards are stored locally, as discord objects cannot be sent to another process.
+    """
+    return asyncio.run(make_cards.update_deck(decksFolder, oldData, newData, deckID, fontPath, guildID, emptyExpansions, "local", None, None,
+                                                contentFontSize=contentFontSize, titleFontSize=titleFontSize))
+
+
+async def renderDeckUpdate(oldData: dict, newData: dict, deckID: str, guildID: int, emptyExpansions: List[str]) -> Tuple[dict, str]:
+    """Render the changes to a deck with make_cards.update_deck, in the card rendering process pool.
+    New cards are stored locally. Upload them afterwards with cardStore.uploadDeckCards if cards are stored on discord.
+
+    :param dict oldData: The deck meta before the update
+    :param dict newData: Validated card data for the updated deck
+    :param str deckID: The ID of the deck, as used in its meta file name
+    :param int guildID: The ID of the guild that owns the deck
+    :param List[str] emptyExpansions: The names of expansions in newData that have no cards
+    :return: The updated deck meta, and a description of the changed expansions
+    :rtype: Tuple[dict, str]
+    :raise RenderError: If a card rendering process stopped while rendering
+    """
+    results = await _runRender(_updateChunk, cfg.paths.decksFolder, oldData, newData, deckID, cfg.paths.cardFont, guildID, emptyExpansions,
+                                cfg.cardContentFontSize, cfg.cardTitleFontSize)
+    return results[0], results[1]
+
+
+async def renderDeck(cardData: dict, guildID: int, progress: Callable[[int, int], Awaitable] = None) -> dict:
+    """Render all of the cards in a deck with make_cards.render_all, spread over the card rendering process pool.
+    Each expansion is rendered as a separate chunk, and the resulting deck metas are merged in expansion order.
+
+    :param dict cardData: Validated card data to render
+    :param int guildID: The ID of the guild that owns the deck
+    :param progress: Coroutine function called with the number of expansions rendered so far and the total number of expansions,
+                        each time an expansion finishes rendering (Default None)
+    :return: The rendered deck meta, as returned by make_cards.render_all
+    :rtype: dict
+    :raise RenderError: If a card rendering process stopped while rendering
+    """
+    expansionNames = list(cardData["expansions"].keys())
+
+    async def renderExpansion(name):
+        chunk = {key: value for key, value in cardData.items() if key != "expansions"}
+        chunk["expansions"] = {name: cardData["expansions"][name]}
+        return name, await _runRender(_renderChunk, cfg.paths.decksFolder, chunk, cfg.paths.cardFont, guildID, cfg.cardContentFontSize,
+                                        cfg.cardTitleFontSize)
+
+    renderedChunks = {}
+    renders = [asyncio.ensure_future(renderExpansion(name)) for name in expansionNames]
+    try:
+        for finished in asyncio.as_completed(renders):
+            name, chunkMeta = await finished
+            renderedChunks[name] = chunkMeta
+            if progress is not None:
+                await progress(len(renderedChunks), len(expansionNames))
+    finally:
+        # If one chunk failed, the rest are abandoned. Their results and errors are collected so that they are not reported as unretrieved
+        for render in renders:
+            render.cancel()
+        await asyncio.gather(*renders, return_exceptions=True)
+
+    # Every chunk shares the deck-wide meta, such as the deck name and card backs
+    deckMeta = {key: value for key, value in renderedChunks[expansionNames[0]].items() if key != "expansions"}
+    deckMeta["expansions"] = {}
+    for name in expansionNames:
+        deckMeta["expansions"].update(renderedChunks[name]["expansions"])
+    return deckMeta
@@ -0,0 +1,155 @@
+import mmap
+import os
+import pickle
+from typing import Dict, List, Tuple, Union
+
+from .. import botState
+
+
+# Snapshots hold a deck catalog in the packed form used by SDBCardTable, next to the deck's meta JSON file.
+# Opening a snapshot costs one mmap and unpickling a small header. Each expansion is pickled separately after the header,
+# and is only unpickled when a game using that expansion needs its cards.
+# Snapshots record the size and modification time of the meta file they were built from, and are ignored once it changes.
+SNAPSHOT_EXT = ".snapshot"
+# Increment whenever the structure of snapshot data changes, to invalidate all existing snapshots
+SNAPSHOT_VERSION = 3
+_MAGIC = b"SDBSNAP" + bytes([SNAPSHOT_VERSION])
+# Number of bytes used to store the length of the snapshot header
+_HEADER_LENGTH_BYTES = 8
+
+
+class DeckSnapshot:
+    """An open deck snapshot. The snapshot file stays mapped for as long as this object exists, so expansions can be read
+    from it even after the file on disk has been replaced by a newer snapshot.
+
+    :var name: The name of the deck
+    :vartype name: str
+    :var whiteBack: URL to the deck's white card back image, or None if the deck has none
+    :vartype whiteBack: str
+    :var blackBack: URL to the deck's black card back image, or None if the deck has none
+    :vartype blackBack: str
+    :var urlPrefixes: The deck's table of card URL prefixes
+    :vartype urlPrefixes: List[str]
+    :var expansionCounts: The number of white and black cards in each expansion, in the order the deck lists them
+    :vartype expansionCounts: Dict[str, Tuple[int, int]]
+    """
+
+    def __init__(self, snapshotBytes: mmap.mmap, dataStart: int, header: dict):
+        """
+        :param mmap.mmap snapshotBytes: The mapped snapshot file
+        :param int dataStart: The position in the snapshot file where expansion data starts
+        :param dict header: The unpickled snapshot header
+        """
+        self._snapshotBytes = snapshotBytes
+        self._dataStart = dataStart
+        self.name: str = header["name"]
+        self.whiteBack: str = header["whiteBack"]
+        self.blackBack: str = header["blackBack"]
+        self.urlPrefixes: List[str] = header["urlPrefixes"]
+        self.expansionCounts: Dict[str, Tuple[int, int]] = {}
+        self._expansionRanges: Dict[str, Tuple[int, int]] = {}
+        for name, whiteCount, blackCount, start, end in header["expansions"]:
+            self.expansionCounts[name] = (whiteCount, blackCount)
+            self._expansionRanges[name] = (start, end)
+
+
+    def readExpansion(self, name: str) -> Tuple[Tuple[bytes, ...], Tuple[bytes, ...]]:
+        """Unpickle the card tables of a single expansion.
+
+        :param str name: The name of the expansion to read
+        :return: The white and black SDBCardTable states of the expansion
+        :rtype: Tuple[Tuple[bytes, ...], Tuple[bytes, ...]]
+        """
+        start, end = self._expansionRanges[name]
+        return pickle.loads(self._snapshotBytes[self._dataStart + start:self._dataStart + end])
+
+
+def snapshotPath(metaPath: str) -> str:
+    """Get the path of the snapshot for the given deck meta file.
+
+    :param str metaPath: Path to the deck meta JSON file
+    :return: Path to the deck's snapshot file
+    :rtype: str
+    """
+    return os.path.splitext(metaPath)[0] + SNAPSHOT_EXT
+
+
+def _metaFingerprint(metaPath: str) -> tuple:
+    stat = os.stat(metaPath)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def writeSnapshot(metaPath: str, snapshot: dict):
+    """Write a snapshot for the given deck meta file. The meta file must already have been written.
+    The snapshot is written to a temporary file first and then moved into place, so readers never see a partial snapshot.
+
+    :param str metaPath: Path to the deck meta JSON file that snapshot was built from
+    :param dict snapshot: The snapshot data, as returned by SDBDeckCatalog.toSnapshot
+    """
+    expansionBlobs = [pickle.dumps((whiteState, blackState), protocol=5) for _, _, _, whiteState, blackState in snapshot["expansions"]]
+
+    # Expansion byte ranges are relative to the end of the header
+    expansions = []
+    offset = 0
+    for (name, whiteCount, blackCount, _, _), blob in zip(snapshot["expansions"], expansionBlobs):
+        expansions.append((name, whiteCount, blackCount, offset, offset + len(blob)))
+        offset += len(blob)
+    header = pickle.dumps((_metaFingerprint(metaPath), {"name": snapshot["name"], "whiteBack": snapshot["whiteBack"], "blackBack": snapshot["blackBack"],
+                                                        "urlPrefixes": snapshot["urlPrefixes"], "expansions": expansions}), protocol=5)
+
+    path = snapshotPath(metaPath)
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as f:
+        f.write(_MAGIC)
+        f.write(len(header).to_bytes(_HEADER_LENGTH_BYTES, "little"))
+        f.write(header)
+        for blob in expansionBlobs:
+            f.write(blob)
+    os.replace(tempPath, path)
+
+
+def openSnapshot(metaPath: str) -> Union[DeckSnapshot, None]:
+    """Open the snapshot for the given deck meta file. Only the snapshot header is read.
+
+    :param str metaPath: Path to the deck meta JSON file
+    :return: The opened snapshot, or None if there is no snapshot, or the snapshot is out of date or unreadable
+    :rtype: DeckSnapshot or None
+    """
+    path = snapshotPath(metaPath)
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        metaFingerprint = _metaFingerprint(metaPath)
+    except OSError:
+        # The meta file was removed or renamed, so the snapshot cannot be checked against it
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            snapshotBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        headerStart = len(_MAGIC) + _HEADER_LENGTH_BYTES
+        if snapshotBytes[:len(_MAGIC)] != _MAGIC:
+            snapshotBytes.close()
+            return None
+        headerLength = int.from_bytes(snapshotBytes[len(_MAGIC):headerStart], "little")
+        fingerprint, header = pickle.loads(snapshotBytes[headerStart:headerStart + headerLength])
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        botState.logger.log("deckSnapshot", "openSnapshot", "Ignoring unreadable deck snapshot " + path + ": " + str(e),
+                            eventType=type(e).__name__)
+        return None
+
+    if fingerprint != metaFingerprint:
+        snapshotBytes.close()
+        return None
+    return DeckSnapshot(snapshotBytes, headerStart + headerLength, header)
+
+
+def removeSnapshot(metaPath: str):
+    """Delete the snapshot for the given deck meta file, if one exists.
+
+    :param str metaPath: Path to the deck meta JSON file
+    """
+    path = snapshotPath(metaPath)
+    if os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,280 @@
+import csv
+import io
+import os
+import zipfile
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple, Union
+from xml.etree.ElementTree import iterparse, ParseError
+
+
+# Deck sources turn a spreadsheet into the card data consumed by cmd_create and updateDeck:
+# {"expansions": {expansionName: {"white": [text, ...], "black": [text, ...]}}, "title": deckName}
+# Each sheet of the spreadsheet is an expansion, column A holds white cards and column B holds black cards.
+#
+# File parsers stream (sheet name, row) pairs out of the file, so that large workbooks never need to be loaded whole.
+# Each parser yields an empty row when it starts a new sheet, so that empty sheets are still reported as expansions.
+# Only the card columns are read. Cells in later columns are ignored, so that a file cannot make a row arbitrarily long.
+NUM_CARD_COLUMNS = 2
+
+
+class DeckFileError(Exception):
+    """Raised when an uploaded deck file could not be read.
+    The exception message is suitable for showing to the user.
+    """
+    pass
+
+
+class DeckBuilder:
+    """Collects rows of card text into expansions, ignoring empty cells and duplicate cards within an expansion.
+    Cards keep the order they were first seen in.
+    """
+
+    def __init__(self):
+        self.expansions: Dict[str, Dict[str, List[str]]] = {}
+        self._seen: Dict[str, Tuple[set, set]] = {}
+
+
+    def addRow(self, sheetName: str, row: List[str]):
+        """Add the white and black cards in a row of a sheet to the sheet's expansion.
+
+        :param str sheetName: The name of the sheet the row belongs to
+        :param List[str] row: The cell values of the row, starting from column A
+        """
+        if sheetName not in self.expansions:
+            self.expansions[sheetName] = {"white": [], "black": []}
+            self._seen[sheetName] = (set(), set())
+        expansion = self.expansions[sheetName]
+        seenWhite, seenBlack = self._seen[sheetName]
+
+        if len(row) > 0 and row[0] and row[0] not in seenWhite:
+            seenWhite.add(row[0])
+            expansion["white"].append(row[0])
+        if len(row) > 1 and row[1] and row[1] not in seenBlack:
+            seenBlack.add(row[1])
+            expansion["black"].append(row[1])
+
+
+    def toCardData(self, title: str) -> dict:
+        return {"expansions": self.expansions, "title": title}
+
+
+def _localName(tag: str) -> str:
+    """Strip the namespace from an ElementTree tag. Matching on local names accepts both the transitional and strict
+    variants of the OOXML namespaces.
+    """
+    return tag[tag.rfind("}") + 1:]
+
+
+# Parsers for each supported deck file extension.
+# A parser takes a binary file object and the file's name, and returns the deck title stored in the file (or None)
+# along with an iterator over (sheet name, row) pairs.
+deckFileParsers: Dict[str, Callable[[BinaryIO, str], Tuple[Union[str, None], Iterator[Tuple[str, List[str]]]]]] = {}
+
+
+def deckFileParser(*extensions: str):
+    """Decorator registering a function as the parser for deck files with the given extensions.
+
+    :param str extensions: The file extensions to register the parser for, including the leading "."
+    """
+    def register(parser):
+        for extension in extensions:
+            deckFileParsers[extension] = parser
+        return parser
+    return register
+
+
+def supportedExtensions() -> List[str]:
+    return list(deckFileParsers.keys())
+
+
+def readDeckFile(deckFile: BinaryIO, fileName: str) -> dict:
+    """Read the card data of a deck from an uploaded spreadsheet file.
+    If the file does not name the deck, the deck is named after the file.
+
+    :param BinaryIO deckFile: The file to read
+    :param str fileName: The name of the file, used to pick a parser
+    :return: The deck's expansions and title
+    :rtype: dict
+    :raise DeckFileError: If the file type is not supported, or the file could not be read
+    """
+    stem, extension = os.path.splitext(fileName)
+    extension = extension.lower()
+    if extension not in deckFileParsers:
+        raise DeckFileError("Unsupported deck file type '" + extension + "'. Supported file types are: " + ", ".join(supportedExtensions()))
+
+    builder = DeckBuilder()
+    try:
+        title, rows = deckFileParsers[extension](deckFile, fileName)
+        for sheetName, row in rows:
+            builder.addRow(sheetName, row)
+    except (zipfile.BadZipFile, KeyError, IndexError, ValueError, StopIteration, ParseError, csv.Error, UnicodeDecodeError) as e:
+        raise DeckFileError("Could not read " + fileName + ", the file may be corrupted: " + type(e).__name__) from e
+
+    return builder.toCardData(title if title else stem)
+
+
+@deckFileParser(".csv")
+def _parseCSV(deckFile: BinaryIO, fileName: str):
+    # A CSV file holds a single sheet, which becomes an expansion named after the file
+    sheetName = os.path.splitext(fileName)[0]
+
+    def rows():
+        yield sheetName, []
+        for row in csv.reader(io.TextIOWrapper(deckFile, encoding="utf-8-sig", newline="")):
+            yield sheetName, row
+
+    return None, rows()
+
+
+def _columnIndex(cellRef: str) -> int:
+    """Convert the column letters of an A1 style cell reference into a 0-based column index.
+    """
+    index = 0
+    for char in cellRef:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord("A") + 1
+    return index - 1
+
+
+def _documentTitle(archive: zipfile.ZipFile, metaPath: str) -> Union[str, None]:
+    """Read the dc:title of an office document from its metadata file, if it has one.
+    """
+    if metaPath not in archive.namelist():
+        return None
+    with archive.open(metaPath) as metaFile:
+        for _, element in iterparse(metaFile):
+            if _localName(element.tag) == "title" and element.text:
+                return element.text.strip()
+    return None
+
+
+def _xlsxSharedStrings(archive: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as stringsFile:
+        for _, element in iterparse(stringsFile):
+            if _localName(element.tag) == "si":
+                # Rich text strings are split over several runs, each with its own t element
+                strings.append("".join(textElement.text or "" for textElement in element.iter() if _localName(textElement.tag) == "t"))
+                element.clear()
+    return strings
+
+
+def _xlsxSheetPaths(archive: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """Get the name and archive path of every sheet in an XLSX workbook, in workbook order.
+    """
+    targets = {}
+    with archive.open("xl/_rels/workbook.xml.rels") as relsFile:
+        for _, element in iterparse(relsFile):
+            if _localName(element.tag) == "Relationship":
+                target = element.get("Target", "")
+                targets[element.get("Id")] = target.lstrip("/") if target.startswith("/") else "xl/" + target
+
+    sheets = []
+    with archive.open("xl/workbook.xml") as workbookFile:
+        for _, element in iterparse(workbookFile):
+            if _localName(element.tag) == "sheet":
+                relID = next((value for key, value in element.attrib.items() if _localName(key) == "id"), None)
+                sheets.append((element.get("name"), targets[relID]))
+    return sheets
+
+
+@deckFileParser(".xlsx")
+def _parseXLSX(deckFile: BinaryIO, fileName: str):
+    archive = zipfile.ZipFile(deckFile)
+    title = _documentTitle(archive, "docProps/core.xml")
+    sharedStrings = _xlsxSharedStrings(archive)
+    sheets = _xlsxSheetPaths(archive)
+
+    def rows():
+        for sheetName, sheetPath in sheets:
+            yield sheetName, []
+            with archive.open(sheetPath) as sheetFile:
+                row = []
+                for _, element in iterparse(sheetFile):
+                    tag = _localName(element.tag)
+                    if tag == "c":
+                        cellRef = element.get("r")
+                        column = _columnIndex(cellRef) if cellRef else len(row)
+                        if not 0 <= column < NUM_CARD_COLUMNS:
+                            element.clear()
+                            continue
+                        cellType = element.get("t")
+                        if cellType == "inlineStr":
+                            value = "".join(textElement.text or "" for textElement in element.iter() if _localName(textElement.tag) == "t")
+                        else:
+                            value = next((child.text or "" for child in element if _localName(child.tag) == "v"), "")
+                            if cellType == "s" and value:
+                                value = sharedStrings[int(value)]
+                        if value:
+                            row.extend([""] * (column + 1 - len(row)))
+                            row[column] = value
+                        element.clear()
+                    elif tag == "row":
+                        yield sheetName, row
+                        row = []
+                        element.clear()
+
+    return title, rows()
+
+
+def _odsText(element) -> str:
+    """Get the text of an ODS text:p element, expanding the elements used for repeated whitespace.
+    """
+    parts = [element.text or ""]
+    for child in element:
+        tag = _localName(child.tag)
+        if tag == "s":
+            parts.append(" " * int(next((value for key, value in child.attrib.items() if _localName(key) == "c"), 1)))
+        elif tag == "tab":
+            parts.append("\t")
+        elif tag == "line-break":
+            parts.append("\n")
+        else:
+            parts.append(_odsText(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+def _odsAttribute(element, name: str, default: str = None) -> str:
+    return next((value for key, value in element.attrib.items() if _localName(key) == name), default)
+
+
+@deckFileParser(".ods")
+def _parseODS(deckFile: BinaryIO, fileName: str):
+    archive = zipfile.ZipFile(deckFile)
+    title = _documentTitle(archive, "meta.xml")
+
+    def rows():
+        sheetName = None
+        row = []
+        # Position of the next cell in the current row. Cells may be repeated, and runs of empty cells are only
+        # padded into row when a later cell in the row has a value.
+        column = 0
+        with archive.open("content.xml") as contentFile:
+            for event, element in iterparse(contentFile, events=("start", "end")):
+                tag = _localName(element.tag)
+                if event == "start":
+                    if tag == "table":
+                        sheetName = _odsAttribute(element, "name", "")
+                        yield sheetName, []
+                    continue
+
+                if tag in ("table-cell", "covered-table-cell"):
+                    value = "\n".join(_odsText(child) for child in element if _localName(child.tag) == "p")
+                    repeats = int(_odsAttribute(element, "number-columns-repeated", "1"))
+                    if value and column < NUM_CARD_COLUMNS:
+                        row.extend([""] * (column - len(row)))
+                        row.extend([value] * min(repeats, NUM_CARD_COLUMNS - column))
+                    column += repeats
+                    element.clear()
+                elif tag == "table-row":
+                    # Repeated rows only add duplicate cards, so each is yielded once
+                    if row:
+                        yield sheetName, row
+                    row = []
+                    column = 0
+                    element.clear()
+
+    return title, rows()
@@ -0,0 +1,155 @@
+import time
+from typing import Dict, List
+
+from ..cfg import cfg
+
+
+# The largest number of white card slots that a black card may have. Deck catalogs store each black card's number of
+# required white cards in two bytes, see sdbDeck.SDBCardTable
+MAX_WHITE_CARD_SLOTS = 2 ** 16 - 1
+
+class DeckValidationReport:
+    """The result of validating card data read from a deck source, see validateCardData.
+
+    :var cardData: The card data with all invalid expansions and cards removed
+    :vartype cardData: dict
+    :var errors: Problems that prevent the deck from being created or updated. Empty if the deck is valid
+    :vartype errors: List[str]
+    :var warnings: Problems that were fixed by skipping expansions or cards
+    :vartype warnings: List[str]
+    :var emptyExpansions: Names of expansions that were skipped because they had no cards
+    :vartype emptyExpansions: List[str]
+    :var droppedBlackCards: The number of black cards skipped from each expansion because they had no white card slots
+    :vartype droppedBlackCards: Dict[str, int]
+    :var oversizedBlackCards: The number of black cards skipped from each expansion because they had more than
+                                MAX_WHITE_CARD_SLOTS white card slots
+    :vartype oversizedBlackCards: Dict[str, int]
+    :var whiteCounts: The number of valid white cards in each expansion
+    :vartype whiteCounts: Dict[str, int]
+    :var blackCounts: The number of valid black cards in each expansion
+    :vartype blackCounts: Dict[str, int]
+    :var totalWhite: The number of valid white cards in the deck
+    :vartype totalWhite: int
+    :var totalBlack: The number of valid black cards in the deck
+    :vartype totalBlack: int
+    """
+
+    def __init__(self):
+        self.cardData: dict = {}
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.unnamedFound = False
+        self.emptyExpansions: List[str] = []
+        self.droppedBlackCards: Dict[str, int] = {}
+        self.oversizedBlackCards: Dict[str, int] = {}
+        self.whiteCounts: Dict[str, int] = {}
+        self.blackCounts: Dict[str, int] = {}
+        self.totalWhite = 0
+        self.totalBlack = 0
+
+
+    @property
+    def isValid(self) -> bool:
+        return not self.errors
+
+
+def validateCardData(cardData: dict) -> DeckValidationReport:
+    """Check card data read from a deck source against every deck rule in a single pass over its expansions and cards.
+    The given card data is not modified.
+
+    - Expansion names must be unique, ignoring case
+    - Unnamed expansions are skipped
+    - Expansions with no cards are skipped
+    - Black cards with no white card slots (`_`) are skipped
+    - Black cards with more than MAX_WHITE_CARD_SLOTS white card slots are skipped
+    - Decks must have at least 2 * cfg.cardsPerHand white cards, and at least one black card
+
+    :param dict cardData: Card data as returned by sdbDeck.collect_cards or deckSources.readDeckFile
+    :return: A report of all problems found, and the card data with invalid expansions and cards removed
+    :rtype: DeckValidationReport
+    """
+    report = DeckValidationReport()
+    expansions = {}
+    seenNames = set()
+
+    for name, expansionData in cardData["expansions"].items():
+        lowerName = name.lower()
+        if lowerName in seenNames:
+            report.errors.append("Duplicate expansion pack name found: " + lowerName)
+            continue
+        seenNames.add(lowerName)
+
+        if name == "":
+            report.unnamedFound = True
+            continue
+
+        whiteCards = expansionData["white"]
+        blackCards = [card for card in expansionData["black"] if "_" in card]
+        if len(blackCards) != len(expansionData["black"]):
+            report.droppedBlackCards[name] = len(expansionData["black"]) - len(blackCards)
+        numSlotted = len(blackCards)
+        blackCards = [card for card in blackCards if card.count("_") <= MAX_WHITE_CARD_SLOTS]
+        if len(blackCards) != numSlotted:
+            report.oversizedBlackCards[name] = numSlotted - len(blackCards)
+        if not whiteCards and not blackCards:
+            report.emptyExpansions.append(name)
+            continue
+
+        expansions[name] = {"white": whiteCards, "black": blackCards}
+        report.whiteCounts[name] = len(whiteCards)
+        report.blackCounts[name] = len(blackCards)
+        report.totalWhite += len(whiteCards)
+        report.totalBlack += len(blackCards)
+
+    report.cardData = {key: value for key, value in cardData.items() if key != "expansions"}
+    report.cardData["expansions"] = expansions
+
+    if report.unnamedFound:
+        report.warnings.append("Unnamed expansion pack detected - skipping this expansion.")
+    if report.emptyExpansions:
+        report.warnings.append("Empty expansion packs detected - skipping these expansions: " + ", ".join(report.emptyExpansions))
+    for name, numDropped in report.droppedBlackCards.items():
+        report.warnings.append("Ignoring " + str(numDropped) + " black cards from " + name + " expansion with no white card slots (`_`).")
+    for name, numDropped in report.oversizedBlackCards.items():
+        report.warnings.append("Ignoring " + str(numDropped) + " black cards from " + name + " expansion with more than "
+                                + str(MAX_WHITE_CARD_SLOTS) + " white card slots (`_`).")
+
+    if report.totalWhite // cfg.cardsPerHand < 2:
+        report.errors.append("Decks must have at least " + str(2 * cfg.cardsPerHand) + " white cards.")
+    if report.totalBlack == 0:
+        report.errors.append("Decks must have at least 1 black card.")
+
+    return report
+
+
+def syntheticCardData(numExpansions: int, numCards: int) -> dict:
+    """Build card data of made up cards for benchmarking, as read from a deck source.
+    Two thirds of the cards are white, and one in five black cards has no white card slots, so is dropped by validation.
+    """
+    cardData = {"title": "benchmark", "expansions": {}}
+    for cardNum in range(numCards):
+        expansion = cardData["expansions"].setdefault("Expansion " + str(cardNum % numExpansions), {"white": [], "black": []})
+        if cardNum % 3:
+            expansion["white"].append("white card number " + str(cardNum))
+        else:
+            expansion["black"].append("black card number " + str(cardNum) + ("" if cardNum % 5 == 0 else " _"))
+    return cardData
+
+
+def benchmarkValidation(numExpansions: int, numCards: int, repeats: int = 5) -> float:
+    """Time validateCardData on made up card data, see syntheticCardData.
+
+    :param int numExpansions: The number of expansions in the card data
+    :param int numCards: The total number of cards in the card data
+    :param int repeats: The number of times to validate the card data (Default 5)
+    :return: The fastest validation time in milliseconds
+    :rtype: float
+    """
+    cardData = syntheticCardData(numExpansions, numCards)
+    fastest = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        validateCardData(cardData)
+        elapsed = (time.perf_counter() - started) * 1000
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return fastest
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import traceback
+from typing import Awaitable, Dict, List, Set, Tuple
+
+from .. import botState, lib
+from ..cfg import cfg
+from ..cardRenderer import make_cards
+from ..cardRenderer.lib import url_to_local_path
+from . import cardAtlas, cardStore, deckRendering
+
+
+# Lazy decks are playable as soon as their spreadsheet has been read. Their deck meta holds the text and hash of every card,
+# but cards that are not in the card store yet have an empty URL. Each card is rendered and stored the first time it is
+# drawn, see ensureRendered, while a background task renders the rest of the expansions being played ahead of demand,
+# see schedulePrerender.
+# Lazily rendered cards are only recorded in the card store. Deck metas and snapshots are not rewritten as cards are
+# rendered, so cards drawn from a lazy deck without a URL look up their stored URL by hash.
+# Cards stored in card sheets are drawn without a URL in the same way, and are cropped out of their sheet, see cardAtlas.
+
+# The cards currently being rendered, by card hash, so that a card requested twice is only rendered once.
+# The result of each render is the card's store entry, or None if it could not be rendered
+_inFlight = lib.asyncUtil.InFlightWork()
+# Rendered cards are written into their deck's folder until they are stored, so each deck renders one batch at a time.
+# Keyed by deck meta path
+_deckLocks: Dict[str, asyncio.Lock] = {}
+# Running background prerender tasks, by deck meta path
+_prerenderTasks: Dict[str, asyncio.Task] = {}
+# The number of cards that prerendering checks for in the card store before letting other tasks run, see _prerender
+_PRERENDER_SCAN_CHUNK = 500
+
+
+def buildLazyMeta(cardData: dict) -> dict:
+    """Build the deck meta for a lazy deck from validated card data, without rendering any cards.
+    Cards already in the card store are given their stored URL, and the rest are given an empty URL.
+    Every card is hashed, as by sdbDeck.hashDeckCards.
+
+    :param dict cardData: Validated card data
+    :return: A deck meta for the card data, marked as "lazy"
+    :rtype: dict
+    """
+    store = cardStore.getStore()
+    deckMeta = {"deck_name": cardData["title"], "lazy": True, "expansions": {}}
+    for name, expansionData in cardData["expansions"].items():
+        deckMeta["expansions"][name] = {}
+        for colour in ("white", "black"):
+            deckMeta["expansions"][name][colour] = []
+            for text in expansionData[colour]:
+                textHash = cardStore.cardHash(text, colour == "black")
+                entry = store.lookup(textHash)
+                card = {"text": text, "url": entry["url"] if entry is not None else "", "hash": textHash}
+                if entry is not None and "atlas" in entry:
+                    card["atlas"] = entry["atlas"]
+                if colour == "black":
+                    card["requiredWhiteCards"] = entry["requiredWhiteCards"] if entry is not None else text.count("_")
+                deckMeta["expansions"][name][colour].append(card)
+    return deckMeta
+
+
+async def _renderBatch(deckKey: str, deckName: str, guildID: int, expansions: Dict[str, Dict[str, List[str]]]):
+    """Render, store and hash a batch of cards from a lazy deck, and record them in the card store.
+    """
+    if deckKey not in _deckLocks:
+        _deckLocks[deckKey] = asyncio.Lock()
+    async with _deckLocks[deckKey]:
+        deckMeta = await deckRendering.renderDeck({"title": deckName, "expansions": expansions}, guildID)
+        deckMeta = make_cards.store_cards_local(deckMeta)
+        # Lazy decks are shown with the default card backs, so the card backs rendered with each batch are not kept
+        for backKey in ("white_back", "black_back"):
+            if backKey in deckMeta:
+                backPath = cfg.paths.decksFolder + os.sep + url_to_local_path(deckMeta.pop(backKey))
+                if os.path.isfile(backPath):
+                    os.remove(backPath)
+        if cfg.cardStorageMethod == "discord":
+            await cardStore.uploadDeckCards(deckMeta)
+        elif cfg.cardStorageMethod != "local":
+            raise ValueError("Unsupported cfg.cardStorageMethod: " + str(cfg.cardStorageMethod))
+
+        for expansionData in deckMeta["expansions"].values():
+            for colour in ("white", "black"):
+                for cardData in (expansionData[colour] if colour in expansionData else []):
+                    cardData["hash"] = cardStore.cardHash(cardData["text"], colour == "black")
+        cardStore.getStore().addDeckCards(deckKey, deckMeta)
+        cardStore.scheduleSave()
+
+
+async def renderCards(deckKey: str, deckName: str, guildID: int, cards: List[Tuple[str, str, bool]]) -> Dict[str, dict]:
+    """Make sure that the given cards of a lazy deck are in the card store with a URL, rendering those that are not stored.
+    Cards stored in a card sheet without a URL of their own are cropped out of the sheet, see cardAtlas.
+    Cards that are already being rendered are waited for, rather than rendered again.
+
+    :param str deckKey: The path to the deck's meta file
+    :param str deckName: The name of the deck
+    :param int guildID: The ID of the guild that owns the deck
+    :param cards: The name of the expansion, text, and whether it is a black card, for each card
+    :type cards: List[Tuple[str, str, bool]]
+    :return: The card store entry of each card, by card hash. Cards that could not be rendered are left out
+    :rtype: Dict[str, dict]
+    """
+    store = cardStore.getStore()
+    entries: Dict[str, dict] = {}
+    waiting: Dict[str, Awaitable] = {}
+    rendering: Set[str] = set()
+    toRender: Dict[str, Dict[str, List[str]]] = {}
+    toCrop: Dict[str, dict] = {}
+
+    for expansionName, text, isBlack in cards:
+        textHash = cardStore.cardHash(text, isBlack)
+        if textHash in entries or textHash in waiting or textHash in rendering:
+            continue
+        entry = store.lookup(textHash)
+        if entry is not None and entry["url"]:
+            entries[textHash] = entry
+        elif textHash in _inFlight:
+            waiting[textHash] = _inFlight.waitFor(textHash)
+        else:
+            _inFlight.start(textHash)
+            rendering.add(textHash)
+            if entry is not None:
+                toCrop[textHash] = entry
+                continue
+            if expansionName not in toRender:
+                toRender[expansionName] = {"white": [], "black": []}
+            toRender[expansionName]["black" if isBlack else "white"].append(text)
+
+    if rendering:
+        try:
+            if toCrop:
+                await cardAtlas.materialiseCards(toCrop)
+            if toRender:
+                await _renderBatch(deckKey, deckName, guildID, toRender)
+        finally:
+            for textHash in rendering:
+                entry = store.lookup(textHash)
+                if entry is not None and entry["url"]:
+                    entries[textHash] = entry
+                    _inFlight.finish(textHash, entry)
+                else:
+                    _inFlight.finish(textHash, None)
+
+    for textHash, rendered in waiting.items():
+        entry = await rendered
+        if entry is not None:
+            entries[textHash] = entry
+
+    # Cards this deck shares with cards stored for other decks are now used by this deck too
+    if store.addDeckHashes(deckKey, set(entries.keys())):
+        cardStore.scheduleSave()
+
+    return entries
+
+
+async def ensureRendered(catalog, cards: list, isBlack: bool, guildID: int):
+    """Give URLs to cards drawn from a lazy deck, rendering the cards that have not been rendered yet.
+    Cards that already have a URL are left alone, so this can be called for cards drawn from any deck.
+    If a card could not be rendered, the error is logged and the card is shown as the deck's card back.
+
+    :param SDBDeckCatalog catalog: The catalog the cards were drawn from
+    :param list cards: The drawn cards. None entries are ignored
+    :param bool isBlack: Whether the cards are black cards
+    :param int guildID: The ID of the guild that owns the deck
+    """
+    missing = [card for card in cards if card is not None and not card.url]
+    if not missing:
+        return
+
+    try:
+        entries = await renderCards(catalog.metaPath, catalog.name, guildID, [(card.expansion.name, card.text, isBlack) for card in missing])
+    except Exception as e:
+        entries = {}
+        botState.logger.log("lazyRendering", "ensureRendered",
+                            "Exception occured when rendering cards drawn from lazy deck " + catalog.name,
+                            eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
+
+    for card in missing:
+        textHash = cardStore.cardHash(card.text, isBlack)
+        if textHash in entries:
+            card.url = entries[textHash]["url"]
+            if isBlack:
+                card.requiredWhiteCards = entries[textHash]["requiredWhiteCards"]
+        else:
+            card.url = catalog.emptyBlack.url if isBlack else catalog.emptyWhite.url
+
+
+async def _prerender(catalog, expansionNames: List[str], guildID: int):
+    store = cardStore.getStore()
+    batch = []
+    try:
+        for name in expansionNames:
+            expansion = catalog.getExpansion(name)
+            for table in (expansion.black, expansion.white):
+                for index in range(len(table)):
+                    # Checking a card does not await anything if it is already stored, so large decks are checked a chunk at a time
+                    if index % _PRERENDER_SCAN_CHUNK == _PRERENDER_SCAN_CHUNK - 1:
+                        await asyncio.sleep(0)
+                    if table.url(index) or store.lookup(cardStore.cardHash(table.text(index), table.isBlack)) is not None:
+                        continue
+                    batch.append((name, table.text(index), table.isBlack))
+                    if len(batch) >= cfg.lazyPrerenderBatchSize:
+                        await renderCards(catalog.metaPath, catalog.name, guildID, batch)
+                        batch = []
+        if batch:
+            await renderCards(catalog.metaPath, catalog.name, guildID, batch)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        botState.logger.log("lazyRendering", "_prerender",
+                            "Exception occured when prerendering lazy deck " + catalog.name,
+                            eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
+    finally:
+        if _prerenderTasks.get(catalog.metaPath) is asyncio.current_task():
+            del _prerenderTasks[catalog.metaPath]
+
+
+def schedulePrerender(catalog, expansionNames: List[str], guildID: int):
+    """Start rendering the unrendered cards of the given expansions of a lazy deck in the background, a batch of
+    cfg.lazyPrerenderBatchSize cards at a time. Cards drawn during a game are rendered between batches.
+    Does nothing if the deck is already being prerendered.
+
+    :param SDBDeckCatalog catalog: The deck's catalog
+    :param List[str] expansionNames: The names of the expansions to render
+    :param int guildID: The ID of the guild that owns the deck
+    """
+    if catalog.metaPath not in _prerenderTasks:
+        _prerenderTasks[catalog.metaPath] = asyncio.ensure_future(_prerender(catalog, expansionNames, guildID))
+
+
+def cancelPrerender(deckKey: str):
+    """Stop prerendering a deck, if it is being prerendered.
+
+    :param str deckKey: The path to the deck's meta file
+    """
+    if deckKey in _prerenderTasks:
+        _prerenderTasks.pop(deckKey).cancel()
@@ -2,295 +2,957 @@ import json
 # from urllib import request
 import random
 from abc import ABC, abstractmethod
-from typing import List, Dict
-from discord import Message
+from typing import List, Dict, Set, Tuple, Union
+from discord import Message, Attachment
 from datetime import datetime
 import os
 import traceback
+import weakref
+from array import array
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+import tempfile
+import time
 
 import gspread
+import requests
 from oauth2client.service_account import ServiceAccountCredentials
 
 from .. import lib
 from .. import botState
 from ..cfg import cfg
-from ..cardRenderer import make_cards
+from . import deckSnapshot, deckSources, deckValidation, cardStore, lazyRendering, deckRendering
 
 
 # use creds to create a client to interact with the Google Drive API
-scope = ['https://spreadsheets.google.com/feeds']
-creds = ServiceAccountCredentials.from_json_keyfile_name(cfg.paths.googleAPICred, scope)
-gspread_client = gspread.authorize(creds)
+scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive.metadata.readonly']
+# Drive API endpoint used to check when a spreadsheet was last modified, without fetching any cells
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/"
+# Created on first use by getSheetsClient, so that importing this module does not need credentials
+_gspreadClient: gspread.Client = None
+_gspreadClientLock = threading.Lock()
+
+
+def _sheetsRequester(client: gspread.Client):
+    """Get the object that sends a gspread client's HTTP requests. gspread 6 moved request and set_timeout from the client
+    onto its HTTP client.
+    """
+    return client.http_client if hasattr(client, "http_client") else client
+
+
+def _authorizeSheetsClient() -> gspread.Client:
+    creds = ServiceAccountCredentials.from_json_keyfile_name(cfg.paths.googleAPICred, scope)
+    client = gspread.authorize(creds)
+    # Without a timeout, a hung request would hold its deck ingestion thread forever, see _runIngestion
+    _sheetsRequester(client).set_timeout(cfg.timeouts.sheetsRequestSeconds)
+    return client
+
+
+def getSheetsClient() -> gspread.Client:
+    """Get the shared gspread client, authorizing it from cfg.paths.googleAPICred on first use.
+    gspread converts the credentials for google-auth, whose authorized session refreshes the access token as it expires.
+    Each request times out after cfg.timeouts.sheetsRequestSeconds.
+    Safe to call from the deck ingestion threads.
+
+    :return: An authorized gspread client
+    :rtype: gspread.Client
+    """
+    global _gspreadClient
+    with _gspreadClientLock:
+        if _gspreadClient is None:
+            _gspreadClient = _authorizeSheetsClient()
+        return _gspreadClient
+
+
+def benchmarkSheetsAuthorization(repeats: int = 5) -> float:
+    """Time authorizing a new gspread client from cfg.paths.googleAPICred, as getSheetsClient does on first use.
+    No requests are sent to Google. The shared client is not replaced.
+
+    :param int repeats: The number of clients to authorize (Default 5)
+    :return: The fastest authorization time in milliseconds
+    :rtype: float
+    """
+    fastest = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        _authorizeSheetsClient()
+        elapsed = (time.perf_counter() - started) * 1000
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return fastest
+
+
+def _sheetRange(sheetTitle: str) -> str:
+    """A1 notation for the white and black card columns of the sheet with the given title.
+    """
+    return "'" + sheetTitle.replace("'", "''") + "'!A:B"
+
 
 def collect_cards(sheetLink):
-    global gspread_client
+    worksheet = getSheetsClient().open_by_url(sheetLink)
+    sheetTitles = [expansion.title for expansion in worksheet.worksheets()]
+    # Fetch the card columns of every sheet in a single request
+    valueRanges = worksheet.values_batch_get([_sheetRange(title) for title in sheetTitles])["valueRanges"] if sheetTitles else []
+    builder = deckSources.DeckBuilder()
 
-    worksheet = gspread_client.open_by_url(sheetLink)
-    expansions = {}
+    for title, valueRange in zip(sheetTitles, valueRanges):
+        builder.addRow(title, [])
+        for row in valueRange.get("values", []):
+            builder.addRow(title, row)
+
+    return builder.toCardData(worksheet.title)
+
+
+def sheetRevision(sheetLink) -> Union[str, None]:
+    """Get the Drive revision of a spreadsheet, which changes whenever the spreadsheet is edited. No cell data is fetched.
+
+    :param str sheetLink: URL to the spreadsheet
+    :return: The spreadsheet's version and modification time, or None if they could not be fetched
+    :rtype: str or None
+    """
+    try:
+        response = _sheetsRequester(getSheetsClient()).request("get", DRIVE_FILES_URL + gspread.utils.extract_id_from_url(sheetLink),
+                                                               params={"fields": "version,modifiedTime", "supportsAllDrives": True})
+        metadata = response.json()
+    except Exception as e:
+        # The revision only lets unedited spreadsheets be skipped, so any failure just means reading the spreadsheet
+        botState.logger.log("sdbDeck", "sheetRevision", "Failed to fetch spreadsheet revision: " + type(e).__name__,
+                            trace=traceback.format_exception(type(e), e, e.__traceback__), eventType="REVISION_FAIL")
+        return None
+    if "version" not in metadata or "modifiedTime" not in metadata:
+        return None
+    return str(metadata["version"]) + "@" + metadata["modifiedTime"]
+
+
+def cardDataDigest(cardData: dict) -> str:
+    """Digest the expansions of card data read from a deck source, along with the current font settings.
+    Decks whose card data digest has not changed since their last update do not need to be rendered again.
+
+    :param dict cardData: Card data as returned by collect_cards or deckSources.readDeckFile
+    :return: A hex digest of the card data
+    :rtype: str
+    """
+    content = json.dumps([cardData["expansions"], cardStore.renderSettingsFingerprint()])
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def renderSettingsDigest() -> str:
+    """Digest the current font and renderer settings, see cardStore.renderSettingsFingerprint.
+    Stored next to a deck's sheet revision, so that an unedited spreadsheet is still read again after the settings change.
+
+    :return: A hex digest of the render settings
+    :rtype: str
+    """
+    return hashlib.blake2b(cardStore.renderSettingsFingerprint().encode(), digest_size=16).hexdigest()
+
+
+# Threads for running blocking deck reads. Created on first use, see _runIngestion
+_ingestionExecutor: ThreadPoolExecutor = None
+
+
+async def _runIngestion(func, *args):
+    """Run a blocking deck reading function in the deck ingestion thread pool, so that it does not block the event loop.
+    At most cfg.maxConcurrentDeckIngestions decks are read at once, further requests wait for a free thread.
+    The timeout only stops waiting for func, and cannot stop its thread. Threads are freed by the request timeout set in
+    getSheetsClient, and this timeout is a backstop for requests that keep receiving data.
+
+    :raise asyncio.TimeoutError: If func did not finish within cfg.timeouts.deckIngestionSeconds
+    """
+    global _ingestionExecutor
+    if _ingestionExecutor is None:
+        _ingestionExecutor = ThreadPoolExecutor(max_workers=cfg.maxConcurrentDeckIngestions, thread_name_prefix="deckIngestion")
+
+    return await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(_ingestionExecutor, func, *args),
+                                    cfg.timeouts.deckIngestionSeconds)
+
+
+async def fetchCards(sheetLink):
+    """Read a deck's cards from a Google spreadsheet in the deck ingestion thread pool.
+
+    :param str sheetLink: URL to the spreadsheet to read
+    :return: The spreadsheet's expansions and title, as returned by collect_cards
+    :rtype: dict
+    :raise asyncio.TimeoutError: If the spreadsheet was not read within cfg.timeouts.deckIngestionSeconds, or a request to the
+                                    Sheets API timed out
+    """
+    try:
+        return await _runIngestion(collect_cards, sheetLink)
+    except requests.exceptions.Timeout as e:
+        raise asyncio.TimeoutError() from e
 
-    for expansion in worksheet.worksheets():
-        expansions[expansion.title] = {"white": list(set(card for card in expansion.col_values(1) if card)),
-                                        "black": list(set(card for card in expansion.col_values(2) if card))}
 
-    return {"expansions": expansions, "title": worksheet.title}
+async def fetchSheetRevision(sheetLink):
+    """Get the revision of a Google spreadsheet in the deck ingestion thread pool, see sheetRevision.
+
+    :raise asyncio.TimeoutError: If the revision was not read within cfg.timeouts.deckIngestionSeconds
+    """
+    return await _runIngestion(sheetRevision, sheetLink)
+
+
+async def fetchCardsFromAttachment(attachment: Attachment):
+    """Read a deck's cards from a spreadsheet file attached to a message, in the deck ingestion thread pool.
+    The file is saved to a temporary file so that it can be streamed by deckSources.readDeckFile.
+
+    :param Attachment attachment: The attached spreadsheet file
+    :return: The file's expansions and title, as returned by deckSources.readDeckFile
+    :rtype: dict
+    :raise deckSources.DeckFileError: If the file is too large, of an unsupported type, or could not be read
+    :raise asyncio.TimeoutError: If the file was not read within cfg.timeouts.deckIngestionSeconds
+    """
+    if attachment.size > cfg.maxDeckFileBytes:
+        raise deckSources.DeckFileError("Deck files may be at most " + str(cfg.maxDeckFileBytes // 1000000) + "MB!")
+    if os.path.splitext(attachment.filename)[1].lower() not in deckSources.deckFileParsers:
+        raise deckSources.DeckFileError("Unsupported deck file type! Supported file types are: " + ", ".join(deckSources.supportedExtensions()))
+
+    with tempfile.TemporaryFile() as deckFile:
+        await attachment.save(deckFile)
+        deckFile.seek(0)
+        return await _runIngestion(deckSources.readDeckFile, deckFile, attachment.filename)
 
 
 class SDBCard(ABC):
-    def __init__(self, text, url, expansion: "SDBExpansion"):
+    # Card objects are created whenever a card is read from an SDBCardTable, so they are slotted to keep them light
+    __slots__ = ("url", "text", "expansion", "index")
+
+    def __init__(self, text, url, expansion: "SDBExpansion", index: int):
         self.url = url
         self.text = text
         self.expansion = expansion
+        self.index = index
 
     def __str__(self):
         return self.url
 
 
 class BlackCard(SDBCard):
-    def __init__(self, text, url, requiredWhiteCards, expansion):
-        super().__init__(text, url, expansion)
+    __slots__ = ("requiredWhiteCards",)
+
+    def __init__(self, text, url, requiredWhiteCards, expansion, index=-1):
+        super().__init__(text, url, expansion, index)
         self.requiredWhiteCards = requiredWhiteCards
 
 
 class WhiteCard(SDBCard):
-    def __init__(self, text, url, expansion):
-        super().__init__(text, url, expansion)
-        self.owner = None
+    __slots__ = ()
 
-    def isOwned(self):
-        return self.owner is not None
+    def __init__(self, text, url, expansion, index=-1):
+        super().__init__(text, url, expansion, index)
 
-    def claim(self, player):
-        if self.isOwned():
-            botState.logger.log("WhiteCard", "claim",
-                                "Player " + self.player.dcUser.name + "#" + str(self.player.dcUser.id) + " Attempted to claim a card that is already owned: " + self.text,
-                                eventType="ALREADY_OWNED", trace=traceback.format_exc())
-        else:
-            self.owner = player
-            self.expansion.ownedWhiteCards += 1
 
-    def revoke(self):
-        if not self.isOwned():
-            botState.logger.log("WhiteCard", "revoke",
-                                "Player " + self.player.dcUser.name + "#" + str(self.player.dcUser.id) + " Attempted to revoke a card that is not owned: " + self.text,
-                                eventType="NOT_OWNED", trace=traceback.format_exc())
-        else:
-            self.owner = None
-            self.expansion.ownedWhiteCards -= 1
+class SDBURLPrefixes:
+    """A table of URL prefixes shared by the cards of a deck. Card URLs in a deck differ only in their last couple of path
+    segments (the attachment ID and file name, or the expansion folder and card file), so each card only stores the
+    index of its prefix and the remaining suffix.
+    """
+    __slots__ = ("prefixes", "_prefixIndices")
 
+    def __init__(self, prefixes: List[str] = []):
+        self.prefixes: List[str] = list(prefixes)
+        self._prefixIndices: Dict[str, int] = {prefix: index for index, prefix in enumerate(self.prefixes)}
 
-class SDBExpansion:
-    def __init__(self):
-        self.white = []
-        self.black = []
-        self.ownedWhiteCards = 0
 
-    def allOwned(self):
-        return self.ownedWhiteCards == len(self.white)
+    def split(self, url: str) -> Tuple[int, str]:
+        """Split a URL into the index of its prefix in this table, and its suffix. New prefixes are added to the table.
+        """
+        splitPoint = url.rfind("/", 0, url.rfind("/")) + 1
+        prefix = url[:splitPoint]
+        if prefix not in self._prefixIndices:
+            self._prefixIndices[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix)
+        return self._prefixIndices[prefix], url[splitPoint:]
 
-    def emptyBoth(self):
-        self.white = []
-        self.black = []
-        self.ownedWhiteCards = 0
 
-    def emptyWhite(self):
-        self.white = []
+class SDBCardTable:
+    """Struct-of-arrays storage for the cards of a single colour in an expansion.
+    Card text and URL suffixes are concatenated into UTF-8 byte strings, indexed by arrays of end offsets.
+    Indexing the table builds a new WhiteCard or BlackCard for the card with that index.
 
-    def emptyBlack(self):
-        self.black = []
+    A table's state is a tuple of byte strings, see toState. This is the form stored in deck snapshots.
+    """
+    __slots__ = ("expansion", "isBlack", "_urlPrefixes", "_texts", "_textEnds", "_urlPrefixIndices", "_urlSuffixes", "_urlSuffixEnds",
+                    "_requiredWhiteCards")
 
-    def whiteIsEmpty(self):
-        return self.white == []
+    def __init__(self, expansion: "SDBExpansion", isBlack: bool, urlPrefixes: SDBURLPrefixes, state: Tuple[bytes, ...]):
+        self.expansion = expansion
+        self.isBlack = isBlack
+        self._urlPrefixes = urlPrefixes
+        self._texts, textEnds, urlPrefixIndices, self._urlSuffixes, urlSuffixEnds, requiredWhiteCards = state
+        self._textEnds = array("I", textEnds)
+        self._urlPrefixIndices = array("I", urlPrefixIndices)
+        self._urlSuffixEnds = array("I", urlSuffixEnds)
+        self._requiredWhiteCards = array("H", requiredWhiteCards)
 
-    def blackIsEmpty(self):
-        return self.black == []
 
+    @staticmethod
+    def stateFromMeta(cardsData: List[dict], isBlack: bool, urlPrefixes: SDBURLPrefixes) -> Tuple[bytes, ...]:
+        """Pack a list of card dictionaries from a deck meta file into a table state.
+        """
+        textEnds = array("I")
+        urlPrefixIndices = array("I")
+        urlSuffixEnds = array("I")
+        # Two bytes per card, see deckValidation.MAX_WHITE_CARD_SLOTS
+        requiredWhiteCards = array("H")
+        texts = bytearray()
+        urlSuffixes = bytearray()
 
-class SDBDeck:
-    def __init__(self, metaPath: str):
-        # deckMeta = json.load(request.urlopen(metaUrl))
-        deckMeta = lib.jsonHandler.readJSON(metaPath)
+        for cardData in cardsData:
+            texts += cardData["text"].encode()
+            textEnds.append(len(texts))
+            prefixIndex, suffix = urlPrefixes.split(cardData["url"])
+            urlPrefixIndices.append(prefixIndex)
+            urlSuffixes += suffix.encode()
+            urlSuffixEnds.append(len(urlSuffixes))
+            if isBlack:
+                requiredWhiteCards.append(cardData["requiredWhiteCards"])
 
-        if "expansions" not in deckMeta or deckMeta["expansions"] == {}:
-            raise RuntimeError("Attempted to create an empty SDBDeck")
+        return bytes(texts), textEnds.tobytes(), urlPrefixIndices.tobytes(), bytes(urlSuffixes), urlSuffixEnds.tobytes(), requiredWhiteCards.tobytes()
+
+
+    def toState(self) -> Tuple[bytes, ...]:
+        return self._texts, self._textEnds.tobytes(), self._urlPrefixIndices.tobytes(), self._urlSuffixes, \
+                self._urlSuffixEnds.tobytes(), self._requiredWhiteCards.tobytes()
+
+
+    def __len__(self) -> int:
+        return len(self._textEnds)
+
+
+    def text(self, index: int) -> str:
+        return self._texts[self._textEnds[index - 1] if index else 0:self._textEnds[index]].decode()
+
+
+    def url(self, index: int) -> str:
+        suffix = self._urlSuffixes[self._urlSuffixEnds[index - 1] if index else 0:self._urlSuffixEnds[index]].decode()
+        return self._urlPrefixes.prefixes[self._urlPrefixIndices[index]] + suffix
 
-        self.expansionNames: List[str] = list(deckMeta["expansions"].keys())
-        self.unseenCards: Dict[str, SDBExpansion] = {expansion : SDBExpansion() for expansion in self.expansionNames}
-        self.seenCards: Dict[str, SDBExpansion] = {expansion : SDBExpansion() for expansion in self.expansionNames}
-        self.name: str = deckMeta["deck_name"]
-        hasWhiteCards: bool = False
-        hasBlackCards: bool = False
-
-        for expansion in self.expansionNames:
-            if "white" in deckMeta["expansions"][expansion]:
-                for cardData in deckMeta["expansions"][expansion]["white"]:
-                    self.unseenCards[expansion].white.append(WhiteCard(cardData["text"], cardData["url"], self.unseenCards[expansion]))
-            if "black" in deckMeta["expansions"][expansion]:
-                for cardData in deckMeta["expansions"][expansion]["black"]:
-                    self.unseenCards[expansion].black.append(BlackCard(cardData["text"], cardData["url"], cardData["requiredWhiteCards"], self.unseenCards[expansion]))
-
-            if not hasWhiteCards:
-                hasWhiteCards = len(self.unseenCards[expansion].white) != 0
-            if not hasBlackCards:
-                hasBlackCards = len(self.unseenCards[expansion].black) != 0
-
-        if not hasWhiteCards:
+
+    def __getitem__(self, index: int) -> SDBCard:
+        if index < 0 or index >= len(self):
+            raise IndexError("Card index out of range: " + str(index))
+        if self.isBlack:
+            return BlackCard(self.text(index), self.url(index), self._requiredWhiteCards[index], self.expansion, index)
+        return WhiteCard(self.text(index), self.url(index), self.expansion, index)
+
+
+class SDBExpansion:
+    """The cards of a single expansion pack. Cards are never modified once the expansion is built,
+    and are shared by every game playing with the expansion's deck.
+    """
+    __slots__ = ("name", "white", "black")
+
+    def __init__(self, name: str, whiteState: Tuple[bytes, ...], blackState: Tuple[bytes, ...], urlPrefixes: SDBURLPrefixes):
+        self.name = name
+        self.white = SDBCardTable(self, False, urlPrefixes, whiteState)
+        self.black = SDBCardTable(self, True, urlPrefixes, blackState)
+
+
+    @classmethod
+    def fromMeta(cls, name: str, expansionData: dict, urlPrefixes: SDBURLPrefixes) -> "SDBExpansion":
+        return SDBExpansion(name, SDBCardTable.stateFromMeta(expansionData["white"] if "white" in expansionData else [], False, urlPrefixes),
+                            SDBCardTable.stateFromMeta(expansionData["black"] if "black" in expansionData else [], True, urlPrefixes),
+                            urlPrefixes)
+
+
+class SDBDeckCatalog:
+    """The parsed, immutable contents of a deck meta file. Catalogs are shared between games, see loadCatalog.
+
+    When built from a snapshot, expansions are only unpacked the first time they are requested with getExpansion,
+    so games playing with a few expansions of a large deck never decode the rest.
+    """
+    def __init__(self, name: str, expansionCounts: Dict[str, Tuple[int, int]], urlPrefixes: SDBURLPrefixes,
+                    whiteBack: str = None, blackBack: str = None, expansions: Dict[str, SDBExpansion] = {},
+                    snapshot: deckSnapshot.DeckSnapshot = None):
+        if expansionCounts == {}:
+            raise RuntimeError("Attempted to create an empty SDBDeck")
+        if not any(whiteCount for whiteCount, _ in expansionCounts.values()):
             raise RuntimeError("Attempted to create a deck with no white cards")
-        elif not hasBlackCards:
+        elif not any(blackCount for _, blackCount in expansionCounts.values()):
             raise RuntimeError("Attempted to create a deck with no black cards")
 
-        self.emptyBlack: BlackCard = BlackCard("EMPTY", deckMeta["black_back"] if "black_back" in deckMeta else cfg.emptyBlackCard, 0, list(self.unseenCards.values())[0])
-        self.emptyWhite: WhiteCard = WhiteCard("EMPTY", deckMeta["white_back"] if "white_back" in deckMeta else cfg.emptyWhiteCard, list(self.unseenCards.values())[0])
+        self.name = name
+        # The number of white and black cards in each expansion
+        self.expansionCounts = expansionCounts
+        self.expansionNames: List[str] = list(expansionCounts.keys())
+        self.urlPrefixes = urlPrefixes
+        self.whiteBack = whiteBack
+        self.blackBack = blackBack
+        self._expansions: Dict[str, SDBExpansion] = dict(expansions)
+        self._snapshot = snapshot
+        # The path to the deck meta file the catalog was loaded from, set by loadCatalog
+        self.metaPath: str = None
+
+        self.emptyBlack: BlackCard = BlackCard("EMPTY", blackBack if blackBack is not None else cfg.emptyBlackCard, 0, None)
+        self.emptyWhite: WhiteCard = WhiteCard("EMPTY", whiteBack if whiteBack is not None else cfg.emptyWhiteCard, None)
+
+
+    def getExpansion(self, name: str) -> SDBExpansion:
+        if name not in self._expansions:
+            if name not in self.expansionCounts:
+                raise KeyError("Unknown expansion for deck " + self.name + ": " + name)
+            whiteState, blackState = self._snapshot.readExpansion(name)
+            self._expansions[name] = SDBExpansion(name, whiteState, blackState, self.urlPrefixes)
+        return self._expansions[name]
+
+
+    @classmethod
+    def fromMeta(cls, deckMeta: dict) -> "SDBDeckCatalog":
+        if "expansions" not in deckMeta:
+            raise RuntimeError("Attempted to create an empty SDBDeck")
 
+        urlPrefixes = SDBURLPrefixes()
+        expansions = {name: SDBExpansion.fromMeta(name, expansionData, urlPrefixes) for name, expansionData in deckMeta["expansions"].items()}
+        return SDBDeckCatalog(deckMeta["deck_name"], {name: (len(expansion.white), len(expansion.black)) for name, expansion in expansions.items()},
+                                urlPrefixes, whiteBack=deckMeta["white_back"] if "white_back" in deckMeta else None,
+                                blackBack=deckMeta["black_back"] if "black_back" in deckMeta else None, expansions=expansions)
+
+
+    @classmethod
+    def fromSnapshot(cls, snapshot: deckSnapshot.DeckSnapshot) -> "SDBDeckCatalog":
+        return SDBDeckCatalog(snapshot.name, snapshot.expansionCounts, SDBURLPrefixes(snapshot.urlPrefixes),
+                                whiteBack=snapshot.whiteBack, blackBack=snapshot.blackBack, snapshot=snapshot)
+
+
+    def toSnapshot(self) -> dict:
+        expansions = []
+        for name in self.expansionNames:
+            expansion = self.getExpansion(name)
+            expansions.append((name, len(expansion.white), len(expansion.black), expansion.white.toState(), expansion.black.toState()))
+        return {"name": self.name, "whiteBack": self.whiteBack, "blackBack": self.blackBack, "urlPrefixes": self.urlPrefixes.prefixes,
+                "expansions": expansions}
+
+
+# Catalogs currently in use by at least one game or reservation, keyed by meta path and last update time.
+# Entries are dropped automatically once no game holds a reference to them.
+_loadedCatalogs: "weakref.WeakValueDictionary[Tuple[str, float], SDBDeckCatalog]" = weakref.WeakValueDictionary()
+
+
+def loadCatalog(metaPath: str, lastUpdate: float) -> SDBDeckCatalog:
+    """Get the catalog for the given deck meta file, building it only if no running game is already using it.
+    Catalogs are built from the deck's snapshot, which is first rebuilt from the meta JSON if it is missing or out of date.
+    """
+    key = (metaPath, lastUpdate)
+    catalog = _loadedCatalogs.get(key)
+    if catalog is None:
+        snapshot = deckSnapshot.openSnapshot(metaPath)
+        if snapshot is None:
+            # deckMeta = json.load(request.urlopen(metaUrl))
+            catalog = SDBDeckCatalog.fromMeta(lib.jsonHandler.readJSON(metaPath))
+            deckSnapshot.writeSnapshot(metaPath, catalog.toSnapshot())
+        else:
+            catalog = SDBDeckCatalog.fromSnapshot(snapshot)
+        catalog.metaPath = metaPath
+        _loadedCatalogs[key] = catalog
+    return catalog
+
+
+def evictCatalog(metaPath: str):
+    """Stop handing out the loaded catalogs for a deck meta file, so that the next game to load it builds a fresh one.
+    Use when the meta changes without its last update time changing, such as when the deck is renamed.
+    Games already holding a catalog keep it.
+    """
+    for key in [key for key in _loadedCatalogs.keys() if key[0] == metaPath]:
+        _loadedCatalogs.pop(key, None)
+
+
+def saveSnapshot(metaPath: str, deckMeta: dict):
+    """Write a fresh snapshot for a deck meta file that has just been written, so the next game to load it can skip parsing JSON.
+    """
+    deckSnapshot.writeSnapshot(metaPath, SDBDeckCatalog.fromMeta(deckMeta).toSnapshot())
+
+
+def syntheticDeckMeta(numExpansions: int, numCards: int) -> dict:
+    """Build a rendered deck meta of made up cards for benchmarking, two thirds of them white.
+    Card URLs share a Discord attachment prefix, as real decks stored in a card storage channel do.
+    """
+    deckMeta = {"deck_name": "benchmark", "white_back": "https://cdn.discordapp.com/attachments/0/0/white_back.png",
+                "black_back": "https://cdn.discordapp.com/attachments/0/0/black_back.png", "expansions": {}}
+    for cardNum in range(numCards):
+        expansion = deckMeta["expansions"].setdefault("expansion " + str(cardNum % numExpansions), {"white": [], "black": []})
+        url = "https://cdn.discordapp.com/attachments/0/" + str(cardNum) + "/card.png"
+        if cardNum % 3:
+            expansion["white"].append({"text": "white card number " + str(cardNum), "url": url})
+        else:
+            expansion["black"].append({"text": "black card _ number " + str(cardNum), "url": url, "requiredWhiteCards": 1})
+    return deckMeta
+
+
+def benchmarkCatalogLoad(metaPath: str, repeats: int = 10) -> Dict[str, float]:
+    """Time building a catalog by parsing a deck meta's JSON, against opening its snapshot, as loadCatalog would without a cached catalog.
+    The snapshot is written first if it is missing or out of date.
+
+    :param str metaPath: Path to the deck meta JSON file
+    :param int repeats: The number of times to load the deck each way (Default 10)
+    :return: The mean milliseconds to parse the JSON and build a catalog under "json", to open the snapshot and build a catalog
+                under "snapshot", and to do so and also unpack every expansion under "snapshotAllExpansions"
+    :rtype: Dict[str, float]
+    """
+    if deckSnapshot.openSnapshot(metaPath) is None:
+        deckSnapshot.writeSnapshot(metaPath, SDBDeckCatalog.fromMeta(lib.jsonHandler.readJSON(metaPath)).toSnapshot())
+
+    def loadJSON():
+        SDBDeckCatalog.fromMeta(lib.jsonHandler.readJSON(metaPath))
+
+    def loadSnapshot():
+        SDBDeckCatalog.fromSnapshot(deckSnapshot.openSnapshot(metaPath))
+
+    def loadSnapshotAllExpansions():
+        catalog = SDBDeckCatalog.fromSnapshot(deckSnapshot.openSnapshot(metaPath))
+        for name in catalog.expansionNames:
+            catalog.getExpansion(name)
+
+    results = {}
+    for methodName, method in (("json", loadJSON), ("snapshot", loadSnapshot), ("snapshotAllExpansions", loadSnapshotAllExpansions)):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            method()
+        results[methodName] = (time.perf_counter() - started) * 1000 / repeats
+    return results
+
+
+def buildDeckStats(deckMeta: dict) -> dict:
+    """Count the cards in a rendered deck meta file, so that card counts never need to be taken from card lists again.
+    Stats are stored in the deck meta under "stats", and copied into the guild's deck record with applyDeckStats.
+    requiredWhiteCards histograms are keyed by the number of required white cards as a string, for JSON compatibility.
+
+    :param dict deckMeta: The deck meta to count cards in
+    :return: Total and per-expansion white and black card counts, and histograms of black card requiredWhiteCards
+    :rtype: dict
+    """
+    expansions = {}
+    totalHistogram = {}
+    for name, expansionData in deckMeta["expansions"].items():
+        blackCards = expansionData["black"] if "black" in expansionData else []
+        histogram = {}
+        for cardData in blackCards:
+            requiredWhiteCards = str(cardData["requiredWhiteCards"])
+            histogram[requiredWhiteCards] = histogram.get(requiredWhiteCards, 0) + 1
+            totalHistogram[requiredWhiteCards] = totalHistogram.get(requiredWhiteCards, 0) + 1
+        expansions[name] = {"white": len(expansionData["white"]) if "white" in expansionData else 0, "black": len(blackCards),
+                            "required_white_cards": histogram}
+
+    return {"expansions": expansions, "white_count": sum(expansion["white"] for expansion in expansions.values()),
+            "black_count": sum(expansion["black"] for expansion in expansions.values()), "required_white_cards": totalHistogram}
+
+
+def hashDeckCards(deckMeta: dict):
+    """Record the content hash of every card in a rendered deck meta, under the card's "hash" key.
+    Cards that already have a hash keep it.
+    """
+    for expansionData in deckMeta["expansions"].values():
+        for colour in ("white", "black"):
+            if colour in expansionData:
+                for cardData in expansionData[colour]:
+                    if "hash" not in cardData:
+                        cardData["hash"] = cardStore.cardHash(cardData["text"], colour == "black")
+
+
+def splitDeckChanges(oldMeta: dict, newCardData: dict) -> Tuple[dict, dict, List[str]]:
+    """Compare the content hashes of a deck's rendered cards with newly read card data, to find the expansions that need updating.
+    Cards rendered before hashes were recorded are assumed to have been rendered with the current font settings.
+
+    Only expansions containing an added, removed or changed card are included in the returned old meta and new card data.
+    Within those expansions, cards whose text is unchanged but whose hash differs are left out of the old meta,
+    so that they are rendered again.
+
+    :param dict oldMeta: The deck's current meta
+    :param dict newCardData: The deck's new card texts, as returned by collect_cards
+    :return: The old meta and new card data restricted to changed expansions, and the names of unchanged expansions
+    :rtype: Tuple[dict, dict, List[str]]
+    """
+    changedOld = {key: value for key, value in oldMeta.items() if key != "expansions"}
+    changedOld["expansions"] = {}
+    changedNew = {key: value for key, value in newCardData.items() if key != "expansions"}
+    changedNew["expansions"] = {}
+    unchanged = []
+
+    for name, expansionData in newCardData["expansions"].items():
+        if name not in oldMeta["expansions"]:
+            changedNew["expansions"][name] = expansionData
+            continue
+
+        oldExpansion = oldMeta["expansions"][name]
+        keptCards = {}
+        expansionChanged = False
+        for colour in ("white", "black"):
+            oldCards = oldExpansion[colour] if colour in oldExpansion else []
+            newHashes = {cardStore.cardHash(text, colour == "black") for text in expansionData[colour]}
+            keptCards[colour] = [cardData for cardData in oldCards
+                                    if (cardData["hash"] if "hash" in cardData else cardStore.cardHash(cardData["text"], colour == "black")) in newHashes]
+            if len(keptCards[colour]) != len(oldCards) or len(keptCards[colour]) != len(newHashes):
+                expansionChanged = True
+
+        if expansionChanged:
+            changedOld["expansions"][name] = {key: value for key, value in oldExpansion.items() if key not in ("white", "black")}
+            # Cards whose text is still in the sheet but whose hash changed must be rendered again, so drop their old renders
+            for colour in ("white", "black"):
+                keptTexts = {cardData["text"] for cardData in keptCards[colour]}
+                newTexts = set(expansionData[colour])
+                changedOld["expansions"][name][colour] = [cardData for cardData in (oldExpansion[colour] if colour in oldExpansion else [])
+                                                            if cardData["text"] in keptTexts or cardData["text"] not in newTexts]
+            changedNew["expansions"][name] = expansionData
+        else:
+            unchanged.append(name)
 
-    def popRandomWhite(self, expansions=[]):
-        if expansions == []:
-            expansions = self.expansionNames
+    for name, expansionData in oldMeta["expansions"].items():
+        if name not in newCardData["expansions"]:
+            changedOld["expansions"][name] = expansionData
+
+    return changedOld, changedNew, unchanged
+
+
+def applyDeckStats(deckRecord: dict, stats: dict):
+    """Update the card counts in a guild's deck record from stats built by buildDeckStats.
+    """
+    deckRecord["expansions"] = {name: (expansion["white"], expansion["black"]) for name, expansion in stats["expansions"].items()}
+    deckRecord["white_count"] = stats["white_count"]
+    deckRecord["black_count"] = stats["black_count"]
+    deckRecord["required_white_cards"] = stats["required_white_cards"]
+
+
+class SDBExpansionDrawState:
+    """One game's draw state for a single expansion.
+
+    White cards are held as an array of card indices, partitioned into three contiguous regions:
+    [unseen and free | unseen and owned | seen]. whitePositions maps each card index back to its place in
+    whiteOrder, so that cards can be moved between regions by swapping in constant time.
+    Black cards are partitioned the same way, without the owned region.
+    """
+    def __init__(self, expansion: SDBExpansion):
+        self.expansion = expansion
+
+        self.whiteOrder = array("I", range(len(expansion.white)))
+        self.whitePositions = array("I", range(len(expansion.white)))
+        self.freeWhiteEnd = len(expansion.white)
+        self.unseenWhiteEnd = len(expansion.white)
+        self.ownedWhite: Set[int] = set()
+
+        self.blackOrder = array("I", range(len(expansion.black)))
+        self.unseenBlackEnd = len(expansion.black)
+
+        # ExpansionSamplers indexing this expansion, and this expansion's index within each of them
+        self.samplers: List[Tuple[ExpansionSampler, int]] = []
+
+
+    def _swapWhite(self, pos1: int, pos2: int):
+        card1, card2 = self.whiteOrder[pos1], self.whiteOrder[pos2]
+        self.whiteOrder[pos1], self.whiteOrder[pos2] = card2, card1
+        self.whitePositions[card1], self.whitePositions[card2] = pos2, pos1
+
+
+    def freeWhiteCount(self) -> int:
+        return self.freeWhiteEnd
+
+
+    def unseenBlackCount(self) -> int:
+        return self.unseenBlackEnd
+
+
+    def _freeWhiteChanged(self, delta: int):
+        for sampler, index in self.samplers:
+            sampler.freeWhite.add(index, delta)
 
-        if False not in (self.unseenCards[expansion].whiteIsEmpty() for expansion in expansions):
-            if False in (self.seenCards[expansion].whiteIsEmpty() for expansion in expansions):
-                for expansion in self.expansionNames:
-                    self.unseenCards[expansion].white = self.seenCards[expansion].white
-                    self.seenCards[expansion].emptyWhite()
-                self.unseenCards[expansion].ownedWhiteCards = self.seenCards[expansion].ownedWhiteCards
-                self.seenCards[expansion].ownedWhiteCards = 0
-            else:
-                raise ValueError("No white cards in any of the given expansions, and no seen cards available for swap: " + ", ".join(expansions))
-        
-        noFreeCards = True
-        for expansion in expansions:
-            if not self.unseenCards[expansion].allOwned():
-                noFreeCards = False
-                break
-        if noFreeCards:
-            botState.logger.log("SDBDeck", "popRandomWhite",
-                                "All white cards are already owned in the given expansions: " + ", ".join(expansions),
-                                eventType="ALL_OWNED", trace=traceback.traceback.format_exc())
-            return None
-
-        expansion = random.choice(expansions)
-        while len(self.unseenCards[expansion].white) == 0 or self.unseenCards[expansion].allOwned():
-            expansion = random.choice(expansions)
-
-        card: WhiteCard = random.choice(self.unseenCards[expansion].white)
-        while card.isOwned():
-            card = random.choice(self.unseenCards[expansion].white)
-
-        card.expansion.ownedWhiteCards -= 1
-        card.expansion = self.seenCards[expansion]
-        card.expansion.ownedWhiteCards += 1
-        self.unseenCards[expansion].white.remove(card)
-        self.seenCards[expansion].white.append(card)
-
-        return card
-    
-
-    def randomBlack(self, expansions=[]):
-        if expansions == []:
-            expansions = self.expansionNames
-        
-        if False not in (self.unseenCards[expansion].blackIsEmpty() for expansion in expansions):
-            if False in (self.seenCards[expansion].blackIsEmpty() for expansion in expansions):
-                for expansion in self.expansionNames:
-                    self.unseenCards[expansion].black = self.seenCards[expansion].black
-                    self.seenCards[expansion].emptyBlack()
-            else:
-                raise ValueError("No black cards in any of the given expansions, and no seen cards available for swap: " + ", ".join(expansions))
 
-        expansion = random.choice(expansions)
-        while len(self.unseenCards[expansion].black) == 0:
-            expansion = random.choice(expansions)
+    def _unseenBlackChanged(self, delta: int):
+        for sampler, index in self.samplers:
+            sampler.unseenBlack.add(index, delta)
 
-        card = random.choice(self.unseenCards[expansion].black)
-        card.expansion = self.seenCards[expansion]
-        self.unseenCards[expansion].black.remove(card)
-        self.seenCards[expansion].black.append(card)
 
-        return card
+    def popFreeWhite(self) -> WhiteCard:
+        """Move a random unseen, unowned white card into the seen region, and return it.
+        The expansion must have at least one free white card.
+        """
+        self.freeWhiteEnd -= 1
+        self._swapWhite(random.randint(0, self.freeWhiteEnd), self.freeWhiteEnd)
+        self.unseenWhiteEnd -= 1
+        self._swapWhite(self.freeWhiteEnd, self.unseenWhiteEnd)
+        self._freeWhiteChanged(-1)
+        return self.expansion.white[self.whiteOrder[self.unseenWhiteEnd]]
+
+
+    def popUnseenBlack(self) -> BlackCard:
+        """Move a random unseen black card into the seen region, and return it.
+        The expansion must have at least one unseen black card.
+        """
+        self.unseenBlackEnd -= 1
+        pos = random.randint(0, self.unseenBlackEnd)
+        self.blackOrder[pos], self.blackOrder[self.unseenBlackEnd] = self.blackOrder[self.unseenBlackEnd], self.blackOrder[pos]
+        self._unseenBlackChanged(-1)
+        return self.expansion.black[self.blackOrder[self.unseenBlackEnd]]
+
+
+    def isOwned(self, index: int) -> bool:
+        return index in self.ownedWhite
+
+
+    def claimWhite(self, index: int):
+        self.ownedWhite.add(index)
+        pos = self.whitePositions[index]
+        if pos < self.freeWhiteEnd:
+            self.freeWhiteEnd -= 1
+            self._swapWhite(pos, self.freeWhiteEnd)
+            self._freeWhiteChanged(-1)
+
+
+    def revokeWhite(self, index: int):
+        self.ownedWhite.discard(index)
+        pos = self.whitePositions[index]
+        if self.freeWhiteEnd <= pos < self.unseenWhiteEnd:
+            self._swapWhite(pos, self.freeWhiteEnd)
+            self.freeWhiteEnd += 1
+            self._freeWhiteChanged(1)
+
+
+    def reshuffleWhite(self):
+        """Mark all white cards as unseen. Cost is proportional to the number of owned cards, not the size of the expansion.
+        """
+        oldFreeWhite = self.freeWhiteEnd
+        self.freeWhiteEnd = self.unseenWhiteEnd = len(self.whiteOrder)
+        for index in self.ownedWhite:
+            self.freeWhiteEnd -= 1
+            self._swapWhite(self.whitePositions[index], self.freeWhiteEnd)
+        self._freeWhiteChanged(self.freeWhiteEnd - oldFreeWhite)
+
+
+    def reshuffleBlack(self):
+        self._unseenBlackChanged(len(self.blackOrder) - self.unseenBlackEnd)
+        self.unseenBlackEnd = len(self.blackOrder)
+
+
+class ExpansionSampler:
+    """Picks cards uniformly across a set of expansions, by first picking an expansion with probability
+    proportional to its number of drawable cards. Drawable card counts are held in prefix-sum trees, which the
+    sampled expansions keep up to date as cards are drawn, claimed, revoked and reshuffled.
+    Each pick costs O(log E) for E expansions.
+    """
+    def __init__(self, expansions: List[SDBExpansionDrawState]):
+        self.expansions = expansions
+        self.freeWhite = lib.fenwickTree.FenwickTree([expansion.freeWhiteCount() for expansion in expansions])
+        self.unseenBlack = lib.fenwickTree.FenwickTree([expansion.unseenBlackCount() for expansion in expansions])
+        self.hasWhiteCards = any(expansion.whiteOrder for expansion in expansions)
+        self.hasBlackCards = any(expansion.blackOrder for expansion in expansions)
+        for index, expansion in enumerate(expansions):
+            expansion.samplers.append((self, index))
+
+
+    def pickWhiteExpansion(self) -> SDBExpansionDrawState:
+        """Pick an expansion weighted by free white cards. At least one expansion must have a free white card.
+        """
+        return self.expansions[self.freeWhite.find(random.randrange(self.freeWhite.total()))]
+
+
+    def pickBlackExpansion(self) -> SDBExpansionDrawState:
+        """Pick an expansion weighted by unseen black cards. At least one expansion must have an unseen black card.
+        """
+        return self.expansions[self.unseenBlack.find(random.randrange(self.unseenBlack.total()))]
+
+
+class SDBDeck:
+    """A single game's view of a deck: which cards of the game's expansions have been seen, and which are in players' hands.
+    Card data is held in the shared catalog.
+    """
+    def __init__(self, catalog: SDBDeckCatalog, expansionNames: List[str]):
+        self.catalog = catalog
+        self.name: str = catalog.name
+        self.expansionNames = expansionNames
+        self.emptyWhite: WhiteCard = catalog.emptyWhite
+        self.emptyBlack: BlackCard = catalog.emptyBlack
+        self.drawStates: Dict[str, SDBExpansionDrawState] = {expansion: SDBExpansionDrawState(catalog.getExpansion(expansion)) for expansion in expansionNames}
+        self.sampler = ExpansionSampler(list(self.drawStates.values()))
+
+
+    def isOwned(self, card: WhiteCard) -> bool:
+        return self.drawStates[card.expansion.name].isOwned(card.index)
+
+
+    def claimWhite(self, card: WhiteCard, player):
+        if self.isOwned(card):
+            botState.logger.log("SDBDeck", "claimWhite",
+                                "Player " + player.dcUser.name + "#" + str(player.dcUser.id) + " Attempted to claim a card that is already owned: " + card.text,
+                                eventType="ALREADY_OWNED", trace=traceback.format_exc())
+        else:
+            self.drawStates[card.expansion.name].claimWhite(card.index)
+
+
+    def revokeWhite(self, card: WhiteCard):
+        if not self.isOwned(card):
+            botState.logger.log("SDBDeck", "revokeWhite",
+                                "Attempted to revoke a card that is not owned: " + card.text,
+                                eventType="NOT_OWNED", trace=traceback.format_exc())
+        else:
+            self.drawStates[card.expansion.name].revokeWhite(card.index)
+
+
+    def popRandomWhite(self):
+        if self.sampler.freeWhite.total() == 0:
+            if not self.sampler.hasWhiteCards:
+                raise ValueError("No white cards in any of the given expansions: " + ", ".join(self.expansionNames))
+
+            for expansion in self.sampler.expansions:
+                expansion.reshuffleWhite()
+
+            if self.sampler.freeWhite.total() == 0:
+                botState.logger.log("SDBDeck", "popRandomWhite",
+                                    "All white cards are already owned in the given expansions: " + ", ".join(self.expansionNames),
+                                    eventType="ALL_OWNED")
+                return None
+
+        return self.sampler.pickWhiteExpansion().popFreeWhite()
+
+
+    def deal(self, players: list, slotsNeeded: List[int]) -> Dict[object, List[WhiteCard]]:
+        """Draw and claim white cards for several players in one pass.
+
+        :param list players: The SDBPlayers to deal cards to
+        :param List[int] slotsNeeded: The number of cards to deal to each player in players
+        :return: The cards dealt to each player. A card is None if no free white cards were left to draw
+        :rtype: Dict[SDBPlayer, List[WhiteCard]]
+        """
+        dealt = {}
+        for player, numCards in zip(players, slotsNeeded):
+            dealt[player] = []
+            for _ in range(numCards):
+                card = self.popRandomWhite()
+                if card is not None:
+                    self.claimWhite(card, player)
+                dealt[player].append(card)
+        return dealt
+
+
+    def randomBlack(self):
+        if self.sampler.unseenBlack.total() == 0:
+            if not self.sampler.hasBlackCards:
+                raise ValueError("No black cards in any of the given expansions: " + ", ".join(self.expansionNames))
+
+            for expansion in self.sampler.expansions:
+                expansion.reshuffleBlack()
+
+        return self.sampler.pickBlackExpansion().popUnseenBlack()
+
+
+async def _finishUnchangedUpdate(callingMsg: Message, bGuild, deckName: str):
+    bGuild.decks[deckName]["last_update"] = datetime.utcnow().timestamp()
+    bGuild.decks[deckName]["updating"] = False
+    await callingMsg.reply("Update complete, no changes found!")
 
 
 async def updateDeck(callingMsg: Message, bGuild, deckName: str):
+    fromFile = "source" in bGuild.decks[deckName] and bGuild.decks[deckName]["source"] == "file"
+    if fromFile and not callingMsg.attachments:
+        await callingMsg.reply(":x: This deck was created from a file! Please attach the updated file to your message.")
+        bGuild.decks[deckName]["updating"] = False
+        return
+
     loadingMsg = await callingMsg.reply("Reading spreadsheet... " + cfg.defaultEmojis.loading.sendable)
 
     try:
-        newCardData = collect_cards(bGuild.decks[deckName]["spreadsheet_url"])
+        revision = None
+        if fromFile:
+            newCardData = await fetchCardsFromAttachment(callingMsg.attachments[0])
+        else:
+            # Check the spreadsheet's revision before fetching any cells, and skip the update if it has not been edited.
+            # Changed render settings change every card's hash, so the cards are still read to find the cards to render again
+            revision = await fetchSheetRevision(bGuild.decks[deckName]["spreadsheet_url"])
+            if revision is not None and bGuild.decks[deckName].get("sheet_revision") == revision \
+                    and bGuild.decks[deckName].get("render_settings_digest") == renderSettingsDigest():
+                await loadingMsg.edit(content="Reading spreadsheet... " + cfg.defaultEmojis.submit.sendable)
+                await _finishUnchangedUpdate(callingMsg, bGuild, deckName)
+                return
+            newCardData = await fetchCards(bGuild.decks[deckName]["spreadsheet_url"])
         await loadingMsg.edit(content="Reading spreadsheet... " + cfg.defaultEmojis.submit.sendable)
     except gspread.SpreadsheetNotFound:
         await callingMsg.reply(":x: Unrecognised spreadsheet! Please make sure the file exists and is public.")
         bGuild.decks[deckName]["updating"] = False
         return
+    except deckSources.DeckFileError as e:
+        await callingMsg.reply(":x: " + str(e))
+        bGuild.decks[deckName]["updating"] = False
+        return
+    except asyncio.TimeoutError:
+        await callingMsg.reply(":x: Reading your spreadsheet took too long! Please try again later.")
+        bGuild.decks[deckName]["updating"] = False
+        return
     else:
-        lowerExpansions = [expansion.lower() for expansion in newCardData["expansions"]]
-        for expansion in lowerExpansions:
-            if lowerExpansions.count(expansion) > 1:
-                await callingMsg.reply(":x: Deck update failed - duplicate expansion pack name found: " + expansion)
-                bGuild.decks[deckName]["updating"] = False
-                return
-        
-        unnamedFound = False
-        emptyExpansions = []
-        for expansion in newCardData["expansions"]:
-            if expansion == "":
-                unnamedFound = True
-            if len(newCardData["expansions"][expansion]["white"]) == 0 and len(newCardData["expansions"][expansion]["black"]) == 0:
-                emptyExpansions.append(expansion)
-
-        errs = ""
-        
-        if unnamedFound:
-            errs += "\nUnnamed expansion pack detected - skipping this expansion."
-            del newCardData["expansions"][""]
-
-        if len(emptyExpansions) != 0:
-            errs += "\nEmpty expansion packs detected - skipping these expansions: " + ", ".join(expansion for expansion in emptyExpansions)
-            for expansion in emptyExpansions:
-                del newCardData["expansions"][expansion]
-
-        whiteCounts = {}
-        blackCounts = {}
-        for expansion in newCardData["expansions"]:
-            whiteCounts[expansion] = len(newCardData["expansions"][expansion]["white"])
-            blackCounts[expansion] = len(newCardData["expansions"][expansion]["black"])
-            indicesToRemove = []
-            for cardNum, cardText in enumerate(newCardData["expansions"][expansion]["black"]):
-                if "_" not in cardText:
-                    indicesToRemove.append(cardNum)
-            if indicesToRemove:
-                errs += "\nIgnoring " + str(len(indicesToRemove)) + " black cards from " + expansion + " expansion with no white card slots (`_`)."
-                for i in indicesToRemove:
-                    newCardData["expansions"][expansion]["black"].pop(i)
-
-        if errs != "":
-            await callingMsg.channel.send(errs)
-
-        totalWhite = sum(whiteCounts.values())
-        totalBlack = sum(blackCounts.values())
-        
-        if int(totalWhite / cfg.cardsPerHand) < 2:
-            await callingMsg.reply("Deck update failed.\nDecks must have at least " + str(2 * cfg.cardsPerHand) + " white cards.")
-            bGuild.decks[deckName]["updating"] = False
+        digest = cardDataDigest(newCardData)
+        if "content_digest" in bGuild.decks[deckName] and bGuild.decks[deckName]["content_digest"] == digest:
+            if revision is not None:
+                bGuild.decks[deckName]["sheet_revision"] = revision
+                bGuild.decks[deckName]["render_settings_digest"] = renderSettingsDigest()
+            await _finishUnchangedUpdate(callingMsg, bGuild, deckName)
             return
-        if totalBlack == 0:
-            await callingMsg.reply("Deck update failed.\nDecks must have at least 1 black card.")
+
+        report = deckValidation.validateCardData(newCardData)
+        if report.warnings:
+            await callingMsg.channel.send("\n".join(report.warnings))
+        if not report.isValid:
+            await callingMsg.reply(":x: Deck update failed.\n" + "\n".join(report.errors))
             bGuild.decks[deckName]["updating"] = False
             return
+        newCardData = report.cardData
 
         oldCardData = lib.jsonHandler.readJSON(bGuild.decks[deckName]["meta_path"])
         deckID = os.path.splitext(os.path.split(bGuild.decks[deckName]["meta_path"])[1])[0]
 
-        cardStorageChannel = None if cfg.cardStorageMethod == "local" else botState.client.get_guild(cfg.cardsDCChannel["guild_id"]).get_channel(cfg.cardsDCChannel["channel_id"])
 
         loadingMsg = await callingMsg.channel.send("Updating deck... " + cfg.defaultEmojis.loading.sendable)
-        results = await make_cards.update_deck(cfg.paths.decksFolder, oldCardData, newCardData, deckID, cfg.paths.cardFont, callingMsg.guild.id, emptyExpansions, cfg.cardStorageMethod, cardStorageChannel, callingMsg, contentFontSize=cfg.cardContentFontSize, titleFontSize=cfg.cardTitleFontSize)
-        oldCardData, changeLog = results[0], results[1]
+        changedOldData, changedNewData, unchangedExpansions = splitDeckChanges(oldCardData, newCardData)
+        store = cardStore.getStore()
+        if "lazy" in bGuild.decks[deckName] and bGuild.decks[deckName]["lazy"]:
+            # Lazy decks are never rendered up front, so the deck meta is rebuilt from the new card data
+            lazyRendering.cancelPrerender(bGuild.decks[deckName]["meta_path"])
+            updatedData = lazyRendering.buildLazyMeta(newCardData)
+            updatedData["deck_name"] = oldCardData["deck_name"]
+            updatedData["spreadsheet_url"] = oldCardData["spreadsheet_url"]
+            changeLog = "\n".join(["Expansion updated: " + name for name in changedNewData["expansions"]]
+                                    + ["Expansion removed: " + name for name in changedOldData["expansions"] if name not in changedNewData["expansions"]])
+            oldCardData = updatedData
+        elif changedOldData["expansions"] or changedNewData["expansions"]:
+            # Only expansions with added, removed or changed cards are given to the renderer, without the cards in the card store
+            changedOldData, changedNewData, storedCards = store.splitStoredUpdate(changedOldData, changedNewData,
+                                                                                  bGuild.decks[deckName]["meta_path"])
+            # Rendered in the card rendering processes, so that large updates do not block the event loop
+            try:
+                updatedData, changeLog = await deckRendering.renderDeckUpdate(changedOldData, changedNewData, deckID, callingMsg.guild.id,
+                                                                                report.emptyExpansions)
+            except deckRendering.RenderError as e:
+                await callingMsg.reply(":x: Deck update failed. " + str(e))
+                bGuild.decks[deckName]["updating"] = False
+                return
+            if cfg.cardStorageMethod == "discord":
+                lastProgressEdit = datetime.utcnow()
+
+                async def showUploadProgress(cardsDone, numCards):
+                    nonlocal lastProgressEdit
+                    if cardsDone < numCards and (datetime.utcnow() - lastProgressEdit).total_seconds() >= cfg.renderProgressIntervalSeconds:
+                        lastProgressEdit = datetime.utcnow()
+                        await loadingMsg.edit(content="Updating deck... uploaded " + str(cardsDone) + "/" + str(numCards) + " cards " + cfg.defaultEmojis.loading.sendable)
+
+                # Cards are uploaded several to a message, rather than one message per card
+                await cardStore.uploadDeckCards(updatedData, progress=showUploadProgress)
+            cardStore.mergeStored(updatedData, storedCards)
+            updatedData["expansions"] = {name: oldCardData["expansions"][name] if name in unchangedExpansions else updatedData["expansions"][name]
+                                            for name in newCardData["expansions"] if name in unchangedExpansions or name in updatedData["expansions"]}
+            oldCardData = updatedData
+        else:
+            changeLog = ""
 
         await loadingMsg.edit(content="Updating deck... " + cfg.defaultEmojis.submit.sendable)
         
+        hashDeckCards(oldCardData)
+        store.syncDeck(bGuild.decks[deckName]["meta_path"], oldCardData)
+        cardStore.saveStore()
+        oldCardData["stats"] = buildDeckStats(oldCardData)
         lib.jsonHandler.writeJSON(bGuild.decks[deckName]["meta_path"], oldCardData)
+        saveSnapshot(bGuild.decks[deckName]["meta_path"], oldCardData)
         now = datetime.utcnow()
         bGuild.decks[deckName]["last_update"] = now.timestamp()
-        bGuild.decks[deckName]["expansions"] = {expansion: (whiteCounts[expansion], blackCounts[expansion]) for expansion in whiteCounts}
-        bGuild.decks[deckName]["white_count"] = totalWhite
-        bGuild.decks[deckName]["black_count"] = totalBlack
+        if fromFile:
+            bGuild.decks[deckName]["spreadsheet_url"] = callingMsg.attachments[0].url
+        if revision is not None:
+            bGuild.decks[deckName]["sheet_revision"] = revision
+            bGuild.decks[deckName]["render_settings_digest"] = renderSettingsDigest()
+        bGuild.decks[deckName]["content_digest"] = digest
+        applyDeckStats(bGuild.decks[deckName], oldCardData["stats"])
 
         bGuild.decks[deckName]["updating"] = False
         if changeLog == "":
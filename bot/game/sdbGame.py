@@ -4,7 +4,7 @@ from typing import Dict, NoReturn, Union, List
 from ..reactionMenus import expiryFunctions
 from ..baseClasses.enum import Enum
 from ..cfg import cfg
-from . import sdbPlayer, sdbDeck
+from . import sdbPlayer, sdbDeck, lazyRendering
 import asyncio
 from ..reactionMenus.SDBSubmissionsReviewMenu import InlineSequentialSubmissionsReviewMenu
 from ..reactionMenus.confirmationReactionMenu import InlineConfirmationMenu
@@ -29,7 +29,7 @@ class DeckUpdateRegistry:
 
 
 class GameChannelReservation:
-    def __init__(self, deck: sdbDeck.SDBDeck):
+    def __init__(self, deck: sdbDeck.SDBDeckCatalog):
         self.deck = deck
         self.shutdownOverride = False
         self.shutdownOverrideReason = ""
@@ -90,7 +90,7 @@ class SDBGame:
         self.playersLeftDuringSetup = []
         self.rounds = rounds
         self.currentRound = 0
-        self.maxPlayers = sum(len(deck.unseenCards[expansion].white) for expansion in activeExpansions) // cfg.cardsPerHand
+        self.maxPlayers = sum(deck.catalog.expansionCounts[expansion][0] for expansion in activeExpansions) // cfg.cardsPerHand
         self.waitingForSubmissions = False
         self.submissionsProgress = None
         self.deckUpdater: DeckUpdateRegistry = None
@@ -170,43 +170,54 @@ class SDBGame:
         await loadingMsg.edit(content="Setting up player hands... " + cfg.defaultEmojis.submit.sendable)
 
 
-    async def dealPlayerCards(self, player):
+    async def dealCards(self, players):
+        """Fill the empty card slots of all of the given players.
+        Cards for every player are drawn from the deck in one pass, and then all of the affected card slot messages are
+        updated concurrently, up to cfg.maxConcurrentCardEdits at a time.
+        """
         if self.shutdownOverride:
             return
-        noneCardDealt = False
-        for cardSlot in player.hand:
-            if self.shutdownOverride:
-                return
-            if cardSlot.isEmpty:
-                newCard = self.deck.popRandomWhite(self.expansionNames)
-                # while player.hasCard(newCard):
-                #     newCard = self.deck.randomWhite(self.expansionNames)
+        emptySlots = {player: [slot for slot in player.hand if slot.isEmpty] for player in players}
+        dealt = self.deck.deal(players, [len(emptySlots[player]) for player in players])
+        # Cards from lazy decks are rendered the first time they are drawn
+        await lazyRendering.ensureRendered(self.deck.catalog, [card for player in players for card in dealt[player]], False, self.channel.guild.id)
+
+        slotsToUpdate = []
+        noneCardPlayers = []
+        for player in players:
+            for cardSlot, newCard in zip(emptySlots[player], dealt[player]):
                 if newCard is None:
-                    noneCardDealt = True
+                    if player not in noneCardPlayers:
+                        noneCardPlayers.append(player)
                 else:
-                    await cardSlot.setCard(newCard)
-        if noneCardDealt:
+                    cardSlot.assignCard(newCard)
+                    slotsToUpdate.append(cardSlot)
+
+        # One player's card slot failing to update, for example because they blocked DMs, must not stop everyone else's deal
+        results = await lib.asyncUtil.gatherBounded(cfg.maxConcurrentCardEdits, (cardSlot.updateMessage() for cardSlot in slotsToUpdate),
+                                                    returnExceptions=True)
+        for cardSlot, result in zip(slotsToUpdate, results):
+            if isinstance(result, Exception):
+                botState.logger.log("SDBGame", "dealCards", "Failed to update card slot message: " + type(result).__name__,
+                                    trace=traceback.format_exception(type(result), result, result.__traceback__), eventType="SLOT_UPDATE_FAIL")
+            elif isinstance(result, BaseException):
+                raise result
+
+        for player in noneCardPlayers:
             await self.channel.send(player.dcUser.mention + " An unexpected error occurred when dealing your cards, the error has been logged.")
 
 
+    async def dealPlayerCards(self, player):
+        await self.dealCards([player])
+
+
     async def dealAllPlayerCards(self):
         if self.shutdownOverride:
             return
         loadingStr = "** **\n**__Round " + str(self.currentRound) + ((" of " + str(self.rounds)) if self.rounds != -1 else "") + "__**\nDealing cards... "
         loadingMsg = await self.channel.send(loadingStr + cfg.defaultEmojis.loading.sendable)
 
-        cardDistributors = set()
-
-        def scheduleCardDistributor(self, player):
-            task = asyncio.ensure_future(self.dealPlayerCards(player))
-            cardDistributors.add(task)
-            task.add_done_callback(cardDistributors.remove)
-
-        for player in self.players:
-            scheduleCardDistributor(self, player)
-
-        if cardDistributors:
-            await asyncio.wait(cardDistributors)
+        await self.dealCards(self.players)
 
         await loadingMsg.edit(content=loadingStr + cfg.defaultEmojis.submit.sendable)
 
@@ -255,7 +266,7 @@ class SDBGame:
             if player is not None:
                 for slot in player.hand:
                     if not slot.isEmpty:
-                        slot.currentCard.revoke()
+                        self.deck.revokeWhite(slot.currentCard)
                 self.players.remove(player)
             await self.channel.send(member.mention + " left the game.")
             
@@ -289,7 +300,7 @@ class SDBGame:
 
             for slot in player.hand:
                 if not slot.isEmpty:
-                    slot.currentCard.revoke()
+                    self.deck.revokeWhite(slot.currentCard)
             await self.channel.send(member.mention + " left the game.")
             
             if (len(self.players) - len(self.playersLeftDuringSetup)) < 2:
@@ -324,8 +335,10 @@ class SDBGame:
     async def pickNewBlackCard(self):
         if self.shutdownOverride:
             return
+        newBlackCard = self.deck.randomBlack()
+        await lazyRendering.ensureRendered(self.deck.catalog, [newBlackCard], True, self.channel.guild.id)
         self.currentBlackCard = sdbPlayer.SDBCardSlot(None, await self.channel.send("​"), None)
-        await self.currentBlackCard.setCard(self.deck.randomBlack(self.expansionNames))
+        await self.currentBlackCard.setCard(newBlackCard)
 
 
     async def endWaitForSubmissions(self):
@@ -416,8 +429,9 @@ class SDBGame:
                 if cfg.cardStorageMethod == "local":
                     roundCardsDir = cfg.paths.decksFolder + os.sep + "temp" + os.sep + str(self.channel.id) + os.sep + str(self.currentRound)
                     winnerImagePath = SDBSubmissionsReviewMenu.mergedSubmissionImagePath(roundCardsDir, winningPlayer)
-                    winnerImage = File(winnerImagePath, filename="winning-submission.jpg")
-                    winnerEmbed.set_image(url="attachment://winning-submission.jpg")
+                    winnerFileName = "winning-submission" + os.path.splitext(winnerImagePath)[1]
+                    winnerImage = File(winnerImagePath, filename=winnerFileName)
+                    winnerEmbed.set_image(url="attachment://" + winnerFileName)
                     await self.channel.send(winningPlayer.dcUser.mention + " wins the round!", file=winnerImage, embed=winnerEmbed)
 
                     if os.path.isdir(roundCardsDir):
@@ -433,11 +447,12 @@ class SDBGame:
 
                 winnerImagePath = SDBSubmissionsReviewMenu.mergedSubmissionImagePath(roundCardsDir, winningPlayer)
                 winnerImage = await SDBSubmissionsReviewMenu.mergePlayerSubmissions(winningPlayer)
-                winnerImage.save(winnerImagePath)
+                await SDBSubmissionsReviewMenu.saveMergedPlayerSubmissionLocal(winningPlayer, roundCardsDir, winnerImage)
                 winnerImage.close()
 
-                winnerImage = File(winnerImagePath, filename="winning-submission.jpg")
-                winnerEmbed.set_image(url="attachment://winning-submission.jpg")
+                winnerFileName = "winning-submission" + os.path.splitext(winnerImagePath)[1]
+                winnerImage = File(winnerImagePath, filename=winnerFileName)
+                winnerEmbed.set_image(url="attachment://" + winnerFileName)
                 await self.channel.send(winningPlayer.dcUser.mention + " wins the round!", file=winnerImage, embed=winnerEmbed)
 
                 if os.path.isdir(roundCardsDir):
@@ -14,17 +14,28 @@ class SDBCardSlot:
 
     
     async def setCard(self, newCard, updateMessage = True):
-        self.currentCard = newCard
         if self.player is not None:
-            newCard.claim(self.player)
+            self.player.game.deck.claimWhite(newCard, self.player)
+        self.assignCard(newCard)
         if updateMessage:
-            await self.message.edit(embed=lib.discordUtil.makeEmbed(img=newCard.url, desc=newCard.url if cfg.debugCards else ""))
+            await self.updateMessage()
+
+
+    def assignCard(self, newCard):
+        """Place a card into this slot without claiming it or updating the slot's message.
+        White cards must already have been claimed for the slot's player, e.g by SDBDeck.deal.
+        """
+        self.currentCard = newCard
         self.isEmpty = False
+
+
+    async def updateMessage(self):
+        await self.message.edit(embed=lib.discordUtil.makeEmbed(img=self.currentCard.url, desc=self.currentCard.url if cfg.debugCards else ""))
     
 
     async def removeCard(self, emptyCard, updateMessage = True):
         if self.player is not None:
-            self.currentCard.revoke()
+            self.player.game.deck.revokeWhite(self.currentCard)
         if updateMessage:
             await self.message.edit(embed=lib.discordUtil.makeEmbed(img=emptyCard.url, desc=emptyCard.url if cfg.debugCards else ""))
         self.isEmpty = True
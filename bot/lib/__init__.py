@@ -1,2 +1,2 @@
 # Make all lib modules available on package import
-from . import discordUtil, emojis, jsonHandler, stringTyping, timeUtil, exceptions
+from . import discordUtil, emojis, jsonHandler, stringTyping, timeUtil, exceptions, fenwickTree, asyncUtil, fontCache, imageEncoding, imageWorkers, loopLag, imageCache
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Iterable, List
+
+
+async def gatherBounded(limit: int, awaitables: Iterable[Awaitable], returnExceptions: bool = False) -> List[Any]:
+    """Await all of the given awaitables concurrently, with no more than limit running at any one time.
+    Results are returned in the same order as the awaitables were given.
+    If any awaitable raises an exception, the first exception raised is propagated once all awaitables have finished,
+    unless returnExceptions is given.
+
+    :param int limit: The maximum number of awaitables to run at once
+    :param Iterable[Awaitable] awaitables: The awaitables to run
+    :param bool returnExceptions: Return the exception raised by each failed awaitable in place of its result, rather than
+                                    propagating it (Default False)
+    :return: The result of each awaitable
+    :rtype: List[Any]
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def runBounded(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    results = await asyncio.gather(*(runBounded(awaitable) for awaitable in awaitables), return_exceptions=True)
+    if returnExceptions:
+        return results
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class InFlightWork:
+    """Futures for work that is in progress, by key, so that work requested again while it is in progress is waited for
+    rather than done again. The work itself is done by whoever started it, which must end it with finish, fail or cancel.
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self):
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._futures
+
+
+    def start(self, key: Hashable):
+        """Record that the work for key has started.
+
+        :param key: The key of the work, which must not already be in progress
+        """
+        self._futures[key] = asyncio.get_event_loop().create_future()
+
+
+    def waitFor(self, key: Hashable) -> Awaitable:
+        """Get an awaitable for the result of the work for key, which must be in progress.
+        It may be awaited after the work has finished.
+
+        :param key: The key of the work
+        :return: An awaitable resolving to the work's result, raising the work's exception, or cancelled if the work is cancelled
+        :rtype: Awaitable
+        """
+        # Shielded, so that cancelling one waiter does not cancel the work for every other waiter
+        return asyncio.shield(self._futures[key])
+
+
+    def finish(self, key: Hashable, result: Any = None):
+        """Record that the work for key has finished, giving its result to everything waiting for it.
+        """
+        self._futures.pop(key).set_result(result)
+
+
+    def fail(self, key: Hashable, exception: BaseException):
+        """Record that the work for key has failed, raising exception in everything waiting for it.
+        """
+        future = self._futures.pop(key)
+        future.set_exception(exception)
+        # Marked as retrieved, as there may be no waiters to retrieve it
+        future.exception()
+
+
+    def cancel(self, key: Hashable):
+        """Record that the work for key was cancelled, cancelling everything waiting for it.
+        """
+        self._futures.pop(key).cancel()
@@ -1,13 +1,15 @@
 from __future__ import annotations
-from typing import Union, TYPE_CHECKING, Tuple, Dict
+from typing import Union, TYPE_CHECKING, Tuple, Dict, List, Callable, Awaitable
 if TYPE_CHECKING:
     from discord import Member, Guild, Message
 
-from . import stringTyping, emojis, exceptions
+from . import stringTyping, emojis, exceptions, asyncUtil
 from .. import botState
 from discord import Embed, Colour, HTTPException, Forbidden, RawReactionActionEvent, Reaction, User
-from discord import DMChannel, GroupChannel, TextChannel
+from discord import DMChannel, GroupChannel, TextChannel, File
 import random
+import io
+import os
 from ..cfg import cfg
 import asyncio
 import inspect
@@ -187,6 +189,80 @@ async def sendDM(text, user, owningMsg, exceptOnFail=False, reactOnDM=True, embe
     return dmMsg
 
 
+# The maximum number of attachments Discord accepts in a single message
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+
+
+def _packUploads(files: List[Tuple[str, Union[str, bytes]]], maxMessageBytes: int) -> List[List[int]]:
+    """Split files into batches of indices to send together, each within the attachment count and size limits of a message.
+    A file larger than maxMessageBytes is sent alone.
+    """
+    batches = []
+    batch = []
+    batchBytes = 0
+    for fileNum, (_, source) in enumerate(files):
+        fileBytes = os.path.getsize(source) if isinstance(source, str) else len(source)
+        if batch and (len(batch) == MAX_ATTACHMENTS_PER_MESSAGE or batchBytes + fileBytes > maxMessageBytes):
+            batches.append(batch)
+            batch = []
+            batchBytes = 0
+        batch.append(fileNum)
+        batchBytes += fileBytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _sendFilesWithRetry(channel: TextChannel, files: List[Tuple[str, Union[str, bytes]]], maxRetries: int) -> Message:
+    """Send files in a single message, retrying after the delay requested by Discord if the send is rate limited.
+    Files are reopened for each attempt, as discord.py closes them after sending.
+    """
+    for attempt in range(maxRetries + 1):
+        dcFiles = [File(source, filename=fileName) if isinstance(source, str) else File(io.BytesIO(source), filename=fileName)
+                    for fileName, source in files]
+        try:
+            return await channel.send(files=dcFiles)
+        except HTTPException as e:
+            if e.status != 429 or attempt == maxRetries:
+                raise
+            retryAfter = e.response.headers.get("Retry-After") if e.response is not None else None
+            await asyncio.sleep(float(retryAfter) if retryAfter else 1)
+
+
+async def uploadFiles(channel: TextChannel, files: List[Tuple[str, Union[str, bytes]]], maxConcurrent: int = 3,
+                        maxMessageBytes: int = 8000000, maxRetries: int = 5,
+                        progress: Callable[[int, int], Awaitable] = None) -> List[str]:
+    """Upload files as message attachments, packing up to MAX_ATTACHMENTS_PER_MESSAGE files into each message.
+    Messages are sent concurrently, and sends that are rate limited are retried after the delay given by Discord.
+
+    :param TextChannel channel: The channel to upload the files to
+    :param files: The name to upload each file with, and either the path to the file or its contents
+    :type files: List[Tuple[str, Union[str, bytes]]]
+    :param int maxConcurrent: The maximum number of messages to send at once (Default 3)
+    :param int maxMessageBytes: The maximum total size of the files in a single message (Default 8000000)
+    :param int maxRetries: The maximum number of times to retry a rate limited send (Default 5)
+    :param progress: Coroutine function called with the number of files uploaded so far and the total number of files,
+                        each time a message is sent (Default None)
+    :return: The URL of each file's attachment, in the order the files were given
+    :rtype: List[str]
+    :raise HTTPException: If a send failed, or was still rate limited after maxRetries retries
+    """
+    urls = [None] * len(files)
+    uploadedCount = 0
+
+    async def sendBatch(batch: List[int]):
+        nonlocal uploadedCount
+        uploadMsg = await _sendFilesWithRetry(channel, [files[fileNum] for fileNum in batch], maxRetries)
+        for fileNum, attachment in zip(batch, uploadMsg.attachments):
+            urls[fileNum] = attachment.url
+        uploadedCount += len(batch)
+        if progress is not None:
+            await progress(uploadedCount, len(files))
+
+    await asyncUtil.gatherBounded(maxConcurrent, (sendBatch(batch) for batch in _packUploads(files, maxMessageBytes)))
+    return urls
+
+
 async def clientMultiWaitFor(eventTypes, timeout, check=None):
     if check is not None:
         done, pending = await asyncio.wait([
@@ -0,0 +1,76 @@
+from typing import List
+
+
+class FenwickTree:
+    """A binary indexed tree over a fixed-length array of non-negative integers.
+    Supports point updates, prefix sums and weighted index lookups in O(log n).
+
+    :var size: The number of elements in the tree
+    :vartype size: int
+    """
+
+    def __init__(self, values: List[int]):
+        """
+        :param List[int] values: The initial values of each element in the tree
+        """
+        self.size = len(values)
+        self._tree = [0] + list(values)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[i]
+        self._topBit = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+
+    def add(self, index: int, delta: int):
+        """Add delta to the element at the given index.
+
+        :param int index: The 0-based index of the element to update
+        :param int delta: The amount to add to the element. May be negative.
+        """
+        index += 1
+        while index <= self.size:
+            self._tree[index] += delta
+            index += index & -index
+
+
+    def prefixSum(self, end: int) -> int:
+        """Sum the elements in the range [0, end).
+
+        :param int end: The exclusive 0-based end index of the range to sum
+        :return: The sum of all elements before end
+        :rtype: int
+        """
+        total = 0
+        while end > 0:
+            total += self._tree[end]
+            end -= end & -end
+        return total
+
+
+    def total(self) -> int:
+        """Sum all elements in the tree.
+
+        :return: The sum of all elements in the tree
+        :rtype: int
+        """
+        return self.prefixSum(self.size)
+
+
+    def find(self, value: int) -> int:
+        """Find the element containing the given position in the cumulative sum of all elements.
+        If value is picked uniformly from [0, total()), each element is returned with probability proportional to its value.
+
+        :param int value: A position in the range [0, total())
+        :return: The smallest 0-based index i such that prefixSum(i + 1) > value
+        :rtype: int
+        """
+        pos = 0
+        bit = self._topBit
+        while bit:
+            nextPos = pos + bit
+            if nextPos <= self.size and self._tree[nextPos] <= value:
+                pos = nextPos
+                value -= self._tree[nextPos]
+            bit >>= 1
+        return pos
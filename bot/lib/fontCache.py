@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from PIL import ImageFont
+
+
+# Font measurement methods to memoize on cached fonts. Only the methods present in the installed Pillow version are wrapped
+_MEASUREMENT_METHODS = ("getsize", "getlength", "getbbox", "getmetrics")
+
+_originalTruetype = ImageFont.truetype
+_loadedFonts: Dict[Tuple, ImageFont.FreeTypeFont] = {}
+_measurementCacheSize = 65536
+
+
+def _memoizeMeasurements(font: ImageFont.FreeTypeFont):
+    """Replace the measurement methods of a font with memoized versions.
+    Calls with unhashable arguments, such as lists of OpenType features, are passed straight through.
+    """
+    for methodName in _MEASUREMENT_METHODS:
+        if not hasattr(font, methodName):
+            continue
+        method = getattr(font, methodName)
+
+        @lru_cache(maxsize=_measurementCacheSize)
+        def measure(args, kwargs, method=method):
+            return method(*args, **dict(kwargs))
+
+        def memoized(*args, method=method, measure=measure, **kwargs):
+            try:
+                return measure(args, tuple(sorted(kwargs.items())))
+            except TypeError:
+                return method(*args, **kwargs)
+
+        memoized.cache_info = measure.cache_info
+        setattr(font, methodName, memoized)
+
+
+def cachedTruetype(font=None, size=10, index=0, encoding="", layout_engine=None, **kwargs) -> ImageFont.FreeTypeFont:
+    """Drop-in replacement for PIL.ImageFont.truetype, which loads each font file once per size, index and encoding.
+    Fonts loaded from file objects, or with any extra arguments, are not cached.
+    Cached fonts are shared, and memoize their text measurements, see _memoizeMeasurements.
+
+    :return: The loaded font
+    :rtype: ImageFont.FreeTypeFont
+    """
+    if kwargs or not isinstance(font, (str, bytes)):
+        return _originalTruetype(font, size, index, encoding, layout_engine, **kwargs)
+
+    key = (font, size, index, encoding, layout_engine)
+    if key not in _loadedFonts:
+        _loadedFonts[key] = _originalTruetype(font, size, index, encoding, layout_engine)
+        _memoizeMeasurements(_loadedFonts[key])
+    return _loadedFonts[key]
+
+
+def installFontCache(measurementCacheSize: int = 65536):
+    """Make PIL.ImageFont.truetype return cached fonts for the rest of this process.
+    Code that looks up ImageFont.truetype when called, such as the card renderer, will use the cache. Safe to call more than once.
+
+    :param int measurementCacheSize: The maximum number of measurements to memoize per method of each cached font (Default 65536)
+    """
+    global _measurementCacheSize
+    _measurementCacheSize = measurementCacheSize
+    ImageFont.truetype = cachedTruetype
+
+
+def clearFontCache():
+    """Forget all cached fonts and their measurements.
+    """
+    _loadedFonts.clear()
@@ -0,0 +1,128 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+from PIL import Image
+
+from . import asyncUtil
+
+
+# Modes that Pillow stores with one byte per pixel. Other modes are stored with four
+_ONE_BYTE_MODES = ("1", "L", "P")
+
+
+def decodedSize(im: Image.Image) -> int:
+    """Estimate the number of bytes of memory taken by a decoded image.
+    """
+    return im.width * im.height * (1 if im.mode in _ONE_BYTE_MODES else 4)
+
+
+class DecodedImageCache:
+    """A least recently used cache of decoded images, limited by their total size in memory.
+    Cached images are shared by everything that loads them, so must not be modified or closed.
+    Images larger than the whole budget are returned by load without being cached.
+    Must only be used from the event loop thread.
+
+    :var maxBytes: The maximum total size in bytes of the cached images, see decodedSize
+    :vartype maxBytes: int
+    :var currentBytes: The total size in bytes of the cached images
+    :vartype currentBytes: int
+    :var hits: The number of loads answered from the cache, including loads that waited for the same image to finish loading
+    :vartype hits: int
+    :var misses: The number of loads that had to load their image
+    :vartype misses: int
+    :var evictions: The number of images dropped from the cache to stay within maxBytes
+    :vartype evictions: int
+    """
+
+    def __init__(self, maxBytes: int):
+        """
+        :param int maxBytes: The maximum total size in bytes of the cached images
+        """
+        self.maxBytes = maxBytes
+        self.currentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._images: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._loading = asyncUtil.InFlightWork()
+
+
+    async def load(self, key: str, loader: Callable[[], Awaitable[Image.Image]]) -> Image.Image:
+        """Get the image cached under key, loading and caching it with loader if it is not cached.
+        If the image is already being loaded, that load is waited for rather than loading it again.
+        Evicted images are not closed, as they may still be in use. They are freed once no longer referenced.
+
+        :param str key: The key to cache the image under, such as its URL
+        :param loader: Coroutine function loading the image
+        :type loader: Callable[[], Awaitable[Image.Image]]
+        :return: The image. It must not be modified or closed
+        :rtype: Image.Image
+        :raise Exception: Any exception raised by loader
+        """
+        if key in self._images:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return self._images[key]
+
+        if key in self._loading:
+            self.hits += 1
+            return await self._loading.waitFor(key)
+
+        self.misses += 1
+        self._loading.start(key)
+        try:
+            im = await loader()
+        except asyncio.CancelledError:
+            self._loading.cancel(key)
+            raise
+        except Exception as e:
+            self._loading.fail(key, e)
+            raise
+        self._loading.finish(key, im)
+        self._put(key, im)
+        return im
+
+
+    def _put(self, key: str, im: Image.Image):
+        size = decodedSize(im)
+        if size > self.maxBytes:
+            return
+        self.forget(key)
+        self._images[key] = im
+        self._sizes[key] = size
+        self.currentBytes += size
+        while self.currentBytes > self.maxBytes:
+            evictedKey, _ = self._images.popitem(last=False)
+            self.currentBytes -= self._sizes.pop(evictedKey)
+            self.evictions += 1
+
+
+    def forget(self, key: str):
+        """Remove an image from the cache, if it is cached. Use when the image stored under key changes or is deleted.
+
+        :param str key: The key of the image to remove
+        """
+        if key in self._images:
+            del self._images[key]
+            self.currentBytes -= self._sizes.pop(key)
+
+
+    def clear(self):
+        """Remove every image from the cache. Counters are kept.
+        """
+        self._images.clear()
+        self._sizes.clear()
+        self.currentBytes = 0
+
+
+    def stats(self) -> Dict[str, int]:
+        """Summarise the cache's contents and counters.
+
+        :return: The number of cached images under "images", and the values of currentBytes, maxBytes, hits, misses and evictions
+                    under their own names
+        :rtype: Dict[str, int]
+        """
+        return {"images": len(self._images), "currentBytes": self.currentBytes, "maxBytes": self.maxBytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
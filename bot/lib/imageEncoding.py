@@ -0,0 +1,63 @@
+import io
+import time
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+
+# Encoder profiles are dictionaries of PIL save options, with the name of a PIL image format under "format".
+# For example: {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True}
+
+# File extensions for the PIL image formats with more than one registered extension
+_FORMAT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png", "TIFF": "tiff"}
+
+
+def fileExtension(profile: dict) -> str:
+    """Get the file extension for images encoded with an encoder profile, without the leading ".".
+    """
+    return _FORMAT_EXTENSIONS.get(profile["format"], profile["format"].lower())
+
+
+def scaleSize(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """Scale an image size, keeping each dimension at least 1 pixel.
+    """
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def encodeImage(im: Image.Image, profile: dict, size: Tuple[int, int] = None) -> bytes:
+    """Encode an image with an encoder profile.
+
+    :param Image.Image im: The image to encode. It is not modified
+    :param dict profile: The encoder profile to encode with
+    :param size: The size to resize the image to before encoding, or None to encode at its current size (Default None)
+    :type size: Tuple[int, int]
+    :return: The encoded image
+    :rtype: bytes
+    """
+    if size is not None and size != im.size:
+        im = im.resize(size, Image.LANCZOS)
+    if profile["format"] == "JPEG" and im.mode not in ("RGB", "L", "CMYK"):
+        im = im.convert("RGB")
+    imageBytes = io.BytesIO()
+    im.save(imageBytes, format=profile["format"], **{option: value for option, value in profile.items() if option != "format"})
+    return imageBytes.getvalue()
+
+
+def benchmarkProfiles(images: List[Image.Image], profiles: Dict[str, dict], scale: float = 1) -> Dict[str, Tuple[float, float]]:
+    """Encode sample images with each of the given encoder profiles, measuring the size and encode time of each.
+
+    :param List[Image.Image] images: The images to encode
+    :param profiles: The encoder profiles to compare, by name
+    :type profiles: Dict[str, dict]
+    :param float scale: The scale to resize the images by before encoding. Resizing is included in the encode time (Default 1)
+    :return: The mean size in bytes, and mean encode time in milliseconds, of an image with each profile
+    :rtype: Dict[str, Tuple[float, float]]
+    """
+    results = {}
+    for profileName, profile in profiles.items():
+        totalBytes = 0
+        started = time.perf_counter()
+        for im in images:
+            totalBytes += len(encodeImage(im, profile, scaleSize(im.size, scale)))
+        results[profileName] = (totalBytes / len(images), (time.perf_counter() - started) * 1000 / len(images))
+    return results
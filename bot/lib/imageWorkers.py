@@ -0,0 +1,80 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Tuple
+
+from PIL import Image
+
+from ..cfg import cfg
+from . import imageEncoding
+
+
+# Image decoding, compositing and encoding is run in a pool of threads, so that it does not block the event loop.
+# Pillow releases the GIL while decoding, resampling and encoding, so the threads run alongside the event loop and each other.
+# Images passed between the event loop and the pool must not be used by the event loop while a task is using them.
+# Created on first use, see _getImagePool
+_imagePool: ThreadPoolExecutor = None
+
+
+def _getImagePool() -> ThreadPoolExecutor:
+    global _imagePool
+    if _imagePool is None:
+        _imagePool = ThreadPoolExecutor(max_workers=cfg.imageWorkerThreads if cfg.imageWorkerThreads > 0 else (os.cpu_count() or 1),
+                                        thread_name_prefix="imageWorker")
+    return _imagePool
+
+
+async def runImageTask(func: Callable, *args) -> Any:
+    """Call a function in the image worker pool, and wait for its result.
+
+    :param Callable func: The function to call. It must not use the event loop
+    :return: The return value of func
+    """
+    return await asyncio.get_event_loop().run_in_executor(_getImagePool(), func, *args)
+
+
+def _decodeBytes(imageBytes: bytes) -> Image.Image:
+    im = Image.open(io.BytesIO(imageBytes))
+    im.load()
+    return im
+
+
+def _decodeFile(path: str) -> Image.Image:
+    im = Image.open(path)
+    im.load()
+    return im
+
+
+async def decodeImage(imageBytes: bytes) -> Image.Image:
+    """Decode an encoded image in the image worker pool.
+
+    :param bytes imageBytes: The encoded image
+    :return: The fully loaded image
+    :rtype: Image.Image
+    """
+    return await runImageTask(_decodeBytes, imageBytes)
+
+
+async def openImageFile(path: str) -> Image.Image:
+    """Read and decode an image file in the image worker pool.
+
+    :param str path: The path to the image file
+    :return: The fully loaded image
+    :rtype: Image.Image
+    :raise FileNotFoundError: If there is no file at path
+    """
+    return await runImageTask(_decodeFile, path)
+
+
+async def encodeImage(im: Image.Image, profile: dict, size: Tuple[int, int] = None) -> bytes:
+    """Encode an image with an encoder profile in the image worker pool, see imageEncoding.encodeImage.
+
+    :param Image.Image im: The image to encode. It is not modified
+    :param dict profile: The encoder profile to encode with
+    :param size: The size to resize the image to before encoding, or None to encode at its current size (Default None)
+    :type size: Tuple[int, int]
+    :return: The encoded image
+    :rtype: bytes
+    """
+    return await runImageTask(imageEncoding.encodeImage, im, profile, size)
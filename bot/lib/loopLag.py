@@ -0,0 +1,80 @@
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Dict
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop is to wake a task that sleeps for a fixed interval.
+    A late wake-up means that something blocked the event loop, delaying every other task for as long.
+
+    :var interval: The number of seconds to sleep between measurements
+    :vartype interval: float
+    :var threshold: Lag in seconds at or above which onLag is called
+    :vartype threshold: float
+    :var onLag: Function called with the lag in seconds of each measurement at or above threshold, or None
+    :vartype onLag: Callable[[float], None]
+    :var recentLags: The lag in seconds of the most recent measurements, oldest first
+    :vartype recentLags: Deque[float]
+    :var maxLag: The highest lag in seconds measured since the monitor was started
+    :vartype maxLag: float
+    :var numLagging: The number of measurements at or above threshold since the monitor was started
+    :vartype numLagging: int
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1, onLag: Callable[[float], None] = None, historySize: int = 240):
+        """
+        :param float interval: The number of seconds to sleep between measurements (Default 0.25)
+        :param float threshold: Lag in seconds at or above which onLag is called (Default 0.1)
+        :param Callable[[float], None] onLag: Function called with the lag in seconds of each measurement at or above threshold (Default None)
+        :param int historySize: The number of recent measurements to keep (Default 240)
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.onLag = onLag
+        self.recentLags: Deque[float] = deque(maxlen=historySize)
+        self.maxLag = 0.0
+        self.numLagging = 0
+        self._task: asyncio.Task = None
+
+
+    async def _monitor(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            sleepStarted = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - sleepStarted - self.interval)
+            self.recentLags.append(lag)
+            self.maxLag = max(self.maxLag, lag)
+            if lag >= self.threshold:
+                self.numLagging += 1
+                if self.onLag is not None:
+                    self.onLag(lag)
+
+
+    def start(self):
+        """Start measuring in the background. Does nothing if the monitor is already running.
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._monitor())
+
+
+    def stop(self):
+        """Stop measuring. Measurements taken so far are kept.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+    def stats(self) -> Dict[str, float]:
+        """Summarise the recent measurements.
+
+        :return: The mean, 99th percentile and highest lag in seconds of the recent measurements, under "mean", "p99" and "max",
+                    and the number of recent measurements under "samples"
+        :rtype: Dict[str, float]
+        """
+        if not self.recentLags:
+            return {"samples": 0, "mean": 0.0, "p99": 0.0, "max": 0.0}
+        lags = sorted(self.recentLags)
+        return {"samples": len(lags), "mean": sum(lags) / len(lags), "p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+                "max": lags[-1]}
@@ -1,15 +1,14 @@
-from bot import botState
 from . import pagedReactionMenu, reactionMenu
-from discord import Embed, Message, Embed, File
+from discord import Embed, Message, Embed
 from ..cfg import cfg
-from ..game import sdbPlayer, sdbGame
-from typing import Dict, List, TYPE_CHECKING
+from ..game import sdbPlayer, sdbGame, cardAtlas, cardImages, cardStore
+from typing import Dict, List, Tuple, TYPE_CHECKING
 from .. import lib
 from concurrent import futures
 import psutil
 from PIL import Image
-from ..cardRenderer.lib import url_to_local_path, CARD_SIZE, local_file_url, IMG_FORMAT
-import io
+from ..cardRenderer.lib import local_file_url
+import asyncio
 import os
 import shutil
 import random
@@ -91,97 +90,120 @@ class InlineMergedSubmissionsReviewMenu(InlineSDBSubmissionsReviewMenu):
         super().__init__(msg, pages, returnTriggers, timeoutSeconds, chooserPlayer)
 
 
-def mergeImageTable(images: List[Image.Image], lineLength: int) -> Image.Image:
+def mergeImageTable(images: List[Image.Image], lineLength: int, cardSize: Tuple[int, int]) -> Image.Image:
+    # Blocks for a long time with large cards, so is run in the image worker pool, see mergePlayerSubmissions
     tableWidth = min(len(images), lineLength)
     tableHeight = int((len(images) - 1) / lineLength) + 1
-    newIm = Image.new('RGB', (CARD_SIZE[0] * tableWidth, CARD_SIZE[1] * tableHeight))
+    newIm = Image.new('RGB', (cardSize[0] * tableWidth, cardSize[1] * tableHeight))
 
     for imNum in range(len(images)):
         col = imNum % tableWidth
         row = int(imNum / tableWidth)
-        newIm.paste(images[imNum], (CARD_SIZE[0] * col, CARD_SIZE[1] * row))
+        cardImage = images[imNum] if images[imNum].size == cardSize else images[imNum].resize(cardSize, Image.LANCZOS)
+        newIm.paste(cardImage, (cardSize[0] * col, cardSize[1] * row))
 
     return newIm
 
 
-def loadImages(imagePaths: List[str]) -> List[Image.Image]:
-    return [Image.open(path) for path in imagePaths]
+async def _loadCardImage(url: str) -> Image.Image:
+    try:
+        return await cardImages.loadCardImage(url)
+    except IOError:
+        # Cards that could not be loaded are left out of the merged image
+        return None
+
+
+async def _cropStoredCard(text: str) -> Image.Image:
+    try:
+        return await cardAtlas.loadStoredCard(text, False)
+    except IOError:
+        # The card is loaded from its URL instead
+        return None
 
 
 async def mergePlayerSubmissions(player: "sdbPlayer.SDBPlayer"):
-    cardImages = []
-    useLocal = cfg.cardStorageMethod == "local"
-    if useLocal:
-        try:
-            cardImages = loadImages(cfg.paths.decksFolder + os.sep + url_to_local_path(card.url) for card in player.submittedCards)
-        except FileNotFoundError:
-            useLocal = False
-    
-    if not useLocal:
-        for card in player.submittedCards:
-            async with botState.httpClient.get(card.url) as resp:
-                if resp.status == 200:
-                    cardImages.append(Image.open(io.BytesIO(await resp.read())))
-
-    mergedImage = mergeImageTable(cardImages, cfg.mergedSubmissionsMenu_lineLength)
-
-    for img in cardImages:
-        img.close()
+    # Cards are shared through the card image cache. Cards from card sheets are normally stored on their own when they are dealt,
+    # and are only cropped out of their sheet if that failed.
+    # Looking a card up in the card store means hashing it, so this is skipped when no card could be in a sheet
+    if cfg.cardAtlasStorage or cardStore.getStore().hasAtlasCards():
+        croppedImages = await asyncio.gather(*(_cropStoredCard(card.text) for card in player.submittedCards))
+    else:
+        croppedImages = [None] * len(player.submittedCards)
+    submittedImages = list(croppedImages)
+    uncropped = [cardNum for cardNum in range(len(submittedImages)) if submittedImages[cardNum] is None]
+    loadedImages = await asyncio.gather(*(_loadCardImage(player.submittedCards[cardNum].url) for cardNum in uncropped))
+    for cardNum, img in zip(uncropped, loadedImages):
+        submittedImages[cardNum] = img
+
+    # Cards are merged at the delivery size, see cfg.cardDeliveryScale
+    mergedImage = await lib.imageWorkers.runImageTask(mergeImageTable, [img for img in submittedImages if img is not None],
+                                                        cfg.mergedSubmissionsMenu_lineLength, cardAtlas.deliveryCardSize())
+
+    # Cached images are shared, so only the cropped images are closed
+    for img in croppedImages:
+        if img is not None:
+            img.close()
 
     return mergedImage
 
 
 def mergedSubmissionImagePath(roundCardsDir, player):
-    return roundCardsDir + os.sep + str(player.dcUser.id) + "." + IMG_FORMAT
+    return roundCardsDir + os.sep + str(player.dcUser.id) + "." + lib.imageEncoding.fileExtension(cfg.imageEncoderProfiles[cfg.mergedSubmissionEncoderProfile])
 
 
-async def saveMergedPlayerSubmissionDiscord(storageChannel, im):
-    submissionBytes = io.BytesIO()
-    im.save(submissionBytes, format="JPEG")
-    submissionBytes.seek(0)
-    dcFile = File(submissionBytes, filename="merged-submissions.JPEG")
-    newMsg = await storageChannel.send(file=dcFile)
-    return newMsg.attachments[0].url
+async def saveMergedPlayerSubmissionsDiscord(images: Dict["sdbPlayer.SDBPlayer", Image.Image]) -> Dict["sdbPlayer.SDBPlayer", str]:
+    # All players' images are uploaded together, several to a message
+    profile = cfg.imageEncoderProfiles[cfg.mergedSubmissionEncoderProfile]
+    extension = lib.imageEncoding.fileExtension(profile)
+    encodedImages = await asyncio.gather(*(lib.imageWorkers.encodeImage(im, profile) for im in images.values()))
+    files = [("merged-submissions-" + str(imageNum) + "." + extension, imageBytes) for imageNum, imageBytes in enumerate(encodedImages)]
+    return dict(zip(images.keys(), await cardStore.uploadFiles(files)))
 
 
-def saveMergedPlayerSubmissionLocal(player, roundCardsDir, im):
+def _writeImageFile(path: str, imageBytes: bytes):
+    with open(path, "wb") as imageFile:
+        imageFile.write(imageBytes)
+
+
+async def saveMergedPlayerSubmissionLocal(player, roundCardsDir, im):
     cardPath = mergedSubmissionImagePath(roundCardsDir, player)
-    im.save(cardPath)
+    imageBytes = await lib.imageWorkers.encodeImage(im, cfg.imageEncoderProfiles[cfg.mergedSubmissionEncoderProfile])
+    await lib.imageWorkers.runImageTask(_writeImageFile, cardPath, imageBytes)
     return local_file_url(cardPath[len(cfg.paths.decksFolder):])
 
 
 async def buildMergedSubmissionsMenuImages(game: "sdbGame.SDBGame") -> Dict[sdbPlayer.SDBPlayer, str]:
-    mergedSubmissionImages = {}
-    shuffledPlayers = list(tuple(p for p in game.players))
+    shuffledPlayers = [p for p in game.players if not p.isChooser]
     random.shuffle(shuffledPlayers)
 
-    for player in shuffledPlayers:
-        if not player.isChooser:
-            mergedSubmissionImages[player] = await mergePlayerSubmissions(player)
-    
-    uploadedSubmissionsImages = {}
-
-    if cfg.cardStorageMethod == "discord":
-        storageChannel = botState.client.get_guild(cfg.cardsDCChannel["guild_id"]).get_channel(cfg.cardsDCChannel["channel_id"])
-
-        for player in mergedSubmissionImages:
-            uploadedSubmissionsImages[player] = await saveMergedPlayerSubmissionDiscord(storageChannel, mergedSubmissionImages[player])
-    
-    elif cfg.cardStorageMethod == "local":
+    if cfg.cardStorageMethod == "local":
         roundCardsDir = cfg.paths.decksFolder + os.sep + "temp" + os.sep + str(game.channel.id) + os.sep + str(game.currentRound)
         if os.path.isdir(roundCardsDir):
             shutil.rmtree(roundCardsDir)
         os.makedirs(roundCardsDir)
-
-        for player in mergedSubmissionImages:
-            uploadedSubmissionsImages[player] = saveMergedPlayerSubmissionLocal(player, roundCardsDir, mergedSubmissionImages[player])
-            
-    
-    else:
+    elif cfg.cardStorageMethod != "discord":
         raise ValueError("Unsupported cardStorageMethod: " + str(cfg.cardStorageMethod))
 
-    for img in mergedSubmissionImages.values():
-        img.close()
-
-    return uploadedSubmissionsImages
-
+    async def buildPlayerImage(player):
+        im = await mergePlayerSubmissions(player)
+        if cfg.cardStorageMethod == "local":
+            # Saved as soon as it is built, leaving nothing to do after the slowest player
+            try:
+                return await saveMergedPlayerSubmissionLocal(player, roundCardsDir, im)
+            finally:
+                im.close()
+        return im
+
+    # Players' submissions are fetched and merged concurrently, up to cfg.maxConcurrentSubmissionMerges players at a time
+    builtImages = await lib.asyncUtil.gatherBounded(cfg.maxConcurrentSubmissionMerges, (buildPlayerImage(player) for player in shuffledPlayers))
+
+    if cfg.cardStorageMethod == "local":
+        return dict(zip(shuffledPlayers, builtImages))
+
+    # Uploaded together once all are merged, so that the uploads share messages, sent cfg.maxConcurrentUploads at a time
+    mergedSubmissionImages = dict(zip(shuffledPlayers, builtImages))
+    try:
+        return await saveMergedPlayerSubmissionsDiscord(mergedSubmissionImages)
+    finally:
+        for img in mergedSubmissionImages.values():
+            img.close()
@@ -7,7 +7,7 @@ import traceback
 from .. import botState, lib
 from ..baseClasses import serializable
 from ..cfg import cfg
-from ..game import sdbGame, sdbDeck
+from ..game import sdbGame, sdbDeck, lazyRendering
 from ..reactionMenus import SDBSignupMenu
 
 
@@ -38,7 +38,6 @@ class BasedGuild(serializable.Serializable):
         self.commandPrefix = commandPrefix
         self.runningGames = runningGames
         self.decks = decks
-        self.activeDecks = {}
         self.modRoleID = modRoleID
         self.modRole = None
 
@@ -53,20 +52,20 @@ class BasedGuild(serializable.Serializable):
         if channel in self.runningGames:
             raise ValueError("Attempted to start a game in a channel which aleady contains a running game: " + channel.name + "#" + str(channel.id))
 
-        if deckName in self.activeDecks:
-            gameDeck = self.activeDecks[deckName]
-        else:
-            try:
-                gameDeck = sdbDeck.SDBDeck(self.decks[deckName]["meta_path"])
-            except RuntimeError as e:
-                gameDeck = None
-                await channel.send("An unexpected error occurred when building the deck, the error has been logged.\nPlease try playing with a different deck!")
-                botState.logger.log("BasedGuild", "startGameSignups",
-                                    "Exception occured when trying to build a deck before starting a game",
-                                    eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
+        try:
+            catalog = sdbDeck.loadCatalog(self.decks[deckName]["meta_path"], self.decks[deckName]["last_update"])
+            gameDeck = sdbDeck.SDBDeck(catalog, expansionNames)
+        except RuntimeError as e:
+            gameDeck = None
+            await channel.send("An unexpected error occurred when building the deck, the error has been logged.\nPlease try playing with a different deck!")
+            botState.logger.log("BasedGuild", "startGameSignups",
+                                "Exception occured when trying to build a deck before starting a game",
+                                eventType=type(e).__name__, trace=traceback.format_exception(type(e), e, e.__traceback__))
 
         if gameDeck is not None:
             self.runningGames[channel] = sdbGame.SDBGame(owner, gameDeck, expansionNames, channel, rounds, self)
+            if "lazy" in self.decks[deckName] and self.decks[deckName]["lazy"]:
+                lazyRendering.schedulePrerender(catalog, expansionNames, self.id)
 
             signupMsg = await channel.send("​")
             signupMenu = SDBSignupMenu.SDBSignupMenu(signupMsg, self.runningGames[channel], lib.timeUtil.timeDeltaFromDict(cfg.timeouts.gameJoinMenu))